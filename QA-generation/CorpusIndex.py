@@ -0,0 +1,209 @@
+import glob
+import json
+import os
+from typing import Callable, Dict, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+class CorpusIndex():
+    """
+    Sentence embedding index over every article in the context directory, to find the nearest source
+    articles of an answer across the whole corpus. Embeddings are normalised, so cosine similarity is a dot product.
+    Searches use a faiss HNSW index when faiss is installed, else an exact blocked matmul in numpy
+    """
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        article_ids: np.ndarray,
+        sources: List[str],
+        backend: str = "auto",
+        block_size: int = 8192
+    ):
+        """
+        Constructor for CorpusIndex
+
+        Args:
+            embeddings (np.ndarray): (num_of_sentences, dim) normalised float32 sentence embeddings
+            article_ids (np.ndarray): index within sources of each sentence's article
+            sources (List[str]): "<context_name>/<file>#<article index>" for each article
+            backend (str, optional): "auto", "hnsw" (needs faiss) or "exact". Defaults to "auto".
+            block_size (int, optional): corpus rows per matmul for exact search. Defaults to 8192.
+        """
+        if backend not in ["auto", "hnsw", "exact"]:
+            print(f"{backend} is not a supported backend, use auto, hnsw or exact")
+            exit()
+
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.article_ids = article_ids
+        self.sources = sources
+        self.block_size = block_size
+
+        self.hnsw = None
+        if backend != "exact":
+            try:
+                import faiss
+
+                self.hnsw = faiss.IndexHNSWFlat(self.embeddings.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+                self.hnsw.hnsw.efSearch = 64
+                self.hnsw.add(self.embeddings)
+            except ImportError:
+                if backend == "hnsw":
+                    print("faiss is not installed, install faiss-cpu for the hnsw backend")
+                    exit()
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    @staticmethod
+    def load_articles(context_dir: str) -> Dict[str, List[Dict]]:
+        """
+        Loads every context file, files that are not lists of articles (logs, scrape state) are skipped
+
+        Args:
+            context_dir (str): directory of the contexts, eg. ../data/context
+
+        Returns:
+            Dict[str, List[Dict]]: "<context_name>/<file>" to its articles
+        """
+        article_files: Dict[str, List[Dict]] = {}
+        for file in sorted(glob.glob(f"{context_dir}/*/*.json")):
+            with open(file, "r") as f:
+                data = json.load(f)
+            if isinstance(data, list) and len(data) > 0 and all(isinstance(item, dict) and "content" in item for item in data):
+                article_files[os.path.relpath(file, context_dir)] = data
+        return article_files
+
+    @classmethod
+    def build(
+        cls,
+        context_dir: str,
+        get_embedder: Callable[[], "SentenceTransformer"],
+        batch_size: int = 128,
+        backend: str = "auto"
+    ) -> "CorpusIndex":
+        """
+        Builds the index from every article in the context directory
+
+        Args:
+            context_dir (str): directory of the contexts, eg. ../data/context
+            get_embedder (Callable[[], SentenceTransformer]): returns the sentence transformer
+            batch_size (int, optional): batch size for embedding. Defaults to 128.
+            backend (str, optional): "auto", "hnsw" or "exact". Defaults to "auto".
+
+        Returns:
+            CorpusIndex: the built index
+        """
+        from evaluation import sent_tokenize
+        from QaGeneration import ensure_string
+
+        sources: List[str] = []
+        sentences: List[str] = []
+        article_ids: List[int] = []
+        for file, articles in cls.load_articles(context_dir).items():
+            for index, article in enumerate(articles):
+                article_sentences = [item.strip() for item in sent_tokenize(ensure_string(article["content"], " ")) if item.strip() != ""]
+                sentences += article_sentences
+                article_ids += [len(sources)] * len(article_sentences)
+                sources.append(f"{file}#{index}")
+
+        embeddings = get_embedder().encode(
+            sentences,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=True
+        )
+        return cls(embeddings, np.array(article_ids, dtype=np.int32), sources, backend=backend)
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index as <path>.npz, the hnsw graph is rebuilt on load
+
+        Args:
+            path (str): path without extension
+        """
+        np.savez(
+            f"{path}.npz",
+            embeddings=self.embeddings,
+            article_ids=self.article_ids,
+            sources=np.array(self.sources)
+        )
+
+    @classmethod
+    def load(cls, path: str, backend: str = "auto") -> "CorpusIndex":
+        """
+        Loads an index saved with save
+
+        Args:
+            path (str): path without extension
+            backend (str, optional): "auto", "hnsw" or "exact". Defaults to "auto".
+
+        Returns:
+            CorpusIndex: the loaded index
+        """
+        data = np.load(f"{path}.npz")
+        return cls(data["embeddings"], data["article_ids"], data["sources"].tolist(), backend=backend)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top k corpus sentences for each query
+
+        Args:
+            queries (np.ndarray): (num_of_queries, dim) normalised embeddings
+            k (int): number of sentences per query
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (num_of_queries, k) scores and sentence indices, best first
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(self))
+        if self.hnsw is not None:
+            return self.hnsw.search(queries, k)
+
+        # Exact search, a block of the corpus at a time, keeping a running top k
+        best_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        best_indices = np.zeros((queries.shape[0], k), dtype=np.int64)
+        for start in range(0, len(self), self.block_size):
+            block_scores = queries @ self.embeddings[start:start + self.block_size].T
+            scores = np.concatenate([best_scores, block_scores], axis=1)
+            indices = np.concatenate([
+                best_indices,
+                np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)
+            ], axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_indices = np.take_along_axis(indices, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_indices, order, axis=1)
+
+    def nearest_sources(self, queries: np.ndarray, k: int = 5, oversample: int = 4) -> List[List[Dict]]:
+        """
+        Top k distinct source articles for each query, scored by their closest sentence
+
+        Args:
+            queries (np.ndarray): (num_of_queries, dim) normalised embeddings
+            k (int, optional): number of articles per query. Defaults to 5.
+            oversample (int, optional): sentences searched per article wanted. Defaults to 4.
+
+        Returns:
+            List[List[Dict]]: {"source", "score"} for each query, best first
+        """
+        scores, indices = self.search(queries, k * oversample)
+        results: List[List[Dict]] = []
+        for query_scores, query_indices in zip(scores, indices):
+            hits: Dict[int, float] = {}
+            for score, index in zip(query_scores, query_indices):
+                if index < 0:
+                    continue
+                article_id = int(self.article_ids[index])
+                if article_id not in hits:
+                    hits[article_id] = float(score)
+                if len(hits) == k:
+                    break
+            results.append([{"source": self.sources[article_id], "score": score} for article_id, score in hits.items()])
+        return results
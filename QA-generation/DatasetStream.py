@@ -0,0 +1,340 @@
+import codecs
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import textwrap
+from typing import IO, Any, Dict, Iterable, Iterator, List, Mapping, Tuple
+
+"""
+Row by row reading and writing of datasets, so questions, answers and contexts do not have to fit in memory.
+The format is chosen by extension:
+
+.json: a json array of rows, as written by json.dump with indent 2
+.jsonl: a row per line
+.jsonl.zst: zstd compressed JSONL, needs zstandard. Rows repeat the definition and context text,
+    so these are several times smaller, and faster to read and write, than .json
+
+Rows are located by byte offset, so a run can start again from a row without reading the rows before it,
+and articles can be sampled from a context file by seeking to them. Rows skipped over are scanned for their end
+without being parsed. Compressed files are read from the start up to the offset, use PackedCorpus for random access
+"""
+
+dataset_extensions = [".jsonl.zst", ".jsonl", ".json"]
+
+zstd_level = 3
+
+# Temporary files are created with mode 600, datasets are given the mode a new file would have
+_umask = os.umask(0)
+os.umask(_umask)
+
+# Strings, which may hold brackets, and brackets. A string cut off by the end of the buffer matches without its closing quote
+_structure = re.compile(r'"(?:[^"\\]|\\.)*"?|[\[\]{}]')
+_separators = re.compile(r"[\s,]*")
+
+
+def is_jsonl(path: str) -> bool:
+    """
+    Whether the dataset at path is JSONL, from its extension
+    """
+    return path.endswith(".jsonl") or path.endswith(".jsonl.zst")
+
+
+def split_extension(path: str) -> Tuple[str, str]:
+    """
+    Splits a dataset path into the path without extension and the extension, eg. ".jsonl.zst"
+    """
+    for extension in dataset_extensions:
+        if path.endswith(extension):
+            return path[:-len(extension)], extension
+    return os.path.splitext(path)
+
+
+def open_dataset(path: str, mode: str = "rb", offset: int = 0, compressed: bool | None = None) -> IO[bytes]:
+    """
+    Opens a dataset file in binary, decompressing or compressing .zst files as a stream
+
+    Args:
+        path (str): path of the file
+        mode (str, optional): "rb" or "wb". Defaults to "rb".
+        offset (int, optional): byte offset to read from, within the decompressed data for .zst files. Defaults to 0.
+        compressed (bool | None, optional): whether the file is zstd compressed. Defaults to a .zst extension.
+
+    Returns:
+        IO[bytes]: the opened file
+    """
+    if compressed is None:
+        compressed = path.endswith(".zst")
+    if not compressed:
+        f = open(path, mode)
+        f.seek(offset)
+        return f
+
+    try:
+        import zstandard
+    except ImportError:
+        print("zstandard is not installed, install it with: pip install zstandard, to read and write .zst datasets")
+        exit()
+    if mode == "wb":
+        return zstandard.ZstdCompressor(level=zstd_level).stream_writer(open(path, "wb"), closefd=True)
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    # Decompresses up to the offset, only forward seeks are possible
+    reader.seek(offset)
+    return io.BufferedReader(reader)
+
+
+def value_end(buffer: str, position: int) -> int:
+    """
+    End of the json object or array starting at position, without parsing it
+
+    Args:
+        buffer (str): text holding the value
+        position (int): start of the value
+
+    Returns:
+        int: end of the value, -1 when the buffer ends before the value does
+    """
+    depth = 0
+    for match in _structure.finditer(buffer, position):
+        token = match.group()
+        if token[0] == '"':
+            if len(token) == 1 or token[-1] != '"':
+                return -1
+        elif token in "[{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return -1
+
+
+class DatasetReader():
+    """
+    Streams the rows of a json array or JSONL dataset, holding one chunk of the file at a time
+    """
+    def __init__(self, path: str, chunk_size: int = 1 << 20):
+        """
+        Constructor for DatasetReader
+
+        Args:
+            path (str): path of the dataset
+            chunk_size (int, optional): bytes read at a time. Defaults to 1MB.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.iter_rows()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.scan(parse_from=math.inf))
+
+    def iter_rows(self, start: int = 0, offset: int = 0) -> Iterator[Dict]:
+        """
+        Rows of the dataset, in order
+
+        Args:
+            start (int, optional): number of rows to skip, they are not parsed. Defaults to 0.
+            offset (int, optional): byte offset of a row to start from, from offsets. Defaults to the first row.
+
+        Returns:
+            Iterator[Dict]: the rows
+        """
+        for _, row in self.scan(offset, parse_from=start):
+            if row is not None:
+                yield row
+
+    def offsets(self) -> List[int]:
+        """
+        Byte offset of every row, found without parsing the rows
+        """
+        return [offset for offset, _ in self.scan(parse_from=math.inf)]
+
+    def read_at(self, offset: int) -> Dict:
+        """
+        Reads the row at a byte offset, from offsets
+
+        Raises:
+            IndexError: when there is no row at the offset
+        """
+        for row in self.iter_rows(offset=offset):
+            return row
+        raise IndexError(f"no row at offset {offset} of {self.path}")
+
+    def scan(self, offset: int = 0, parse_from: float = 0) -> Iterator[Tuple[int, Any]]:
+        """
+        Byte offset and row of every row from offset, rows before parse_from are given as None
+
+        Args:
+            offset (int, optional): byte offset to start from. Defaults to 0.
+            parse_from (float, optional): index of the first row to parse, counted from offset. Defaults to 0.
+
+        Returns:
+            Iterator[Tuple[int, Any]]: byte offset and row
+        """
+        if is_jsonl(self.path):
+            return self.scan_jsonl(offset, parse_from)
+        return self.scan_array(offset, parse_from)
+
+    def scan_jsonl(self, offset: int, parse_from: float) -> Iterator[Tuple[int, Any]]:
+        with open_dataset(self.path, "rb", offset) as f:
+            index = 0
+            for line in f:
+                if line.strip() != b"":
+                    yield offset, json.loads(line) if index >= parse_from else None
+                    index += 1
+                offset += len(line)
+
+    def scan_array(self, offset: int, parse_from: float) -> Iterator[Tuple[int, Any]]:
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        # A row offset is within the array already
+        is_opened = offset != 0
+        buffer, position, eof, index = "", 0, False, 0
+
+        with open_dataset(self.path, "rb", offset) as f:
+            while True:
+                match = _separators.match(buffer, position)
+                offset += len(match.group().encode("utf-8"))
+                position = match.end()
+
+                end = -1
+                if position < len(buffer):
+                    if not is_opened:
+                        if buffer[position] != "[":
+                            raise ValueError(f"{self.path} is not a json array")
+                        is_opened = True
+                        position += 1
+                        offset += 1
+                        continue
+                    if buffer[position] == "]":
+                        return
+
+                    row = None
+                    if index < parse_from and buffer[position] in "[{":
+                        end = value_end(buffer, position)
+                    else:
+                        try:
+                            row, end = decoder.raw_decode(buffer, position)
+                        except json.JSONDecodeError:
+                            if eof:
+                                raise
+                            end = -1
+                    # A number at the end of the buffer may continue in the next chunk
+                    if end == len(buffer) and not eof:
+                        end = -1
+
+                if end == -1:
+                    if eof:
+                        raise ValueError(f"{self.path} ends before its json array does")
+                    # Reads grow with a row that does not fit, so a large row is not parsed again for every chunk
+                    chunk = f.read(max(self.chunk_size, len(buffer) - position))
+                    eof = chunk == b""
+                    buffer = buffer[position:] + text_decoder.decode(chunk, final=eof)
+                    position = 0
+                    continue
+
+                yield offset, row if index >= parse_from else None
+                offset += len(buffer[position:end].encode("utf-8"))
+                position = end
+                index += 1
+
+
+def as_dict(row: Mapping) -> Dict:
+    """
+    The row as a dict for json, rows may be any mapping, eg. QaRecord
+    """
+    return row if isinstance(row, dict) else dict(row)
+
+
+def write_rows(path: str, rows: Iterable[Mapping]) -> int:
+    """
+    Writes the rows to path, laid out as json.dump(rows, indent=2), as JSONL, or as compressed JSONL by extension.
+    Written to a temporary file of its own first, so rows can be streamed from the file being replaced,
+    and writers of the same dataset never share a temporary file
+
+    Args:
+        path (str): path of the dataset
+        rows (Iterable[Dict]): rows to write, taken lazily, dicts or mappings such as QaRecord
+
+    Returns:
+        int: number of rows written
+    """
+    count = 0
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        with open_dataset(temp_path, "wb", compressed=path.endswith(".zst")) as f:
+            if is_jsonl(path):
+                for row in rows:
+                    f.write((json.dumps(as_dict(row)) + "\n").encode("utf-8"))
+                    count += 1
+            else:
+                for row in rows:
+                    f.write((("[\n" if count == 0 else ",\n") + textwrap.indent(json.dumps(as_dict(row), indent=2), "  ")).encode("utf-8"))
+                    count += 1
+                f.write(b"[]" if count == 0 else b"\n]")
+        os.chmod(temp_path, 0o666 & ~_umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return count
+
+
+def append_rows(path: str, rows: Iterable[Mapping]) -> int:
+    """
+    Appends rows to an uncompressed JSONL dataset, for output written as it is produced.
+    The rows are written in a single write, so a stopped run leaves at most one partial row, see trim_partial_row
+
+    Args:
+        path (str): path of the dataset, ending with .jsonl
+        rows (Iterable[Mapping]): rows to append, dicts or mappings such as QaRecord
+
+    Returns:
+        int: number of rows appended
+    """
+    if not path.endswith(".jsonl"):
+        raise ValueError(f"rows can only be appended to .jsonl datasets, not {path}")
+    lines = [json.dumps(as_dict(row)) + "\n" for row in rows]
+    with open(path, "a") as f:
+        f.write("".join(lines))
+    return len(lines)
+
+
+def trim_partial_row(path: str) -> None:
+    """
+    Drops a partial last row from an uncompressed JSONL dataset, left when a write was cut off
+    """
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # Looks back a block at a time for the newline ending the last whole row
+        while end > 0:
+            start = max(end - (1 << 16), 0)
+            f.seek(start)
+            block = f.read(end - start)
+            if end == size and block.endswith(b"\n"):
+                return
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+def load_rows(path: str) -> List[Dict]:
+    """
+    Loads every row of a dataset in any of the formats, for scripts and notebooks working on whole datasets
+
+    Args:
+        path (str): path of the dataset
+
+    Returns:
+        List[Dict]: the rows
+    """
+    return list(DatasetReader(path))
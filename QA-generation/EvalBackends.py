@@ -0,0 +1,197 @@
+import os
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from bert_score import BERTScorer
+    from sentence_transformers import SentenceTransformer
+
+"""
+Loaders for the evaluation models, with a choice of inference backend for machines without a GPU.
+The backend is set with eval_backend under file_config in the QA config, or --eval_backend for eval-server.py
+
+torch: fp32 PyTorch, on GPU when there is one
+int8: PyTorch with the linear layers dynamically quantized to int8, on CPU
+onnx: the transformer encoders exported once to ONNX and run with ONNX Runtime on CPU, needs onnxruntime
+
+Pooling and scoring stay in PyTorch for every backend, only the transformer encoders are swapped,
+so scores only differ by the numerical error of the backend. eval-drift.py measures it on stored datasets
+"""
+
+eval_backends = ["torch", "int8", "onnx"]
+
+onnx_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "complex-qa", "onnx")
+
+
+def set_num_threads(num_threads: int) -> None:
+    """
+    Sets the threads used by PyTorch on CPU, 0 keeps the default
+    """
+    import torch
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+
+def quantize(model: Any) -> Any:
+    """
+    Dynamically quantizes the linear layers of a model to int8, in place
+    """
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def onnx_encoder(model: Any, name: str, num_threads: int) -> Any:
+    """
+    Exports a transformer encoder to ONNX on first use, and returns a module running it with ONNX Runtime,
+    taking the place of the encoder within sentence transformers or bert score
+
+    Args:
+        model (Any): HuggingFace encoder, eg. MPNetModel or RobertaModel
+        name (str): name of the exported file within the onnx cache
+        num_threads (int): intra op threads for ONNX Runtime, 0 keeps the default
+
+    Returns:
+        Any: OnnxEncoder for the model
+    """
+    import torch
+
+    try:
+        import onnxruntime
+    except ImportError:
+        print("onnxruntime is not installed, install it with: pip install onnxruntime, or use eval_backend int8")
+        exit()
+
+    class LastHiddenState(torch.nn.Module):
+        """
+        Encoder with tensor inputs and output, for the export
+        """
+        def __init__(self, model: Any):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids: Any, attention_mask: Any) -> Any:
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+    os.makedirs(onnx_cache_dir, exist_ok=True)
+    onnx_path = os.path.join(onnx_cache_dir, f"{name.replace('/', '_')}.onnx")
+    if not os.path.exists(onnx_path):
+        model = model.cpu().eval()
+        example = torch.ones((1, 8), dtype=torch.long)
+        # Written to a temporary file first, so an interrupted export is not picked up later
+        torch.onnx.export(
+            LastHiddenState(model),
+            (example, example),
+            f"{onnx_path}.tmp",
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=14
+        )
+        os.replace(f"{onnx_path}.tmp", onnx_path)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads > 0:
+        session_options.intra_op_num_threads = num_threads
+    session = onnxruntime.InferenceSession(onnx_path, session_options, providers=["CPUExecutionProvider"])
+
+    class OnnxEncoder(torch.nn.Module):
+        """
+        Runs the exported encoder, called the same way as the HuggingFace model it replaces
+        """
+        def __init__(self, session: Any, config: Any):
+            super().__init__()
+            self.session = session
+            self.config = config
+
+        def forward(self, input_ids: Any, attention_mask: Any = None, **kwargs) -> Any:
+            if attention_mask is None:
+                attention_mask = torch.ones_like(input_ids)
+            (last_hidden_state,) = self.session.run(None, {
+                "input_ids": input_ids.cpu().numpy(),
+                "attention_mask": attention_mask.cpu().numpy()
+            })
+            return (torch.from_numpy(last_hidden_state),)
+
+    return OnnxEncoder(session, model.config)
+
+
+def load_embedder(
+    eval_backend: str = "torch",
+    num_threads: int = 0,
+    embedder_name: str = "all-mpnet-base-v2",
+    device: str | None = None
+) -> "SentenceTransformer":
+    """
+    Loads the sentence transformer with the given backend
+
+    Args:
+        eval_backend (str, optional): "torch", "int8" or "onnx". Defaults to "torch".
+        num_threads (int, optional): CPU threads, 0 keeps the default. Defaults to 0.
+        embedder_name (str, optional): sentence transformer model. Defaults to "all-mpnet-base-v2".
+        device (str | None, optional): device for the torch backend, picked automatically when None. Defaults to None.
+
+    Returns:
+        SentenceTransformer: the embedder
+    """
+    from sentence_transformers import SentenceTransformer
+
+    check_backend(eval_backend)
+    set_num_threads(num_threads)
+    if eval_backend == "torch":
+        return SentenceTransformer(embedder_name, device=device)
+
+    embedder = SentenceTransformer(embedder_name, device="cpu")
+    transformer = embedder._first_module()
+    if eval_backend == "int8":
+        quantize(embedder)
+    else:
+        transformer.auto_model = onnx_encoder(transformer.auto_model, embedder_name, num_threads)
+    return embedder
+
+
+def load_scorer(
+    eval_backend: str = "torch",
+    num_threads: int = 0,
+    device: str | None = None
+) -> "BERTScorer":
+    """
+    Loads the bert scorer, roberta-large rescaled with the english baseline, with the given backend
+
+    Args:
+        eval_backend (str, optional): "torch", "int8" or "onnx". Defaults to "torch".
+        num_threads (int, optional): CPU threads, 0 keeps the default. Defaults to 0.
+        device (str | None, optional): device for the torch backend, picked automatically when None. Defaults to None.
+
+    Returns:
+        BERTScorer: the scorer
+    """
+    from bert_score import BERTScorer
+
+    check_backend(eval_backend)
+    set_num_threads(num_threads)
+    if eval_backend == "torch":
+        return BERTScorer(lang="en", rescale_with_baseline=True, device=device)
+
+    scorer = BERTScorer(lang="en", rescale_with_baseline=True, device="cpu")
+    if eval_backend == "int8":
+        scorer._model = quantize(scorer._model)
+    else:
+        # bert score keeps only the layers it scores with, so the exported encoder outputs that layer
+        scorer._model = onnx_encoder(scorer._model, f"{scorer.model_type}_{scorer.num_layers}", num_threads)
+    return scorer
+
+
+def check_backend(eval_backend: str) -> None:
+    """
+    Exits when the backend is not supported
+    """
+    if eval_backend not in eval_backends:
+        print(f"{eval_backend} is not a supported evaluation backend, use {', '.join(eval_backends)}")
+        exit()
+
@@ -0,0 +1,385 @@
+import base64
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+"""
+Local evaluation service. The sentence transformer and the bert scorer are loaded once by eval-server.py,
+and every process evaluating on the same machine sends its score requests over a Unix socket.
+Requests from all clients are gathered into dynamic batches, up to max_batch_size texts or max_wait seconds,
+so concurrent runs share forward passes instead of each holding its own copy of the models.
+
+Messages are a 4 byte big endian length followed by a json body
+"""
+
+_header = struct.Struct(">I")
+
+
+def send_message(connection: socket.socket, message: Dict) -> None:
+    """
+    Sends a length prefixed json message
+    """
+    data = json.dumps(message).encode("utf-8")
+    connection.sendall(_header.pack(len(data)) + data)
+
+
+def recv_exact(connection: socket.socket, size: int) -> bytes:
+    """
+    Reads exactly size bytes, raises ConnectionError when the other side closes
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("eval server connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(connection: socket.socket) -> Dict:
+    """
+    Reads a length prefixed json message
+    """
+    (size,) = _header.unpack(recv_exact(connection, _header.size))
+    return json.loads(recv_exact(connection, size))
+
+
+def encode_array(array: np.ndarray) -> Dict:
+    """
+    Packs a float32 array into a json serialisable dict
+    """
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(packed: Dict) -> np.ndarray:
+    """
+    Unpacks an array packed by encode_array
+    """
+    return np.frombuffer(base64.b64decode(packed["data"]), dtype=np.float32).reshape(packed["shape"])
+
+
+class Batcher():
+    """
+    Gathers requests for a single model into dynamic batches, run one at a time on a worker thread
+    """
+    def __init__(self, run_batch: Any, max_batch_size: int, max_wait: float):
+        """
+        Constructor for Batcher
+
+        Args:
+            run_batch (Any): function taking the list of request payloads, returning a result per payload
+            max_batch_size (int): max texts in a batch
+            max_wait (float): max seconds the first request of a batch waits for others
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.requests: queue.Queue = queue.Queue()
+        self.batch_sizes: List[int] = []
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, payload: Dict, size: int) -> Any:
+        """
+        Queues a payload of size texts and waits for its result
+        """
+        future: Future = Future()
+        self.requests.put((payload, size, future))
+        return future.result()
+
+    def next_batch(self) -> List[Tuple[Dict, int, Future]]:
+        """
+        Waits for a request, then gathers more until the batch is full or max_wait has passed
+        """
+        batch = [self.requests.get()]
+        size = batch[0][1]
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += request[1]
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            self.batch_sizes.append(sum(size for _, size, _ in batch))
+            try:
+                results = self.run_batch([payload for payload, _, _ in batch])
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+
+class EvalServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix socket server holding the evaluation models, each client connection is served on its own thread
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str,
+        embedder_name: str = "all-mpnet-base-v2",
+        max_batch_size: int = 64,
+        max_wait: float = 0.01,
+        device: str | None = None,
+        eval_backend: str = "torch",
+        num_threads: int = 0
+    ):
+        """
+        Constructor for EvalServer, loads the models
+
+        Args:
+            socket_path (str): path of the Unix socket to listen on
+            embedder_name (str, optional): sentence transformer model. Defaults to "all-mpnet-base-v2".
+            max_batch_size (int, optional): max texts in a batch. Defaults to 64.
+            max_wait (float, optional): max seconds a request waits for a batch to fill. Defaults to 0.01.
+            device (str | None, optional): device for the models, picked by the libraries when None. Defaults to None.
+            eval_backend (str, optional): "torch", "int8" or "onnx", see EvalBackends. Defaults to "torch".
+            num_threads (int, optional): CPU threads for the models, 0 keeps the default. Defaults to 0.
+        """
+        from EvalBackends import load_embedder, load_scorer
+        from evaluation import Evaluation
+        from ReferenceScorer import ReferenceScorer
+
+        Evaluation.quiet_transformers()
+        self.max_batch_size = max_batch_size
+        self.embedder_name = embedder_name
+        self.eval_backend = eval_backend
+        self.embedder = load_embedder(eval_backend, num_threads, embedder_name, device)
+        self.scorer = load_scorer(eval_backend, num_threads, device)
+        # Shared by every client, so an article scored by one run is reused by the others
+        self.reference_scorer = ReferenceScorer(self.scorer)
+
+        self.batchers = {
+            "encode": Batcher(self.encode_batch, max_batch_size, max_wait),
+            "bert_score": Batcher(self.bert_score_batch, max_batch_size, max_wait),
+            "bert_score_window": Batcher(self.bert_score_window_batch, max_batch_size, max_wait)
+        }
+        super().__init__(socket_path, EvalHandler)
+
+    def encode_batch(self, payloads: List[Dict]) -> List[Dict]:
+        """
+        Embeds the sentences of every request in one pass
+        """
+        sentences = [sentence for payload in payloads for sentence in payload["sentences"]]
+        embeddings = self.embedder.encode(sentences, convert_to_numpy=True, batch_size=self.max_batch_size)
+
+        results, start = [], 0
+        for payload in payloads:
+            end = start + len(payload["sentences"])
+            results.append({"embeddings": encode_array(embeddings[start:end])})
+            start = end
+        return results
+
+    def bert_score_batch(self, payloads: List[Dict]) -> List[Dict]:
+        """
+        Scores the candidates of every request in one pass, each candidate against its list of references
+        """
+        cands = [cand for payload in payloads for cand in payload["cands"]]
+        # A single reference is scored as a list of one, which gives the same score
+        refs = [ref if isinstance(ref, list) else [ref] for payload in payloads for ref in payload["refs"]]
+        P, R, F1 = self.scorer.score(cands, refs, batch_size=self.max_batch_size)
+
+        results, start = [], 0
+        for payload in payloads:
+            end = start + len(payload["cands"])
+            results.append({
+                "P": P[start:end].tolist(),
+                "R": R[start:end].tolist(),
+                "F1": F1[start:end].tolist()
+            })
+            start = end
+        return results
+
+    def bert_score_window_batch(self, payloads: List[Dict]) -> List[Dict]:
+        """
+        Scores the candidate sentences of every request against its reference window, see ReferenceScorer
+        """
+        F1_list = self.reference_scorer.score_windows(
+            [(payload["cand_window"], payload["ref_window"]) for payload in payloads])
+        return [{"F1": F1} for F1 in F1_list]
+
+    def handle_request(self, request: Dict) -> Dict:
+        """
+        Answers a single request from a client
+        """
+        if request["type"] == "ping":
+            return {"ok": True, "embedder_name": self.embedder_name, "eval_backend": self.eval_backend}
+        if request["type"] == "stats":
+            stats: Dict[str, Any] = {name: batcher.batch_sizes[-1000:] for name, batcher in self.batchers.items()}
+            stats["references"] = self.reference_scorer.get_stats()
+            return stats
+        if request["type"] == "encode":
+            return self.batchers["encode"].submit(request, len(request["sentences"]))
+        if request["type"] == "bert_score":
+            return self.batchers["bert_score"].submit(request, len(request["cands"]))
+        if request["type"] == "bert_score_window":
+            return self.batchers["bert_score_window"].submit(request, len(request["cand_window"]))
+        raise ValueError(f"unknown request type {request['type']}")
+
+
+class EvalHandler(socketserver.BaseRequestHandler):
+    """
+    Serves the requests of a single client connection, one at a time
+    """
+    server: EvalServer
+
+    def handle(self) -> None:
+        while True:
+            try:
+                request = recv_message(self.request)
+            except ConnectionError:
+                return
+            try:
+                response = self.server.handle_request(request)
+            except Exception as e:
+                response = {"error": str(e)}
+            send_message(self.request, response)
+
+
+class EvalClient():
+    """
+    Client for EvalServer, with a connection per thread
+    """
+    def __init__(self, socket_path: str):
+        """
+        Constructor for EvalClient
+
+        Args:
+            socket_path (str): path of the Unix socket the server listens on
+        """
+        self.socket_path = socket_path
+        self.local = threading.local()
+
+    def connection(self) -> socket.socket:
+        if getattr(self.local, "connection", None) is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.socket_path)
+            self.local.connection = connection
+        return self.local.connection
+
+    def request(self, message: Dict) -> Dict:
+        """
+        Sends a request and waits for the response
+
+        Raises:
+            RuntimeError: when the server fails to answer the request
+        """
+        connection = self.connection()
+        try:
+            send_message(connection, message)
+            response = recv_message(connection)
+        except OSError:
+            connection.close()
+            self.local.connection = None
+            raise
+        if "error" in response:
+            raise RuntimeError(f"eval server: {response['error']}")
+        return response
+
+    def ping(self) -> bool:
+        """
+        Checks that the server is up
+        """
+        try:
+            return self.request({"type": "ping"}).get("ok", False)
+        except OSError:
+            return False
+
+    def server_models(self) -> Dict:
+        """
+        Embedder name and evaluation backend of the server, the version of the metrics it scores
+        """
+        response = self.request({"type": "ping"})
+        return {"embedder_name": response.get("embedder_name", "all-mpnet-base-v2"), "eval_backend": response.get("eval_backend", "torch")}
+
+
+class RemoteEmbedder():
+    """
+    Stands in for SentenceTransformer in Evaluation, embedding through the eval server
+    """
+    # Sentences per request, so large inputs are sent in pieces that batch with other clients
+    request_size = 256
+
+    def __init__(self, client: EvalClient):
+        self.client = client
+
+    def encode(
+        self,
+        sentences: str | List[str],
+        convert_to_tensor: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> Any:
+        """
+        Same as SentenceTransformer.encode, batch_size and progress options are left to the server
+        """
+        single = isinstance(sentences, str)
+        sentence_list = [sentences] if single else list(sentences)
+
+        embedding_list = [
+            decode_array(self.client.request({
+                "type": "encode",
+                "sentences": sentence_list[start:start + self.request_size]
+            })["embeddings"])
+            for start in range(0, len(sentence_list), self.request_size)
+        ]
+        embeddings = np.concatenate(embedding_list) if len(embedding_list) > 0 else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if single:
+            embeddings = embeddings[0]
+
+        if convert_to_tensor:
+            import torch
+
+            return torch.from_numpy(embeddings.copy())
+        return embeddings
+
+
+class RemoteScorer():
+    """
+    Stands in for BERTScorer in Evaluation, scoring through the eval server
+    """
+    def __init__(self, client: EvalClient):
+        self.client = client
+
+    def score(self, cands: List[str], refs: List[str] | List[List[str]], **kwargs) -> Tuple[Any, Any, Any]:
+        """
+        Same as BERTScorer.score, returns precision, recall and F1 tensors
+        """
+        import torch
+
+        response = self.client.request({"type": "bert_score", "cands": list(cands), "refs": list(refs)})
+        return torch.tensor(response["P"]), torch.tensor(response["R"]), torch.tensor(response["F1"])
+
+    def score_window(self, cand_window: List[str], ref_window: List[str]) -> List[float]:
+        """
+        Same as ReferenceScorer.score_window, with the reference embeddings cached on the server
+        """
+        response = self.client.request({
+            "type": "bert_score_window",
+            "cand_window": list(cand_window),
+            "ref_window": list(ref_window)
+        })
+        return response["F1"]
@@ -0,0 +1,475 @@
+import ast
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Tuple
+
+import yaml
+
+"""
+Runs the end to end experiment, question generation -> close and open book QA -> perplexity -> notebooks,
+from a declarative config, see configs/experiment.yaml. Each stage is a command with the files it reads (inputs)
+and the files it writes (outputs). A stage depends on the stages writing its inputs, and stages whose dependencies
+are done run in parallel.
+
+The hash of a stage covers its command and env, the script it runs with the modules it imports from its directory,
+the content of every input, the QA config section of its model and the sections shared by every model, eg. file_config. Hashes are recorded in a state file when a stage succeeds, and a stage is only run again when its hash
+changed or an output is missing. Inputs are hashed by their content when a stage is about to run, so a stage run
+again that writes the same files leaves the stages after it untouched. Stages only write their own outputs,
+a file is never written by two stages, nor read and written by the same stage.
+
+Stages are expanded over the grid, a stage using {context_name} runs once for every context_name in the grid.
+A grid entry of mappings sets several placeholders together, eg. a context_name with its context_file_name.
+Placeholders listed under gather are expanded within the inputs instead, so the stage reads every file of the grid.
+They are expanded the same way within env values, joined with os.pathsep, eg. to pass the files of the grid to a notebook
+"""
+
+_placeholder = re.compile(r"\{(\w+)\}")
+
+
+class Stage():
+    """
+    A single command of the experiment, with the files it reads and writes
+    """
+    def __init__(
+        self,
+        name: str,
+        command: List[str],
+        inputs: List[str],
+        outputs: List[str],
+        script: str = "",
+        modules: List[str] | None = None,
+        model: Any = None,
+        cwd: str = "."
+    ):
+        """
+        Constructor for Stage
+
+        Args:
+            name (str): unique name, with the grid values of the stage, eg. close_book[nyt,vicuna-13b-v1.3]
+            command (List[str]): command to run
+            inputs (List[str]): files read by the command
+            outputs (List[str]): files written by the command
+            script (str, optional): python script run by the command, hashed with the stage. Defaults to "".
+            modules (List[str] | None, optional): modules imported by the script, hashed with the stage. Defaults to None.
+            model (Any, optional): QA config sections of the models used, hashed with the stage. Defaults to None.
+            cwd (str, optional): directory to run the command in. Defaults to ".".
+        """
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.script = script
+        self.modules = modules if modules is not None else []
+        self.model = model
+        self.cwd = cwd
+        self.env: Dict[str, str] = {}
+        self.dependencies: List[str] = []
+
+
+def substitute(value: Any, values: Dict[str, str]) -> Any:
+    """
+    Replaces the {name} placeholders of the grid in every string within value
+    """
+    if isinstance(value, str):
+        return _placeholder.sub(lambda match: values.get(match.group(1), match.group(0)), value)
+    if isinstance(value, list):
+        return [substitute(item, values) for item in value]
+    if isinstance(value, dict):
+        return {key: substitute(item, values) for key, item in value.items()}
+    return value
+
+
+def placeholders(value: Any) -> List[str]:
+    """
+    Names of the placeholders within value, in order of appearance
+    """
+    names: List[str] = []
+    for name in _placeholder.findall(json.dumps(value)):
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def script_modules(script: str) -> List[str]:
+    """
+    Modules of the directory of a script imported by it, directly or through each other, eg. QaController.
+    Imports within functions are included, as the scripts import their heavier modules on first use
+
+    Args:
+        script (str): path of the script
+
+    Returns:
+        List[str]: paths of the modules
+    """
+    directory = os.path.dirname(script)
+    modules: List[str] = []
+    pending = [script]
+    while len(pending) > 0:
+        with open(pending.pop(), "r") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = os.path.normpath(os.path.join(directory, f"{name.split('.')[0]}.py"))
+                if path != script and path not in modules and os.path.exists(path):
+                    modules.append(path)
+                    pending.append(path)
+    return sorted(modules)
+
+
+def script_command(python: str, script: str, args: Dict[str, Any]) -> List[str]:
+    """
+    Command line for a python script of this repo, flags False are left out as the scripts parse bools with type=bool
+
+    Args:
+        python (str): python executable
+        script (str): path of the script
+        args (Dict[str, Any]): arguments, without the leading --
+
+    Returns:
+        List[str]: the command
+    """
+    command = [python, script]
+    for key, value in args.items():
+        if value is False or value is None:
+            continue
+        if isinstance(value, list):
+            value = ",".join(str(item) for item in value)
+        command += [f"--{key}", str(value)]
+    return command
+
+
+class ExperimentPipeline():
+    """
+    Incremental runner for the stages of an experiment
+    """
+    def __init__(self, config_path: str, force: bool = False, max_parallel: int = 0):
+        """
+        Constructor for ExperimentPipeline, expands the stages over the grid and links them by their files
+
+        Args:
+            config_path (str): path of the experiment config, paths within it are relative to where the runner is started
+            force (bool, optional): When True, every stage is run whether or not it is stale. Defaults to False.
+            max_parallel (int, optional): stages run at once, 0 to use max_parallel in the config. Defaults to 0.
+        """
+        try:
+            with open(config_path, "r") as f:
+                self.config = yaml.safe_load(f)
+        except Exception as e:
+            print(str(e))
+            print("--experiment_config only takes in a yaml config file")
+            sys.exit()
+
+        self.force = force
+        self.max_parallel = max(max_parallel or self.config.get("max_parallel", 1), 1)
+        self.python = self.config.get("python", sys.executable)
+        self.logs_dir = self.config.get("logs_dir", "../data/generations/logs/experiment")
+        self.state_path = self.config.get("state_path", f"{self.logs_dir}/experiment_state.json")
+
+        self.qa_config: Dict[str, Any] = {}
+        if self.config.get("qa_config", "") != "":
+            with open(self.config["qa_config"], "r") as f:
+                self.qa_config = yaml.safe_load(f)
+        # Sections of the QA config other than the models, eg. file_config, read by every stage.
+        # Models are recognised by openai_localhost, which every model needs
+        self.shared_qa_config = {
+            key: value for key, value in self.qa_config.items()
+            if not (isinstance(value, dict) and "openai_localhost" in value)
+        }
+
+        self.stages = self.expand_stages()
+        self.order = self.link_stages()
+
+        self.state: Dict[str, Dict] = {"stages": {}, "files": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+
+    def expand_stages(self) -> Dict[str, Stage]:
+        """
+        Stages of the config, one for every combination of the grid values they use
+
+        Returns:
+            Dict[str, Stage]: stages by name
+        """
+        # Values of each grid entry, as the placeholders they set
+        options: Dict[str, List[Dict[str, str]]] = {
+            key: [
+                {name: str(item) for name, item in value.items()} if isinstance(value, dict) else {key: str(value)}
+                for value in values
+            ]
+            for key, values in self.config.get("grid", {}).items()
+        }
+        entries = {name: key for key, values in options.items() for value in values for name in value}
+        common_inputs: List[str] = self.config.get("inputs", [])
+
+        stages: Dict[str, Stage] = {}
+        modules: Dict[str, List[str]] = {}
+        for spec in self.config["stages"]:
+            gathered: List[str] = spec.get("gather", [])
+            missing = [name for name in placeholders(spec) if name not in entries]
+            if len(missing) > 0:
+                print(f"stage {spec['name']} uses {', '.join(missing)}, which are not in the grid")
+                sys.exit()
+            names = [name for name in placeholders(spec) if name not in gathered]
+            keys = list(dict.fromkeys(entries[name] for name in names))
+
+            for combination in itertools.product(*[options[key] for key in keys]):
+                values = {name: value for option in combination for name, value in option.items() if name in names}
+                expanded = substitute(spec, values)
+                expanded["inputs"] = self.gather_inputs(expanded.get("inputs", []), options, entries)
+                name = spec["name"] if len(names) == 0 else f"{spec['name']}[{','.join(values[name] for name in names)}]"
+                if name in stages:
+                    print(f"stage {name} is defined more than once")
+                    sys.exit()
+
+                script = expanded.get("script", "")
+                if script != "":
+                    command = script_command(self.python, script, expanded.get("args", {}))
+                else:
+                    command = expanded["command"]
+                    command = shlex.split(command) if isinstance(command, str) else [str(item) for item in command]
+
+                # Sections of the QA config for the models of the stage, so a change to a model reruns its stages
+                model_names = str(expanded.get("args", {}).get("model_name", ""))
+                model = {
+                    model_name.strip(): self.qa_config.get(model_name.strip(), None)
+                    for model_name in model_names.split(",") if model_name.strip() != ""
+                }
+
+                cwd = expanded.get("cwd", ".")
+                script = os.path.normpath(os.path.join(cwd, script)) if script != "" else ""
+                if script != "" and script not in modules:
+                    modules[script] = script_modules(script) if os.path.exists(script) else []
+                stages[name] = Stage(
+                    name=name,
+                    command=command,
+                    inputs=[os.path.normpath(path) for path in common_inputs + expanded.get("inputs", [])],
+                    outputs=[os.path.normpath(path) for path in expanded.get("outputs", [])],
+                    script=script,
+                    modules=modules.get(script, None),
+                    model=model if len(model) > 0 else None,
+                    cwd=cwd
+                )
+                stages[name].env = {
+                    key: os.pathsep.join(self.gather_inputs([str(value)], options, entries))
+                    for key, value in expanded.get("env", {}).items()
+                }
+        return stages
+
+    @staticmethod
+    def gather_inputs(
+        inputs: List[str],
+        options: Dict[str, List[Dict[str, str]]],
+        entries: Dict[str, str]
+    ) -> List[str]:
+        """
+        Expands the placeholders left in the inputs of a stage over every value of the grid
+
+        Args:
+            inputs (List[str]): input paths, with the placeholders of the stage already replaced
+            options (Dict[str, List[Dict[str, str]]]): values of each grid entry
+            entries (Dict[str, str]): grid entry setting each placeholder
+
+        Returns:
+            List[str]: the paths, each once
+        """
+        paths: List[str] = []
+        for path in inputs:
+            keys = list(dict.fromkeys(entries[name] for name in placeholders(path)))
+            for combination in itertools.product(*[options[key] for key in keys]):
+                paths.append(substitute(path, {name: value for option in combination for name, value in option.items()}))
+        return list(dict.fromkeys(paths))
+
+    def link_stages(self) -> List[str]:
+        """
+        Links every stage to the stages writing its inputs
+
+        Returns:
+            List[str]: names of the stages, each after the stages it depends on
+        """
+        producers: Dict[str, str] = {}
+        for stage in self.stages.values():
+            for path in stage.outputs:
+                if path in producers:
+                    print(f"{path} is written by both {producers[path]} and {stage.name}, a file can only be the output of one stage")
+                    sys.exit()
+                if path in stage.inputs:
+                    print(f"{path} is both an input and an output of {stage.name}, write it to a new file instead")
+                    sys.exit()
+                producers[path] = stage.name
+
+        for stage in self.stages.values():
+            stage.dependencies = sorted({producers[path] for path in stage.inputs if path in producers})
+
+        # Kahn's algorithm, stages keep the order of the config where they can
+        order: List[str] = []
+        remaining = list(self.stages.keys())
+        while len(remaining) > 0:
+            ready = [name for name in remaining if all(dependency in order for dependency in self.stages[name].dependencies)]
+            if len(ready) == 0:
+                print(f"stages {', '.join(remaining)} depend on each other")
+                sys.exit()
+            order += ready
+            remaining = [name for name in remaining if name not in ready]
+        return order
+
+    def file_hash(self, path: str) -> str:
+        """
+        sha256 of a file, reused from the state while the file keeps its size and modification time
+        """
+        stat = os.stat(path)
+        cached = self.state["files"].get(path, None)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        self.state["files"][path] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def stage_hash(self, stage: Stage) -> str:
+        """
+        Hash of everything the outputs of a stage depend on, its command, env, script and its modules, inputs,
+        models and the QA config shared by the models
+        """
+        content = {
+            "command": stage.command[1:] if stage.script != "" else stage.command,
+            "env": stage.env,
+            "script": self.file_hash(stage.script) if stage.script != "" and os.path.exists(stage.script) else "",
+            "modules": {path: self.file_hash(path) for path in stage.modules},
+            "inputs": {path: self.file_hash(path) for path in stage.inputs},
+            "model": stage.model,
+            "qa_config": self.shared_qa_config
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_stale(self, stage: Stage, stage_hash: str) -> bool:
+        """
+        Whether a stage has to run, its hash changed since it last succeeded or one of its outputs is missing
+        """
+        if self.force:
+            return True
+        record = self.state["stages"].get(stage.name, None)
+        if record is None or record["hash"] != stage_hash:
+            return True
+        return any(not os.path.exists(path) for path in stage.outputs)
+
+    def save_state(self) -> None:
+        """
+        Writes the hashes of the stages that succeeded, through a temporary file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        with open(f"{self.state_path}.tmp", "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    def run_stage(self, stage: Stage) -> int:
+        """
+        Runs the command of a stage, its output is written to a log file per stage
+
+        Returns:
+            int: exit code of the command
+        """
+        os.makedirs(self.logs_dir, exist_ok=True)
+        log_name = re.sub(r"[^\w.-]+", "_", stage.name)
+        log_path = f"{self.logs_dir}/{log_name}.log"
+        with open(log_path, "w") as log:
+            log.write(f"{datetime.datetime.now()}: {shlex.join(stage.command)}\n")
+            log.flush()
+            try:
+                return subprocess.run(
+                    stage.command,
+                    cwd=stage.cwd,
+                    env={**os.environ, **stage.env},
+                    stdout=log,
+                    stderr=subprocess.STDOUT
+                ).returncode
+            except OSError as e:
+                log.write(f"{str(e)}\n")
+                return 1
+
+    def run(self, dry_run: bool = False) -> Dict[str, str]:
+        """
+        Runs the stale stages, each once the stages it depends on are done, up to max_parallel at once.
+        Stages after a failed stage are skipped
+
+        Args:
+            dry_run (bool, optional): When True, stale stages are listed without running them. Defaults to False.
+
+        Returns:
+            Dict[str, str]: status of every stage, "fresh", "done", "failed" or "skipped", "stale" for a dry run
+        """
+        status: Dict[str, str] = {}
+        pending = list(self.order)
+        running: Dict[Future, Tuple[Stage, str]] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    dependency_status = [status.get(dependency, "") for dependency in stage.dependencies]
+                    if any(item in ["failed", "skipped"] for item in dependency_status):
+                        status[name] = "skipped"
+                    elif not all(item in ["fresh", "done", "stale"] for item in dependency_status):
+                        continue
+                    elif dry_run and "stale" in dependency_status:
+                        # Inputs are not written yet, so the stage would run after them
+                        status[name] = "stale"
+                    elif any(not os.path.exists(path) for path in stage.inputs):
+                        missing = [path for path in stage.inputs if not os.path.exists(path)]
+                        print(f"{name}: missing inputs {', '.join(missing)}")
+                        status[name] = "failed"
+                    else:
+                        stage_hash = self.stage_hash(stage)
+                        if not self.is_stale(stage, stage_hash):
+                            status[name] = "fresh"
+                        elif dry_run:
+                            status[name] = "stale"
+                        else:
+                            print(f"{name}: running {shlex.join(stage.command)}")
+                            running[executor.submit(self.run_stage, stage)] = (stage, stage_hash)
+                            status[name] = "running"
+                    pending.remove(name)
+                    if status[name] != "running":
+                        print(f"{name}: {status[name]}")
+
+                if len(running) == 0:
+                    continue
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, stage_hash = running.pop(future)
+                    missing = [path for path in stage.outputs if not os.path.exists(path)]
+                    if future.result() != 0 or len(missing) > 0:
+                        status[stage.name] = "failed"
+                        reason = f"exit code {future.result()}" if future.result() != 0 else f"missing outputs {', '.join(missing)}"
+                        print(f"{stage.name}: failed, {reason}, see the log in {self.logs_dir}")
+                        continue
+
+                    status[stage.name] = "done"
+                    self.state["stages"][stage.name] = {
+                        "hash": stage_hash,
+                        "outputs": {path: self.file_hash(path) for path in stage.outputs},
+                        "finished": str(datetime.datetime.now())
+                    }
+                    self.save_state()
+                    print(f"{stage.name}: done")
+
+        if not dry_run:
+            self.save_state()
+        return status
@@ -1,5 +1,8 @@
+import hashlib
 import json
-from typing import List, Dict
+import os
+import threading
+from typing import List, Dict, Any
 from datetime import datetime
 
 
@@ -7,9 +10,21 @@ class HandleExceptions():
     """
     Class to represent a single list of exceptions to be logged
     """
-    def __init__(self):
+    def __init__(self, name: str = "", collated_exceptions: "CollatedExceptions | None" = None):
+        """
+        Constructor for HandleExceptions
+
+        Args:
+            name (str, optional): name of the generation the exceptions belong to. Defaults to "".
+            collated_exceptions (CollatedExceptions | None, optional): sink that each exception is appended to. Defaults to None.
+        """
+        self.name = name
+        self.collated_exceptions = collated_exceptions
+
+        # Only kept in memory without a CollatedExceptions, which has them in its error log
         self.exceptions: List[Dict] = []
         self.number_of_fails: int = 0
+        self.lock = threading.Lock()
 
     def __str__(self):
         """
@@ -19,7 +34,8 @@ class HandleExceptions():
 
     def store_exceptions(self, content: Dict, exception: str) -> None:
         """
-        stores an exception instance
+        stores an exception instance. When part of a CollatedExceptions, the exception is appended
+        to its error log straight away, with large payloads stored once by content hash, and not kept in memory
 
         Args:
             content (Dict): descriptor for the exception
@@ -27,36 +43,53 @@ class HandleExceptions():
         """
         content["error"] = exception
 
-        self.exceptions.append(content)
-        self.number_of_fails += 1
+        if self.collated_exceptions is not None:
+            # Counted by append_failure, together with the line written to the error log
+            self.collated_exceptions.append_failure(self.name, content)
+            return
+
+        with self.lock:
+            self.exceptions.append(content)
+            self.number_of_fails += 1
 
     def get_exceptions(self) -> List:
         """
-        returns all stored exceptions
+        returns the exceptions stored in memory, see the error log of the CollatedExceptions otherwise
         """
         return self.exceptions
 
-    def combine_num_of_fails(self) -> None:
+    def combine_num_of_fails(self) -> List[Dict]:
         """
-        add the number of fails to the front of the list
+        returns the stored exceptions, with the number of fails at the front of the list
         """
-        self.exceptions = [
-            {"number of fails": self.number_of_fails}] + self.exceptions
+        return [{"number of fails": self.number_of_fails}] + self.exceptions
 
 
 class CollatedExceptions():
     """
     Collated list of HandleExceptions. HandleExceptions represent a list of exceptions for a single generation.
+    Every exception is appended once to a JSONL error log, text larger than payload_limit is stored once
+    under error_payloads/ by its sha256 and referenced from the log.
     """
-    def __init__(self, directory: str):
+    def __init__(self, directory: str, payload_limit: int = 256):
         """
         Contructor for CollatedExceptions
 
         Args:
             directory (str): Directory to store the exceptions
+            payload_limit (int, optional): Characters above which a field is stored by content hash. Defaults to 256.
         """
         self.file_path: str = self.generate_file_path(directory)
+        self.summary_path: str = self.file_path.replace("error_log_", "error_summary_").replace(".jsonl", ".json")
+        self.payload_dir: str = f"{directory}/error_payloads"
+        self.payload_limit = payload_limit
+
         self.collated_exceptions: Dict[str, HandleExceptions] = {}
+        self.stored_payloads: set[str] = set()
+        self.summary_changed: bool = False
+
+        # Exceptions are stored from the worker threads of the QA pipelines
+        self.lock = threading.RLock()
 
     def generate_file_path(self, directory: str) -> str:
         """
@@ -71,7 +104,7 @@ class CollatedExceptions():
         current_datetime = datetime.now()
         formatted_datetime = current_datetime.strftime("%Y-%m-%d-%H:%M:%S")
 
-        return f"{directory}/error_log_{formatted_datetime}.json"
+        return f"{directory}/error_log_{formatted_datetime}.jsonl"
 
     def create_exception(self, name: str) -> HandleExceptions:
         """
@@ -83,10 +116,12 @@ class CollatedExceptions():
         Returns:
             HandleExceptions: Returns the HandleException stored
         """
-        if name not in self.collated_exceptions:
-            self.collated_exceptions[name] = HandleExceptions()
+        with self.lock:
+            if name not in self.collated_exceptions:
+                self.collated_exceptions[name] = HandleExceptions(
+                    name=name, collated_exceptions=self)
 
-        return self.collated_exceptions[name]
+            return self.collated_exceptions[name]
 
     def new_handle_exception(self, result_key: str, action: str, model_name: str) -> HandleExceptions:
         """
@@ -105,14 +140,70 @@ class CollatedExceptions():
 
         return handle_exceptions
 
+    def store_payload(self, value: Any) -> Any:
+        """
+        Stores a large payload once by its content hash
+
+        Args:
+            value (Any): field of an exception
+
+        Returns:
+            Any: the value itself if small, else a reference to the stored payload
+        """
+        text = value if isinstance(value, str) else json.dumps(value)
+        if len(text) <= self.payload_limit:
+            return value
+
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            if digest not in self.stored_payloads:
+                os.makedirs(self.payload_dir, exist_ok=True)
+                payload_path = f"{self.payload_dir}/{digest}.txt"
+                if not os.path.exists(payload_path):
+                    with open(payload_path, "w") as f:
+                        f.write(text)
+                self.stored_payloads.add(digest)
+
+        return {"sha256": digest, "length": len(text)}
+
+    def append_failure(self, name: str, content: Dict) -> Dict:
+        """
+        Appends a single exception to the error log, and counts it as a fail of its generation
+
+        Args:
+            name (str): name of the generation the exception belongs to
+            content (Dict): descriptor for the exception, including the error
+
+        Returns:
+            Dict: the exception as logged, with large payloads replaced by references
+        """
+        event = {
+            "time": datetime.now().isoformat(),
+            "generation": name,
+            **{key: value if key == "error" else self.store_payload(value) for key, value in content.items()}
+        }
+        with self.lock:
+            with open(self.file_path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+            self.create_exception(name).number_of_fails += 1
+            self.summary_changed = True
+        return event
+
+    def get_summary(self) -> Dict[str, int]:
+        """
+        Returns the number of fails for each generation
+        """
+        with self.lock:
+            return {key: value.number_of_fails for key, value in self.collated_exceptions.items()}
+
     def save_failures(self) -> None:
         """
-        Saves the CollatedException to a json file
+        Saves the number of fails for each generation. Exceptions themselves are already appended to the error log
         """
-        result: dict[str, List[Dict]] = {}
-        for key, value in self.collated_exceptions.items():
-            value.combine_num_of_fails()
-            result[key] = value.get_exceptions()
+        with self.lock:
+            if not self.summary_changed:
+                return
 
-        with open(self.file_path, "w") as f:
-            json.dump(result, f, indent=2)
+            with open(self.summary_path, "w") as f:
+                json.dump(self.get_summary(), f, indent=2)
+            self.summary_changed = False
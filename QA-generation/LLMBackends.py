@@ -0,0 +1,266 @@
+import queue
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+"""
+Backends that PromptLLM sends completions to, selected with `backend` in the model's section of the QA config.
+Every backend has complete(definition, prompt, temp, max_tokens, prefix), returning the completion and its token usage
+
+openai: OpenAI / FastChat chat completions api over http
+transformers: local HuggingFace model, prompts queued from any thread are batched together with left padding
+echo: deterministic completions built from the prompt, for tests and offline runs
+"""
+
+Usage = Dict[str, int]
+
+
+class OpenAIBackend():
+    """
+    Chat completions over http, with requests sharing a prompt prefix pinned to the same endpoint
+    """
+    def __init__(self, model_name: str, model_config: Dict[str, Any]):
+        """
+        Constructor for OpenAIBackend
+
+        Args:
+            model_name (str): name of the model served
+            model_config (Dict[str, Any]): section of the QA config for the model
+        """
+        import openai
+
+        self.model_name = model_name
+
+        # openai_localhost can list several endpoints serving the same model
+        localhost = model_config["openai_localhost"]
+        self.endpoints: List[str] = localhost if isinstance(localhost, list) else [localhost]
+        openai.api_base = self.endpoints[0]
+        openai.api_key = model_config["openai_api_key"]
+        openai.organization = model_config["openai_organization"]
+        self.openai_completion = openai.ChatCompletion()
+
+    def get_endpoint(self, definition: str, prefix: str) -> str:
+        """
+        Pins requests that share a prompt prefix to the same endpoint, so servers with prefix caching reuse their KV cache
+
+        Args:
+            definition (str): system prompt of the request
+            prefix (str): shared start of the input
+
+        Returns:
+            str: endpoint to send the request to
+        """
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+        return self.endpoints[zlib.crc32(f"{definition}\n{prefix}".encode("utf-8")) % len(self.endpoints)]
+
+    def complete(self, definition: str, prompt: str, temp: float, max_tokens: int, prefix: str) -> Tuple[str, Usage]:
+        output = self.openai_completion.create(
+            api_base=self.get_endpoint(definition, prefix),
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": definition},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temp,
+            max_tokens=max_tokens,
+            do_sampling=True
+        )
+        usage = output.get("usage", None) or {}
+        return output.choices[0].message.content, {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0)
+        }
+
+
+class TransformersBackend():
+    """
+    Local HuggingFace causal language model. Prompts are queued, and a worker thread generates for up to
+    max_batch_size of them at once, left padded, so concurrent callers share a forward pass
+    """
+    def __init__(self, model_config: Dict[str, Any]):
+        """
+        Constructor for TransformersBackend, the model is loaded on first use
+
+        Args:
+            model_config (Dict[str, Any]): section of the QA config for the model, with model_path and optionally
+                device (cpu), max_batch_size (8), batch_wait in seconds (0.01) and num_threads
+        """
+        self.model_path: str = model_config["model_path"]
+        self.device: str = model_config.get("device", "cpu")
+        self.max_batch_size: int = model_config.get("max_batch_size", 8)
+        self.batch_wait: float = model_config.get("batch_wait", 0.01)
+        self.num_threads: int = model_config.get("num_threads", 0)
+
+        self.tokenizer: Any = None
+        self.model: Any = None
+        self.requests: queue.Queue = queue.Queue()
+        self.worker: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Loads the tokenizer and model, and starts the batching worker
+        """
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(self.model_path).to(self.device)
+        self.model.eval()
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def format(self, definition: str, prompt: str) -> str:
+        """
+        Chat prompt for the model, using its chat template when it has one
+        """
+        if getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template([
+                {"role": "system", "content": definition},
+                {"role": "user", "content": prompt}
+            ], tokenize=False, add_generation_prompt=True)
+        # Vicuna style template
+        return f"{definition}\n\nUSER: {prompt}\nASSISTANT:"
+
+    def complete(self, definition: str, prompt: str, temp: float, max_tokens: int, prefix: str) -> Tuple[str, Usage]:
+        with self.lock:
+            if self.worker is None:
+                self.load()
+
+        future: Future = Future()
+        self.requests.put(((self.format(definition, prompt), temp, max_tokens), future))
+        return future.result()
+
+    def next_batch(self) -> List[Tuple[Tuple[str, float, int], Future]]:
+        """
+        Waits for a request, then collects more for up to batch_wait seconds
+        """
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        """
+        Worker loop, requests with the same sampling settings are generated together
+        """
+        while True:
+            batch = self.next_batch()
+            groups: Dict[Tuple[float, int], List[Tuple[str, Future]]] = {}
+            for (text, temp, max_tokens), future in batch:
+                groups.setdefault((temp, max_tokens), []).append((text, future))
+
+            for (temp, max_tokens), group in groups.items():
+                try:
+                    results = self.generate([text for text, _ in group], temp, max_tokens)
+                    for (_, future), result in zip(group, results):
+                        future.set_result(result)
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+
+    def generate(self, texts: List[str], temp: float, max_tokens: int) -> List[Tuple[str, Usage]]:
+        """
+        Generates for a batch of prompts, left padded so every prompt ends at the same position
+
+        Args:
+            texts (List[str]): formatted prompts
+            temp (float): temperature, greedy when 0
+            max_tokens (int): max new tokens
+
+        Returns:
+            List[Tuple[str, Usage]]: completion and token usage of each prompt
+        """
+        import torch
+
+        encoded = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.device)
+        sampling = {"do_sample": True, "temperature": temp, "top_p": 0.9} if temp > 0 else {"do_sample": False}
+        with torch.no_grad():
+            output = self.model.generate(
+                **encoded,
+                max_new_tokens=max_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **sampling
+            )
+
+        new_tokens = output[:, encoded["input_ids"].shape[1]:]
+        results = []
+        for index, tokens in enumerate(new_tokens):
+            completion_tokens = int((tokens != self.tokenizer.pad_token_id).sum())
+            results.append((
+                self.tokenizer.decode(tokens, skip_special_tokens=True).strip(),
+                {
+                    "prompt_tokens": int(encoded["attention_mask"][index].sum()),
+                    "completion_tokens": completion_tokens
+                }
+            ))
+        return results
+
+
+class EchoBackend():
+    """
+    Deterministic completions, numbered lines of words taken from the prompt, for tests and offline runs
+    """
+    def __init__(self, model_config: Dict[str, Any]):
+        """
+        Constructor for EchoBackend
+
+        Args:
+            model_config (Dict[str, Any]): section of the QA config for the model, optionally with completion_tokens (120)
+        """
+        self.completion_tokens: int = model_config.get("completion_tokens", 120)
+
+    def complete(self, definition: str, prompt: str, temp: float, max_tokens: int, prefix: str) -> Tuple[str, Usage]:
+        words = prompt.split() or ["echo"]
+        generator = random.Random(f"{definition}\n{prompt}")
+        completion_tokens = min(self.completion_tokens, max_tokens)
+
+        lines = []
+        for start in range(0, completion_tokens, 12):
+            line = [generator.choice(words) for _ in range(min(12, completion_tokens - start))]
+            lines.append(f"{len(lines) + 1}. {' '.join(line)}?")
+
+        return "\n".join(lines), {
+            "prompt_tokens": len(definition.split()) + len(words),
+            "completion_tokens": completion_tokens
+        }
+
+
+def get_backend(model_name: str, model_config: Dict[str, Any]) -> Any:
+    """
+    Creates the backend set in the model's section of the QA config
+
+    Args:
+        model_name (str): name of the model
+        model_config (Dict[str, Any]): section of the QA config for the model
+
+    Returns:
+        Any: OpenAIBackend, TransformersBackend or EchoBackend
+    """
+    backend = model_config.get("backend", "openai")
+    if backend == "openai":
+        return OpenAIBackend(model_name, model_config)
+    if backend == "transformers":
+        return TransformersBackend(model_config)
+    if backend == "echo":
+        return EchoBackend(model_config)
+
+    print(f"{backend} is not a supported backend, use openai, transformers or echo")
+    exit()
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+from SentenceStore import text_hash
+
+"""
+Metric results keyed by (metric, version, candidate hash, reference hash), appended to a JSONL file.
+The version is everything a result depends on besides its two inputs, the model, backend and settings of the metric,
+so changing the embedder only recomputes the sentence transformer scores, and evaluating new rows or a new metric
+only computes the entries that are missing. Entries of other versions are kept, switching back reuses them.
+
+Hashes are sha256 of the exact inputs of the metric, texts with text_hash and sentence windows with window_hash,
+so the same answer to the same context is scored once however many files or runs it appears in
+"""
+
+Key = Tuple[str, str, str, str]
+
+
+def window_hash(window: List[str]) -> str:
+    """
+    sha256 of a window of sentences, the input of sentence level metrics
+    """
+    return text_hash("\n".join(window))
+
+
+class MetricCache():
+    """
+    Metric results, computed once per metric version and pair of inputs
+    """
+    def __init__(self, path: str = ""):
+        """
+        Constructor for MetricCache, loading the results already stored at path
+
+        Args:
+            path (str, optional): JSONL file of stored results, results are only kept in memory when blank. Defaults to "".
+        """
+        self.path = path
+        self.results: Dict[Key, Any] = {}
+        self.pending: List[Key] = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path != "" and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip() == "":
+                        continue
+                    entry = json.loads(line)
+                    self.results[(entry["metric"], entry["version"], entry["candidate"], entry["reference"])] = entry["value"]
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def get(self, metric: str, version: str, candidate_hash: str, reference_hash: str) -> Any:
+        """
+        Stored result of a metric, None when it has not been computed for this version
+        """
+        with self.lock:
+            return self.results.get((metric, version, candidate_hash, reference_hash), None)
+
+    def put(self, metric: str, version: str, candidate_hash: str, reference_hash: str, value: Any) -> None:
+        """
+        Stores the result of a metric, it is written to the file on the next save
+
+        Args:
+            metric (str): name of the metric, eg. bertScore
+            version (str): model, backend and settings of the metric
+            candidate_hash (str): hash of the candidate
+            reference_hash (str): hash of the reference
+            value (Any): result, anything json serialisable
+        """
+        key = (metric, version, candidate_hash, reference_hash)
+        with self.lock:
+            if key not in self.results:
+                self.pending.append(key)
+            self.results[key] = value
+
+    def lookup(
+        self,
+        metric: str,
+        version: str,
+        candidate_hash: str,
+        reference_hash: str,
+        compute: Callable[[], Any]
+    ) -> Any:
+        """
+        Result of a metric, computed and stored when missing
+
+        Args:
+            metric (str): name of the metric, eg. bertScore
+            version (str): model, backend and settings of the metric
+            candidate_hash (str): hash of the candidate
+            reference_hash (str): hash of the reference
+            compute (Callable[[], Any]): computes the result, only called on a miss
+
+        Returns:
+            Any: the result
+        """
+        value = self.get(metric, version, candidate_hash, reference_hash)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = compute()
+        self.put(metric, version, candidate_hash, reference_hash, value)
+        return value
+
+    def save(self) -> None:
+        """
+        Appends the results computed since the last save to the JSONL file
+        """
+        with self.lock:
+            if self.path == "" or len(self.pending) == 0:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                for key in self.pending:
+                    metric, version, candidate_hash, reference_hash = key
+                    f.write(json.dumps({
+                        "metric": metric,
+                        "version": version,
+                        "candidate": candidate_hash,
+                        "reference": reference_hash,
+                        "value": self.results[key]
+                    }) + "\n")
+            self.pending = []
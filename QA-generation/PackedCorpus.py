@@ -0,0 +1,229 @@
+import glob
+import json
+import os
+import random
+import re
+from typing import Any, Dict, List
+
+import numpy as np
+from DatasetStream import DatasetReader
+from QaGeneration import ensure_string
+
+"""
+Every article of the context directory packed into one binary file, <path>.bin, with the byte offset of each article
+and metadata columns (id, source, title, date, author, url) in <path>.npz. The binary file is memory mapped,
+so opening the corpus reads only the index, and drawing or looking up an article only parses that article.
+Built with corpus-pack.py
+
+id: "<context_name>/<file>#<article index>", as in CorpusIndex
+source: "<context_name>/<file>"
+date: YYYY-MM-DD from the date of the article, or from its url, blank when neither has one
+"""
+
+columns = ["ids", "sources", "titles", "dates", "authors", "urls"]
+
+_months = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+_month_pattern = "|".join(_months)
+_day_month_year = re.compile(rf"(\d{{1,2}})\s+({_month_pattern})\s+(\d{{4}})", re.IGNORECASE)
+_month_day_year = re.compile(rf"({_month_pattern})\s+(\d{{1,2}}),?\s+(\d{{4}})", re.IGNORECASE)
+_iso_date = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+_url_date = re.compile(r"/(\d{4})/(\d{2})/(\d{2})/")
+
+
+def normalise_date(article: Dict) -> str:
+    """
+    Date of the article as YYYY-MM-DD, from its date field or its url
+
+    Args:
+        article (Dict): article from a context file
+
+    Returns:
+        str: the date, blank when not found
+    """
+    date = ensure_string(article.get("date", ""), " ")
+    match = _day_month_year.search(date)
+    if match is not None:
+        return f"{match.group(3)}-{_months.index(match.group(2).lower()) + 1:02d}-{int(match.group(1)):02d}"
+    match = _month_day_year.search(date)
+    if match is not None:
+        return f"{match.group(3)}-{_months.index(match.group(1).lower()) + 1:02d}-{int(match.group(2)):02d}"
+    for pattern, text in [(_iso_date, date), (_url_date, ensure_string(article.get("url", ""), ""))]:
+        match = pattern.search(text)
+        if match is not None:
+            return f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
+    return ""
+
+
+class PackedCorpus():
+    """
+    Memory mapped corpus of articles, with random, stratified and by id access
+    """
+    def __init__(self, path: str):
+        """
+        Opens a corpus packed with pack
+
+        Args:
+            path (str): path without extension
+        """
+        self.path = path
+        with np.load(f"{path}.npz") as index:
+            self.offsets = index["offsets"]
+            for column in columns:
+                setattr(self, column, index[column])
+
+        if self.offsets[-1] > 0:
+            self.data = np.memmap(f"{path}.bin", dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+        self.id_lookup: Dict[str, int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, row: int) -> Dict:
+        """
+        Article at a row of the corpus
+
+        Args:
+            row (int): row of the article
+
+        Returns:
+            Dict: the article, as stored in its context file
+        """
+        return json.loads(self.data[self.offsets[row]:self.offsets[row + 1]].tobytes())
+
+    def get_by_id(self, article_id: str) -> Dict:
+        """
+        Article with the given id, eg. rsis/data_2021.json#12
+
+        Raises:
+            KeyError: when no article has the id
+        """
+        if self.id_lookup is None:
+            self.id_lookup = {str(article_id): row for row, article_id in enumerate(self.ids)}
+        return self.get(self.id_lookup[article_id])
+
+    def rows_of(self, source: str) -> np.ndarray:
+        """
+        Rows of the articles from a context file
+
+        Args:
+            source (str): "<context_name>/<file>", eg. rsis/data_2021.json
+
+        Returns:
+            np.ndarray: the rows
+        """
+        return np.flatnonzero(self.sources == source)
+
+    def sample_order(
+        self,
+        rows: List[int] | np.ndarray | None = None,
+        stratify_by: str = "",
+        generator: random.Random | None = None
+    ) -> List[int]:
+        """
+        Rows in a random order to draw articles from. When stratified, rows are shuffled within each stratum and the strata
+        take turns, so the first n rows are spread evenly over the strata
+
+        Args:
+            rows (List[int] | np.ndarray | None, optional): rows to draw from. Defaults to every row.
+            stratify_by (str, optional): "", "date" for the month of the article, or "source". Defaults to "".
+            generator (random.Random | None, optional): source of randomness. Defaults to the random module.
+
+        Returns:
+            List[int]: the rows, in the order to draw them
+        """
+        if stratify_by not in ["", "date", "source"]:
+            print(f"{stratify_by} is not supported, stratify by date or source")
+            exit()
+        sampler: Any = generator if generator is not None else random
+        rows = list(range(len(self))) if rows is None else [int(row) for row in rows]
+
+        if stratify_by == "":
+            return sampler.sample(rows, len(rows))
+
+        strata: Dict[str, List[int]] = {}
+        for row in rows:
+            key = str(self.dates[row])[:7] if stratify_by == "date" else str(self.sources[row])
+            strata.setdefault(key, []).append(row)
+        stratum_list = [sampler.sample(stratum, len(stratum)) for stratum in strata.values()]
+        sampler.shuffle(stratum_list)
+
+        order = []
+        for position in range(max(len(stratum) for stratum in stratum_list) if stratum_list else 0):
+            order += [stratum[position] for stratum in stratum_list if position < len(stratum)]
+        return order
+
+    def sample(self, k: int, stratify_by: str = "", generator: random.Random | None = None) -> List[Dict]:
+        """
+        Draws k articles without replacement, see sample_order
+
+        Args:
+            k (int): number of articles
+            stratify_by (str, optional): "", "date" or "source". Defaults to "".
+            generator (random.Random | None, optional): source of randomness. Defaults to the random module.
+
+        Returns:
+            List[Dict]: the articles
+        """
+        return [self.get(row) for row in self.sample_order(stratify_by=stratify_by, generator=generator)[:k]]
+
+    def is_stale(self, source_path: str) -> bool:
+        """
+        Whether a context file changed after the corpus was packed
+        """
+        return os.path.getmtime(source_path) > os.path.getmtime(f"{self.path}.npz")
+
+    @staticmethod
+    def pack(context_dir: str, path: str) -> int:
+        """
+        Packs every article of the context directory, files that are not lists of articles (logs, scrape state) are skipped
+
+        Args:
+            context_dir (str): directory of the contexts, eg. ../data/context
+            path (str): path of the packed corpus, without extension
+
+        Returns:
+            int: number of articles packed
+        """
+        offsets = [0]
+        metadata: Dict[str, List[str]] = {column: [] for column in columns}
+        with open(f"{path}.bin.tmp", "wb") as f:
+            for file in sorted(glob.glob(f"{context_dir}/*/*.json")):
+                source = os.path.relpath(file, context_dir)
+                try:
+                    for index, article in enumerate(DatasetReader(file)):
+                        if not isinstance(article, dict) or "content" not in article:
+                            continue
+                        PackedCorpus.pack_article(f, article, f"{source}#{index}", source, offsets, metadata)
+                except ValueError:
+                    print(f"{file} is not a list of articles, skipped")
+
+        os.replace(f"{path}.bin.tmp", f"{path}.bin")
+        np.savez(
+            f"{path}.npz",
+            offsets=np.array(offsets, dtype=np.int64),
+            **{column: np.array(values, dtype=str) for column, values in metadata.items()}
+        )
+        return len(offsets) - 1
+
+    @staticmethod
+    def pack_article(
+        f: Any,
+        article: Dict,
+        article_id: str,
+        source: str,
+        offsets: List[int],
+        metadata: Dict[str, List[str]]
+    ) -> None:
+        """
+        Appends an article to the binary file, with its offset and metadata
+        """
+        offsets.append(offsets[-1] + f.write(json.dumps(article).encode("utf-8")))
+        metadata["ids"].append(article_id)
+        metadata["sources"].append(source)
+        metadata["titles"].append(ensure_string(article.get("title", ""), " "))
+        metadata["dates"].append(normalise_date(article))
+        author = ensure_string(article.get("author(s)", article.get("author", "")), " ").strip()
+        metadata["authors"].append(re.sub(r"^By\s+", "", author))
+        metadata["urls"].append(ensure_string(article.get("url", ""), ""))
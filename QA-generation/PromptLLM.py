@@ -1,17 +1,18 @@
-import openai
 from typing import Dict, Any
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
+from LLMBackends import get_backend
+from StageMetrics import StageMetrics
+from TokenBudget import TokenBudget
 
 
 class PromptLLM():
     """
-    Object to execute LLM calls. Currently uses the FastChat API to prompt
+    Object to execute LLM calls, through the backend set for the model in the QA config (see LLMBackends)
     """
     def __init__(
         self,
         model_name: str,
-        qa_config: Dict[Any, Any]
+        qa_config: Dict[Any, Any],
+        stage_metrics: StageMetrics | None = None
     ) -> None:
         """
         Constructor for PromptLLM
@@ -19,16 +20,18 @@ class PromptLLM():
         Args:
             model_name (str): path to hugging face model or openai model
             qa_config (Dict[Any, Any]): qa_config file loading from the generation call
+            stage_metrics (StageMetrics | None, optional): records token usage of each completion. Defaults to None.
         """
         self.qa_config = qa_config
+        self.stage_metrics = stage_metrics
 
         self.chatcompletion_model = model_name
-        openai.api_base = qa_config[model_name]["openai_localhost"]
-        openai.api_key = qa_config[model_name]["openai_api_key"]
-        openai.organization = qa_config[model_name]["openai_organization"]
-        self.openai_completion = openai.ChatCompletion()
 
-        # self.tokenizer, self.model = self.load_model("lmsys/vicuna-13b-v1.3") # Hugging face interface (deprecated)
+        # OpenAI / FastChat over http by default, or a local transformers model, or echo for tests
+        self.backend = get_backend(model_name, qa_config[model_name])
+
+        # Prompts are checked against the context window before being sent
+        self.token_budget = TokenBudget.from_config(qa_config[model_name])
 
     def check_if_model_exists(self, model_name: str) -> str:
         """
@@ -62,7 +65,8 @@ class PromptLLM():
         definition: str,
         input: str,
         temp: int,
-        max_tokens: int
+        max_tokens: int,
+        suffix: str = ""
     ) -> str:
         """
         Instructs the model with defintions and instructions
@@ -72,72 +76,25 @@ class PromptLLM():
             input (str): Input for the model to do something
             temp (int): temp for the model
             max_tokens (int): max output tokens to generate
+            suffix (str, optional): end of the input kept whole when the input is cut to fit, eg. the question asked about
+                the input. Requests with the same input share it as a prompt prefix. Defaults to "".
 
         Returns:
             str: returns the generation from the model
         """
-        prompt = f"Input:{input}\nOutput:"
+        # Inputs that do not fit the context window are truncated or chunked, or raise PromptTooLong, before any request
+        output_list = []
+        for input_item in self.token_budget.fit(definition, input, max_tokens, suffix):
+            prompt = f"Input:{input_item}\nOutput:"
+
+            # Requests on the same input share it as a prefix, whatever their suffix
+            shared_prefix = input_item[:len(input_item) - len(suffix)]
+            output, usage = self.backend.complete(definition, prompt, temp, max_tokens, shared_prefix)
 
-        output = self.openai_completion.create(
-            model=self.chatcompletion_model,
-            messages=[
-                {"role": "system", "content": definition},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temp,
-            max_tokens=max_tokens,
-            do_sampling=True
-        )
+            output_list.append(output)
 
-        output_text = output.choices[0].message.content
+            if self.stage_metrics is not None:
+                self.stage_metrics.add_tokens(usage["prompt_tokens"], usage["completion_tokens"])
 
+        output_text = "\n".join(output_list)
         return output_text
-    
-"""
-Use of huggingface API to access model, uncomment to use the huggingface API, currently deprecated
-"""
-
-    # # Hugging face interface (deprecated)
-    # @staticmethod
-    # def load_model(
-    #     model_name:str
-    # ) -> tuple[Any, Any]:
-
-    #     tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False, padding_side="left")
-    #     model = AutoModelForCausalLM.from_pretrained(model_name, device_map="auto")
-
-    #     model.eval()
-    #     eos_token_id = tokenizer.eos_token_id
-    #     tokenizer.pad_token = tokenizer.eos_token
-    #     model.config.pad_token_id = model.config.eos_token_id
-
-    #     # Set pad_token_id to eos_token_id
-    #     tokenizer.pad_token_id = eos_token_id
-    #     tokenizer.padding_side = 'left'
-    #     return tokenizer, model
-
-    # Hugging face interface (deprecated)
-    # @staticmethod
-    # def hugging_prompt(
-    #     input:str,
-    #     max_tokens:int,
-    #     tokenizer,
-    #     model
-    # ) -> str:
-    #     input_train = tokenizer(input, return_tensors="pt")
-    #     #print(input)
-    #     input_train.to('cuda')
-    #     #with torch.no_grad():
-    #     #torch.cuda.empty_cache()
-    #     with torch.no_grad():
-    #         greedy_output = model.generate(
-    #             input_ids=input_train['input_ids'],
-    #             attention_mask=input_train['attention_mask'],
-    #             num_beams=4,
-    #             do_sample=True,
-    #             top_p = 0.9,
-    #             top_k = 40,
-    #             max_new_tokens=max_tokens
-    #         )
-    #     decoded_output = tokenizer.decode(greedy_output[0], skip_special_tokens=True)
-    #     return decoded_output
@@ -1,16 +1,28 @@
 import json
 import os
 import random
-from typing import Dict, List, Any
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Any, Tuple
 
 import tqdm
+from CorpusIndex import CorpusIndex
+from DatasetStream import DatasetReader, append_rows, split_extension, trim_partial_row, write_rows
 from evaluation import Evaluation
-from QaGeneration import QaGeneration
+from QaGeneration import QaGeneration, ensure_string
+from QaRecord import QaRecord, TextPool, load_records
 from HandleExceptions import CollatedExceptions
+from PackedCorpus import PackedCorpus
 from PromptLLM import PromptLLM
+from QuestionIndex import QuestionIndex
+from SentenceStore import get_store, open_store, text_hash
+from StageMetrics import StageMetrics
+from StagePipeline import SharedResults, StagePipeline
 
 
 class QaController():
+    # Rows scored at a time by the passes over the whole output, rouge and nearest sources
+    score_batch_size = 1024
+
     def __init__(
         self,
         qa_config: Dict[Any, Any],
@@ -20,7 +32,11 @@ class QaController():
         context_name: str = "",
         questions_path: str = "",
         replace: bool = False,
-        identifier: str = ""
+        identifier: str = "",
+        schedule_window: int = 8,
+        num_of_workers: int = 4,
+        eval_workers: int = 1,
+        queue_size: int = 16
     ) -> None:
         """
         Constructor the QA controller
@@ -34,54 +50,99 @@ class QaController():
             questions_path (str, optional): Questions path to use with answer generation. Defaults to "".
             replace (bool, optional): When True, new generations will replace old ones in starting dataset. Defaults to False.
             identifier (str, optional): Unique identifier for the generated files. Defaults to "".
+            schedule_window (int, optional): rows whose requests are ordered together by shared prompt prefix, answers are saved
+                every schedule_window rows. Defaults to 8.
+            num_of_workers (int, optional): threads for each LLM stage of the QA pipelines. Defaults to 4.
+            eval_workers (int, optional): threads for the evaluation stage, more than 1 is best used with an eval server. Defaults to 1.
+            queue_size (int, optional): max rows waiting between stages of the QA pipelines. Defaults to 16.
         """
         # CONFIGS AND ARGS
         self.qa_config = qa_config
+        self.replace = replace
 
         self.identifier = identifier
+        self.schedule_window = max(schedule_window, 1)
+        self.num_of_workers = max(num_of_workers, 1)
+        self.eval_workers = max(eval_workers, 1)
+        self.queue_size = queue_size
 
         # GENERATION ARGS
         self.num_of_generations = num_of_generations
 
         self.context_name = context_name
         self.generation_file_path = f"{self.qa_config['file_config']['generation_dir']}/{self.context_name}"
+        # .json, .jsonl or .jsonl.zst, for the questions and answers written, see DatasetStream
+        self.dataset_extension = self.qa_config['file_config'].get('dataset_extension', ".json")
 
         # GETTING CONFIGS
         with open(self.qa_config['file_config']['definition_path'], "r") as f:
             self.definition_data = json.load(f)
 
-        # LOADING QUESTIONS
+        # Articles and definitions held once for every row of the questions dataset, see QaRecord.
+        # Only rows held for the whole run go in it, rows streamed through the QA pipelines are plain dicts
+        self.text_pool = TextPool()
+
+        # QUESTIONS, streamed from the file row by row, see DatasetStream
         self.questions_path = questions_path
+        self.questions_reader: DatasetReader | None = None
+        self.num_of_questions = 0
         if questions_path != "" and os.path.exists(questions_path):
-            with open(questions_path, "r") as f:
-                self.questions_dataset = json.load(f)
+            self.questions_reader = DatasetReader(questions_path)
+            self.num_of_questions = len(self.questions_reader)
         else:
-            self.questions_dataset = []
             print("no questions loaded")
 
-        # LOADING STARTING DATASET
+        # STARTING DATASET, copied row by row into the progress file of a QA run, see open_progress
+        self.starting_dataset_path = ""
         if starting_dataset_path != "" and os.path.exists(starting_dataset_path):
-            with open(starting_dataset_path, "r") as f:
-                self.starting_dataset = json.load(f)
+            self.starting_dataset_path = starting_dataset_path
         else:
-            self.starting_dataset = []
             print("no starting dataset loaded")
 
         # EXCEPTIONS
         self.collated_exceptions = CollatedExceptions(
             qa_config['file_config']['logs_dir'])
 
+        # METRICS
+        self.stage_metrics = StageMetrics(
+            directory=qa_config['file_config'].get('metrics_dir', ""),
+            export_format=qa_config['file_config'].get('metrics_format', "jsonl")
+        )
+
         # LLM
         self.prompt_llm = PromptLLM(
             model_name=model_name,
-            qa_config=self.qa_config
+            qa_config=self.qa_config,
+            stage_metrics=self.stage_metrics
         )
 
         # EVALUATOR
         self.evaluation_object = Evaluation(
-            collated_exceptions=self.collated_exceptions
+            collated_exceptions=self.collated_exceptions,
+            stage_metrics=self.stage_metrics,
+            eval_socket=qa_config['file_config'].get('eval_socket', ""),
+            eval_backend=qa_config['file_config'].get('eval_backend', "torch"),
+            num_threads=qa_config['file_config'].get('eval_threads', 0),
+            metric_cache_path=qa_config['file_config'].get('metric_cache_path', "")
         )
 
+        # SENTENCE SPANS, shared by every question on the same article, precomputed with sentence-store.py
+        sentence_store_path = qa_config['file_config'].get('sentence_store_path', "")
+        if sentence_store_path != "":
+            open_store(sentence_store_path)
+
+        # PACKED CORPUS, built with corpus-pack.py
+        packed_corpus_path = qa_config['file_config'].get('packed_corpus_path', "")
+        self.packed_corpus = None
+        if packed_corpus_path != "" and os.path.exists(f"{packed_corpus_path}.npz"):
+            self.packed_corpus = PackedCorpus(packed_corpus_path)
+
+        # CORPUS INDEX, built with corpus-index.py
+        corpus_index_path = qa_config['file_config'].get('corpus_index_path', "")
+        self.corpus_index = None
+        if corpus_index_path != "" and os.path.exists(f"{corpus_index_path}.npz"):
+            self.corpus_index = CorpusIndex.load(corpus_index_path)
+
         # QA GENERATOR
         self.qa_object = QaGeneration(
             prompt_llm=self.prompt_llm,
@@ -89,182 +150,563 @@ class QaController():
             replace=replace
         )
 
+    def estimate_run(self, mode: str, start: int) -> Dict[str, Any]:
+        """
+        Estimates the token volume and cost of the rows left to generate, before a run starts.
+        Outputs that are not generated yet are counted at their max_tokens
+
+        Args:
+            mode (str): "open_book" or "close_book"
+            start (int): first row to generate
+
+        Returns:
+            Dict[str, Any]: estimate from the TokenBudget of the model
+        """
+        token_budget = self.prompt_llm.token_budget
+        summaries = self.shared_context_result("concise_context" if mode == "open_book" else "point_form_context")
+        requests: List[tuple] = []
+        for _, row in self.question_rows(start):
+            context = ensure_string(row["context"], "")
+            context_hash = text_hash(context)
+            question = ensure_string(row["question"], "")
+
+            # Contexts are only summarised once per article
+            is_summarised = context_hash in summaries
+            summaries.setdefault(context_hash, "")
+
+            if mode == "open_book":
+                if is_summarised and summaries[context_hash] != "":
+                    requests.append((self.definition_data["answer_with_context"], f"context: {summaries[context_hash]} question: {question}", 1024))
+                else:
+                    if not is_summarised:
+                        requests.append((self.definition_data["summarise_to_text"], context, 1024))
+                    requests.append((self.definition_data["answer_with_context"], 1024 + token_budget.count(question), 1024))
+            else:
+                requests.append((self.definition_data["answer"], question, 1024))
+                requests.append((self.definition_data["summarise_to_points"], 1024, 250))
+                if not is_summarised:
+                    requests.append((self.definition_data["summarise_to_points"], context, 250))
+
+        report = token_budget.estimate(requests)
+        print(
+            f"estimated {report['requests']} requests, {report['prompt_tokens']} prompt tokens, "
+            f"up to {report['completion_tokens']} completion tokens, cost {report['cost']:.2f}, "
+            f"{report['over_budget']} inputs over the context window ({token_budget.policy})"
+        )
+        return report
+
+    def question_rows(self, start: int) -> Iterator[Tuple[int, Dict]]:
+        """
+        Questions left to generate, read from the questions file as they are needed. Rows before start are not parsed
+
+        Args:
+            start (int): first row to generate
+
+        Returns:
+            Iterator[Tuple[int, Dict]]: index of each row, with the row
+        """
+        end = min(self.num_of_generations, self.num_of_questions)
+        if self.questions_reader is None or start >= end:
+            return iter([])
+        return enumerate(islice(self.questions_reader.iter_rows(start=start), end - start), start)
+
+    def schedule_windows(self, start: int) -> Iterator[List[Tuple[int, Dict]]]:
+        """
+        Splits the rows left to generate into windows of schedule_window rows. Rows within a window are fed to the
+        QA pipelines ordered by context, so requests sharing the definition and context are sent close together
+
+        Args:
+            start (int): first row to generate
+
+        Returns:
+            Iterator[List[Tuple[int, Dict]]]: rows of each window, in the order requests are sent
+        """
+        rows = self.question_rows(start)
+        while True:
+            window = list(islice(rows, self.schedule_window))
+            if len(window) == 0:
+                return
+            yield sorted(window, key=lambda item: text_hash(ensure_string(item[1]["context"], "")))
+
+    def shared_results_path(self, result_key: str) -> str:
+        """
+        JSONL file of the results shared per article generated by this run, eg. concise_context.
+        Kept apart from the questions file, which QA only reads, so runs on the same questions do not write to it
+
+        Args:
+            result_key (str): key of the result, eg. concise_context
+
+        Returns:
+            str: path of the file
+        """
+        return f"{self.generation_file_path}/{result_key}_{self.context_name}_{self.identifier}_{self.prompt_llm.get_chat_model()}.jsonl"
+
+    def shared_context_result(self, result_key: str) -> Dict[str, str]:
+        """
+        Results already generated for each context, questions on the same article reuse them instead of generating again.
+        Read from the questions file, where older runs stored them, and from the shared results file of this run
+
+        Args:
+            result_key (str): key of the result within the questions dataset, eg. concise_context
+
+        Returns:
+            Dict[str, str]: hash of the context, see SentenceStore.text_hash, to its result
+        """
+        results: Dict[str, str] = {}
+        if self.questions_reader is not None:
+            for row in self.questions_reader:
+                if row.get(result_key, "") != "":
+                    results[text_hash(ensure_string(row["context"], ""))] = row[result_key]
+
+        shared_results_path = self.shared_results_path(result_key)
+        if os.path.exists(shared_results_path):
+            for entry in DatasetReader(shared_results_path):
+                if entry.get(result_key, "") != "":
+                    results[entry["sha256"]] = entry[result_key]
+        return results
+
+    def save_shared_results(self, result_key: str, entries: List[Dict]) -> None:
+        """
+        Appends results shared per article to the shared results file of this run, see shared_results_path
+
+        Args:
+            result_key (str): key of the result, eg. concise_context
+            entries (List[Dict]): sha256 of each context, with its result under result_key. Cleared once saved
+        """
+        # Created even when empty, it is an output of the QA stages of the experiment
+        shared_results_path = self.shared_results_path(result_key)
+        os.makedirs(os.path.dirname(os.path.abspath(shared_results_path)), exist_ok=True)
+        with open(shared_results_path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        entries.clear()
+
+    def ordered_rows(self, start: int) -> Iterator[Tuple[int, Dict]]:
+        """
+        Rows left to generate, in the order they are fed to a QA pipeline, see schedule_windows
+
+        Args:
+            start (int): first row to generate
+
+        Returns:
+            Iterator[Tuple[int, Dict]]: index of each row, with the data to work with
+        """
+        for window in self.schedule_windows(start):
+            for idx, row in window:
+                yield idx, {"context": row["context"], "question": row["question"]}
+
+    @staticmethod
+    def progress_path(answers_file_path: str) -> str:
+        """
+        Append-only JSONL file the answers of a QA run are persisted to as they finish, see open_progress
+        """
+        return f"{split_extension(answers_file_path)[0]}.partial.jsonl"
+
+    def open_progress(self, answers_file_path: str) -> int:
+        """
+        Prepares the progress file of a QA run. A progress file left by a run that did not finish is continued,
+        else it starts as a copy of the starting dataset, streamed row by row. Rows in it are never loaded
+
+        Args:
+            answers_file_path (str): path the answers are written to once the run finishes
+
+        Returns:
+            int: rows already in the progress file, the first row to generate
+        """
+        progress_path = self.progress_path(answers_file_path)
+        if os.path.exists(progress_path):
+            trim_partial_row(progress_path)
+            num_of_rows = len(DatasetReader(progress_path))
+            print(f"continuing from the {num_of_rows} rows in {progress_path}")
+            return num_of_rows
+
+        os.makedirs(os.path.dirname(os.path.abspath(progress_path)), exist_ok=True)
+        rows = DatasetReader(self.starting_dataset_path) if self.starting_dataset_path != "" else []
+        return write_rows(progress_path, rows)
+
+    def finish_answers(self, answers_file_path: str, score_rows: Callable[[List[Dict]], List[Dict]]) -> None:
+        """
+        Writes the answers file from the progress file, score_batch_size rows at a time, scoring each batch
+        with score_rows on the way, eg. rouge. The progress file is removed once the answers file is written
+
+        Args:
+            answers_file_path (str): path to save the answers to
+            score_rows (Callable[[List[Dict]], List[Dict]]): scores a batch of rows, returning the rows
+        """
+        progress_path = self.progress_path(answers_file_path)
+
+        def scored_rows() -> Iterator[Dict]:
+            rows = iter(DatasetReader(progress_path))
+            while True:
+                batch = list(islice(rows, self.score_batch_size))
+                if len(batch) == 0:
+                    return
+                yield from score_rows(batch)
+
+        with self.stage_metrics.span("save_answers"):
+            write_rows(answers_file_path, scored_rows())
+        os.remove(progress_path)
+
+    def persist_stage(
+        self,
+        start: int,
+        progress_path: str,
+        progress_bar: tqdm.tqdm,
+        result_key: str,
+        shared_results: Dict[int, Dict]
+    ) -> Callable[[Tuple[int, Dict]], None]:
+        """
+        Last stage of a QA pipeline, run on a single thread. Rows finish in any order, and are appended to the
+        progress file in the order of the questions, every schedule_window rows together with the shared results.
+        Only rows waiting for an earlier row to finish are held
+
+        Args:
+            start (int): first row generated, the rows in the progress file
+            progress_path (str): progress file the rows are appended to, see open_progress
+            progress_bar (tqdm.tqdm): progress bar of the run
+            result_key (str): key of the result shared per article, eg. concise_context
+            shared_results (Dict[int, Dict]): sha256 of the context of each row with its shared result, as generated,
+                saved to shared_results_path. Kept apart from the rows, as evaluation splits the fields of a row into sentences
+
+        Returns:
+            Callable[[Tuple[int, Dict]], None]: the stage
+        """
+        end = min(self.num_of_generations, self.num_of_questions)
+        pending: Dict[int, Dict] = {}
+        # Results already stored are not appended again
+        stored = set(self.shared_context_result(result_key))
+        new_results: List[Dict] = []
+        finished_rows: List[Dict] = []
+        next_idx = start
+        num_of_persisted = 0
+
+        def persist(item: Tuple[int, Dict]) -> None:
+            nonlocal next_idx, num_of_persisted
+            idx, dataset = item
+            entry = shared_results.pop(idx, None)
+            if entry is not None and entry[result_key] != "" and entry["sha256"] not in stored:
+                stored.add(entry["sha256"])
+                new_results.append(entry)
+            pending[idx] = dataset
+
+            while next_idx in pending:
+                # Rows are saved in the order of the questions
+                finished_rows.append(pending.pop(next_idx))
+                next_idx += 1
+                num_of_persisted += 1
+                progress_bar.update(1)
+
+                if num_of_persisted % self.schedule_window == 0 or next_idx == end:
+                    # Saving exceptions
+                    with self.stage_metrics.span("save_failures"):
+                        self.collated_exceptions.save_failures()
+                    with self.stage_metrics.span("save_shared_results"):
+                        self.save_shared_results(result_key, new_results)
+                    with self.stage_metrics.span("save_answers"):
+                        append_rows(progress_path, finished_rows)
+                    finished_rows.clear()
+                    get_store().save()
+                    self.evaluation_object.metric_cache.save()
+                    self.stage_metrics.save()
+
+        return persist
+
     def open_book_qa(
         self
     ) -> None:
         """
-        Performs open book QA. Context will be given with questions during answer generation
+        Performs open book QA. Context will be given with questions during answer generation.
+        Rows go through a pipeline of stages, summarise context -> answer -> evaluate -> persist, each with its own threads
         """
         # Checking questions dataset
-        if len(self.questions_dataset) <= 0:
+        if self.num_of_questions <= 0:
             print("questions not loaded correctly")
             exit()
 
+        answers_file_path = f"{self.generation_file_path}/open_book_answers_{self.context_name}_{self.identifier}_{self.prompt_llm.get_chat_model()}{self.dataset_extension}"
+        progress_path = self.progress_path(answers_file_path)
+        start = self.open_progress(answers_file_path)
+
+        self.estimate_run("open_book", start)
+
         # Progress bar
         progress_bar = tqdm.tqdm(
-            total=min(self.num_of_generations, len(self.questions_dataset)),
+            total=min(self.num_of_generations, self.num_of_questions),
             desc=f"{self.context_name}, {self.prompt_llm.current_model_name()}, {self.identifier}"
         )
-        target_dataset = self.starting_dataset
-        progress_bar.update(len(target_dataset))
-
-        # Does all the steps per index
-        for idx in range(len(target_dataset), min(self.num_of_generations, len(self.questions_dataset))):
-
-            # reference to data to work with
-            working_dataset = {
-                "context": self.questions_dataset[idx]["context"],
-                "question": self.questions_dataset[idx]["question"],
-            }
-
-            if "concise_context" in self.questions_dataset[idx] and self.questions_dataset[idx]["concise_context"] != "":
-                working_dataset["concise_context"] = self.questions_dataset[idx]["concise_context"]
-            else:
-                progress_bar.set_postfix({'Info': "creating concised context"})
-                # Summarise the context
-                working_dataset = self.qa_object.summarisation_generation(
-                    definition=self.definition_data["summarise_to_text"],
+        progress_bar.update(start)
+
+        # Contexts are summarised once per article, by the first row that needs it
+        concise_contexts = SharedResults(self.shared_context_result("concise_context"))
+        shared_results: Dict[int, Dict] = {}
+
+        def summarise_context(item: Tuple[int, Dict]) -> Tuple[int, Dict]:
+            idx, dataset = item
+            context_hash = text_hash(ensure_string(dataset["context"], ""))
+            with self.stage_metrics.span("summarise_context", row=idx):
+                dataset["concise_context"] = concise_contexts.get(
+                    context_hash,
+                    lambda: self.qa_object.summarisation_generation(
+                        definition=self.definition_data["summarise_to_text"],
+                        max_tokens=1024,
+                        source_key="context",
+                        result_key="concise_context",
+                        intended_input_tokens=self.prompt_llm.token_budget.input_budget(self.definition_data["summarise_to_text"], 1024),
+                        dataset={"context": dataset["context"]}
+                    )["concise_context"],
+                    keep=lambda result: result != ""
+                )
+            shared_results[idx] = {"sha256": context_hash, "concise_context": dataset["concise_context"]}
+            return idx, dataset
+
+        # Generates answer from the summarised context
+        def answer(item: Tuple[int, Dict]) -> Tuple[int, Dict]:
+            idx, dataset = item
+            with self.stage_metrics.span("answer", row=idx):
+                dataset = self.qa_object.answer_generation(
+                    definition=self.definition_data["answer_with_context"],
                     max_tokens=1024,
-                    source_key="context",
-                    result_key="concise_context",
-                    intended_input_tokens=1024,
-                    dataset=working_dataset
+                    source_key="question",
+                    context_key="concise_context",
+                    result_key="open_book_answer",
+                    dataset=dataset
                 )
-                self.questions_dataset[idx]["concise_context"] = working_dataset["concise_context"]
-                with open(self.questions_path, "w") as f:
-                    json.dump(self.questions_dataset, f, indent=2)
-
-            # Generates answer from the summarised context
-            progress_bar.set_postfix(
-                {'Info': "answering with concised context"})
-            working_dataset = self.qa_object.answer_generation(
-                definition=self.definition_data["answer_with_context"],
-                max_tokens=1024,
-                source_key="question",
-                context_key="concise_context",
-                result_key="open_book_answer",
-                dataset=working_dataset
-            )
-            # Evaluates the raw answer against the raw context
-            progress_bar.set_postfix({'Info': "evaluating concised answer"})
-            working_dataset = self.evaluation_object.evaluation_generation(
-                dataset=working_dataset,
+            return idx, dataset
+
+        # Evaluates the answer against the summarised context
+        def evaluate(item: Tuple[int, Dict]) -> Tuple[int, Dict]:
+            idx, dataset = item
+            with self.stage_metrics.span("evaluate_answer", row=idx):
+                dataset = self.evaluation_object.evaluation_generation(
+                    dataset=dataset,
+                    cand_key="open_book_answer",
+                    ref_key="concise_context",
+                    result_key="open_book_orignals",
+                    rouge=False
+                )
+            return idx, dataset
+
+        progress_bar.set_postfix({'Info': "generating and evaluating answers"})
+        pipeline = StagePipeline(queue_size=self.queue_size)
+        pipeline.add_stage("summarise_context", summarise_context, self.num_of_workers)
+        pipeline.add_stage("answer", answer, self.num_of_workers)
+        pipeline.add_stage("evaluate", evaluate, self.eval_workers)
+        pipeline.add_stage("persist", self.persist_stage(start, progress_path, progress_bar, "concise_context", shared_results))
+        pipeline.run(self.ordered_rows(start))
+
+        # Rouge is evaluated over batches of the whole output, as the answers file is written
+        def score_rows(rows: List[Dict]) -> List[Dict]:
+            rows = self.evaluation_object.rouge_generation(
+                dataset_list=rows,
                 cand_key="open_book_answer",
                 ref_key="concise_context",
                 result_key="open_book_orignals",
+                replace=self.replace
             )
-            # Updates the dataset
-            target_dataset.append(working_dataset)
-
-            # Saving exceptions
-            self.collated_exceptions.save_failures()
+            if self.corpus_index is not None:
+                rows = self.evaluation_object.nearest_source_generation(
+                    dataset_list=rows,
+                    cand_key="open_book_answer",
+                    result_key="open_book_orignals",
+                    corpus_index=self.corpus_index,
+                    replace=self.replace
+                )
+            return rows
 
-            # save for every iteration
-            with open(f"{self.generation_file_path}/open_book_answers_{self.context_name}_{self.identifier}_{self.prompt_llm.get_chat_model()}.json", 'w') as f:
-                json.dump(target_dataset, f, indent=2)
+        progress_bar.set_postfix({'Info': "evaluating rouge" if self.corpus_index is None else "evaluating rouge, finding nearest sources"})
+        self.finish_answers(answers_file_path, score_rows)
+        self.collated_exceptions.save_failures()
+        get_store().save()
+        self.evaluation_object.metric_cache.save()
 
-            progress_bar.update(1)
+        progress_bar.close()
+        self.stage_metrics.save()
+        self.stage_metrics.print_summary()
 
     def close_book_qa(self) -> None:
         """
-        Performs blind QA, where only questions will be given to the model for answer generation
+        Performs blind QA, where only questions will be given to the model for answer generation.
+        Rows go through a pipeline of stages, answer -> summarise to points -> evaluate -> persist, each with its own threads
         """
         # Checking questions dataset
-        if len(self.questions_dataset) <= 0:
+        if self.num_of_questions <= 0:
             print("questions not loaded correctly")
             exit()
 
-        target_dataset = self.starting_dataset
+        answers_file_path = f"{self.generation_file_path}/close_book_answers_{self.context_name}_{self.identifier}_{self.prompt_llm.get_chat_model()}{self.dataset_extension}"
+        progress_path = self.progress_path(answers_file_path)
+        start = self.open_progress(answers_file_path)
+
+        self.estimate_run("close_book", start)
+
         progress_bar = tqdm.tqdm(
-            total=min(self.num_of_generations, len(self.questions_dataset)),
+            total=min(self.num_of_generations, self.num_of_questions),
             desc=f"{self.context_name}, {self.prompt_llm.current_model_name()}, {self.identifier}"
         )
-        progress_bar.update(len(target_dataset))
-        for idx in range(len(target_dataset), min(self.num_of_generations, len(self.questions_dataset))):
-
-            # reference to data to work with
-            working_dataset = {
-                "context": self.questions_dataset[idx]["context"],
-                "question": self.questions_dataset[idx]["question"],
-            }
-
-            progress_bar.set_postfix({'Info': "generating answers"})
-            # Generates answer from the questions
-            working_dataset = self.qa_object.answer_generation(
-                definition=self.definition_data["answer"],
-                max_tokens=1024,
-                source_key="question",
-                result_key="close_book_answer",
-                dataset=working_dataset
-            )
-            # Generates point form of the answer
-            progress_bar.set_postfix({'Info': "summarising answers"})
-            working_dataset = self.qa_object.answer_generation(
-                definition=self.definition_data["summarise_to_points"],
-                temp=0,
-                max_tokens=250,
-                source_key="close_book_answer",
-                result_key="point_form_close_book_answer",
-                dataset=working_dataset
-            )
-            if "point_form_context" in self.questions_dataset[idx] and self.questions_dataset[idx]["point_form_context"] != "":
-                working_dataset["point_form_context"] = self.questions_dataset[idx]["point_form_context"]
-            else:
-                # Generates point form of the context
-                progress_bar.set_postfix({'Info': "summarising context"})
-                working_dataset = self.qa_object.answer_generation(
+        progress_bar.update(start)
+
+        # Contexts are summarised once per article, by the first row that needs it
+        point_form_contexts = SharedResults(self.shared_context_result("point_form_context"))
+        shared_results: Dict[int, Dict] = {}
+
+        # Generates answer from the questions
+        def answer(item: Tuple[int, Dict]) -> Tuple[int, Dict]:
+            idx, dataset = item
+            with self.stage_metrics.span("answer", row=idx):
+                dataset = self.qa_object.answer_generation(
+                    definition=self.definition_data["answer"],
+                    max_tokens=1024,
+                    source_key="question",
+                    result_key="close_book_answer",
+                    dataset=dataset
+                )
+            return idx, dataset
+
+        # Generates point form of the answer, and of the context
+        def summarise(item: Tuple[int, Dict]) -> Tuple[int, Dict]:
+            idx, dataset = item
+            with self.stage_metrics.span("summarise_answer", row=idx):
+                dataset = self.qa_object.answer_generation(
                     definition=self.definition_data["summarise_to_points"],
                     temp=0,
                     max_tokens=250,
-                    source_key="context",
-                    result_key="point_form_context",
-                    dataset=working_dataset
+                    source_key="close_book_answer",
+                    result_key="point_form_close_book_answer",
+                    dataset=dataset
+                )
+            context_hash = text_hash(ensure_string(dataset["context"], ""))
+            with self.stage_metrics.span("summarise_context", row=idx):
+                dataset["point_form_context"] = point_form_contexts.get(
+                    context_hash,
+                    lambda: self.qa_object.answer_generation(
+                        definition=self.definition_data["summarise_to_points"],
+                        temp=0,
+                        max_tokens=250,
+                        source_key="context",
+                        result_key="point_form_context",
+                        dataset={"context": dataset["context"]}
+                    )["point_form_context"],
+                    keep=lambda result: result != ""
                 )
-                self.questions_dataset[idx]["point_form_context"] = working_dataset["point_form_context"]
-                with open(self.questions_path, "w") as f:
-                    json.dump(self.questions_dataset, f, indent=2)
+            shared_results[idx] = {"sha256": context_hash, "point_form_context": dataset["point_form_context"]}
+            return idx, dataset
 
+        def evaluate(item: Tuple[int, Dict]) -> Tuple[int, Dict]:
+            idx, dataset = item
             # Evaluates the raw answer against the raw context
-            progress_bar.set_postfix({'Info': "evaluating answers"})
-            working_dataset = self.evaluation_object.evaluation_generation(
-                dataset=working_dataset,
+            with self.stage_metrics.span("evaluate_answer", row=idx):
+                dataset = self.evaluation_object.evaluation_generation(
+                    dataset=dataset,
+                    cand_key="close_book_answer",
+                    ref_key="context",
+                    result_key="answer",
+                    rouge=False
+                )
+            # Evaluates the point form version of answer to the point form version of context
+            with self.stage_metrics.span("evaluate_summarised", row=idx):
+                dataset = self.evaluation_object.evaluation_generation(
+                    dataset=dataset,
+                    cand_key="point_form_close_book_answer",
+                    ref_key="point_form_context",
+                    result_key="summarised",
+                    rouge=False
+                )
+            return idx, dataset
+
+        progress_bar.set_postfix({'Info': "generating and evaluating answers"})
+        pipeline = StagePipeline(queue_size=self.queue_size)
+        pipeline.add_stage("answer", answer, self.num_of_workers)
+        pipeline.add_stage("summarise", summarise, self.num_of_workers)
+        pipeline.add_stage("evaluate", evaluate, self.eval_workers)
+        pipeline.add_stage("persist", self.persist_stage(start, progress_path, progress_bar, "point_form_context", shared_results))
+        pipeline.run(self.ordered_rows(start))
+
+        # Rouge is evaluated over batches of the whole output, as the answers file is written
+        def score_rows(rows: List[Dict]) -> List[Dict]:
+            rows = self.evaluation_object.rouge_generation(
+                dataset_list=rows,
                 cand_key="close_book_answer",
                 ref_key="context",
                 result_key="answer",
+                replace=self.replace
             )
-            # Evaluates the point form version of answer to the point form version of context
-            progress_bar.set_postfix({'Info': "evaluating summarised answers"})
-            working_dataset = self.evaluation_object.evaluation_generation(
-                dataset=working_dataset,
+            rows = self.evaluation_object.rouge_generation(
+                dataset_list=rows,
                 cand_key="point_form_close_book_answer",
                 ref_key="point_form_context",
                 result_key="summarised",
+                replace=self.replace
             )
-            # Updates the dataset
-            target_dataset.append(working_dataset)
+            if self.corpus_index is not None:
+                rows = self.evaluation_object.nearest_source_generation(
+                    dataset_list=rows,
+                    cand_key="close_book_answer",
+                    result_key="answer",
+                    corpus_index=self.corpus_index,
+                    replace=self.replace
+                )
+            return rows
+
+        progress_bar.set_postfix({'Info': "evaluating rouge" if self.corpus_index is None else "evaluating rouge, finding nearest sources"})
+        self.finish_answers(answers_file_path, score_rows)
+        self.collated_exceptions.save_failures()
+        get_store().save()
+        self.evaluation_object.metric_cache.save()
+
+        progress_bar.close()
+        self.stage_metrics.save()
+        self.stage_metrics.print_summary()
+
+    def article_sampler(self, context_file_name: str, stratify_by: str = "") -> Tuple[List[int], Callable[[int], Dict]]:
+        """
+        Order to draw the articles of a context file in, read from the packed corpus when it is up to date with the file,
+        else from the context file
 
-            # Saving exceptions
-            self.collated_exceptions.save_failures()
+        Args:
+            context_file_name (str): file to draw articles from, without the .json
+            stratify_by (str, optional): "" or "date", only with the packed corpus, see PackedCorpus.sample_order.
+                Articles are drawn from a single file, so stratifying by source is not supported. Defaults to "".
 
-            # save for every iteration
-            with open(f"data_2021_nyt.json", 'w') as f:
-                json.dump(target_dataset, f, indent=2)
+        Returns:
+            Tuple[List[int], Callable[[int], Dict]]: rows in the order to draw them, and a function reading the article of a row
+        """
+        if stratify_by not in ["", "date"]:
+            print(f"{stratify_by} is not supported, articles are drawn from a single file, stratify by date")
+            exit()
 
-            progress_bar.update(1)
+        source = f"{self.context_name}/{context_file_name}.json"
+        context_path = f"{self.qa_config['file_config']['context_dir']}/{source}"
 
-    def generate_questions(self, context_file_name: str) -> None:
+        if self.packed_corpus is not None:
+            rows = self.packed_corpus.rows_of(source)
+            if len(rows) > 0 and not self.packed_corpus.is_stale(context_path):
+                return self.packed_corpus.sample_order(rows, stratify_by), self.packed_corpus.get
+            print(f"{source} is not packed or changed since, run corpus-pack.py again. Reading the context file")
+
+        if stratify_by != "":
+            print("stratified sampling needs the packed corpus, sampling at random")
+        # Articles are read from the context file as they are sampled
+        context_reader = DatasetReader(context_path)
+        article_offsets = context_reader.offsets()
+        article_order = random.sample(range(len(article_offsets)), len(article_offsets))
+        return article_order, lambda article_index: context_reader.read_at(article_offsets[article_index])
+
+    def generate_questions(self, context_file_name: str, similarity_threshold: float = 0.9, stratify_by: str = "") -> None:
         """
-        Generates questions for the target dataset.
+        Generates questions for the target dataset. Articles are sampled without replacement, and questions
+        that are near duplicates of questions already generated are dropped
 
         Args:
             context_file_name (str): file path for context to generate questions from
+            similarity_threshold (float, optional): questions with a higher cosine similarity to an existing question are dropped. Defaults to 0.9.
+            stratify_by (str, optional): "" or "date", spreads the articles drawn evenly over months. Defaults to "".
         """
-        context_file_path = f"{self.qa_config['file_config']['context_dir']}/{self.context_name}"
         generation_file_path = f"{self.qa_config['file_config']['generation_dir']}/{self.context_name}"
-        with open(f"{context_file_path}/{context_file_name}.json", "r") as f:
-            context_json = json.load(f)
+        article_order, get_article = self.article_sampler(context_file_name, stratify_by)
 
-        target_dataset: List[Dict[str, str]] = self.questions_dataset
+        target_dataset: List[QaRecord] = []
+        if self.questions_reader is not None:
+            target_dataset = load_records(self.questions_path, self.text_pool)
 
         progress_bar = tqdm.tqdm(
             total=self.num_of_generations,
@@ -272,16 +714,41 @@ class QaController():
         )
         progress_bar.update(len(target_dataset))
 
+        question_index = QuestionIndex(
+            get_embedder=self.evaluation_object.get_embedder,
+            threshold=similarity_threshold
+        )
+        with self.stage_metrics.span("dedup_questions"):
+            question_index.add([item["question"] for item in target_dataset], filter_duplicates=False)
+
+        # Articles already used by the starting questions are not sampled again
+        used_contexts = {text_hash(ensure_string(item["context"], "")) for item in target_dataset}
+
         # Filling up the dataset to hit number of generations target
-        while (len(target_dataset) < self.num_of_generations):
-            random_number = random.randint(0, len(context_json) - 1)
-            context_data = context_json[random_number]
-            result_list = self.qa_object.question_generation(
-                definition=self.definition_data["question"],
-                context_data=context_data
-            )
-            target_dataset += result_list
+        for article_index in article_order:
+            if len(target_dataset) >= self.num_of_generations:
+                break
+            context_data = get_article(article_index)
+            if text_hash(ensure_string(context_data["content"], "")) in used_contexts:
+                continue
+            with self.stage_metrics.span("question", article=article_index):
+                result_list = self.qa_object.question_generation(
+                    definition=self.definition_data["question"],
+                    context_data=context_data
+                )
+            with self.stage_metrics.span("dedup_questions"):
+                is_added = question_index.add([item["question"] for item in result_list])
+            result_list = [item for item, added in zip(result_list, is_added) if added]
+
+            target_dataset += [QaRecord(item, self.text_pool) for item in result_list]
             progress_bar.update(len(result_list))
 
-        with open(f"{generation_file_path}/questions_{self.context_name}_{context_file_name}_{self.prompt_llm.get_chat_model()}.json", 'w') as f:
-            json.dump(target_dataset, f, indent=2)
+        if len(target_dataset) < self.num_of_generations:
+            print(f"every article has been used, {len(target_dataset)} distinct questions generated")
+
+        with self.stage_metrics.span("save_questions"):
+            write_rows(f"{generation_file_path}/questions_{self.context_name}_{context_file_name}_{self.prompt_llm.get_chat_model()}{self.dataset_extension}", target_dataset)
+
+        progress_bar.close()
+        self.stage_metrics.save()
+        self.stage_metrics.print_summary()
@@ -1,4 +1,3 @@
-import tiktoken
 from typing import List, Union, Dict
 from HandleExceptions import CollatedExceptions
 from PromptLLM import PromptLLM
@@ -113,18 +112,21 @@ class QaGeneration():
             return dataset
 
         source: str = ensure_string(dataset[source_key], "")
+        suffix = ""
         if (context_key != "" and context_key in dataset):
+            # Only the context is cut to fit the context window, the question is always sent
             context = ensure_string(dataset[context_key], "")
-            source = f"context: {context} question: {source}"
+            suffix = f" question: {source}"
+            source = f"context: {context}"
         try:
             result = self.prompt_llm.prompt_model(
-                definition, source, temp=temp, max_tokens=max_tokens)
+                definition, source, temp=temp, max_tokens=max_tokens, suffix=suffix)
             dataset[result_key] = result
 
         except Exception as e:
             exception_content = {
                 "definition": definition,
-                "source": source,
+                "source": source + suffix,
             }
             handle_exceptions.store_exceptions(exception_content, str(e))
 
@@ -171,12 +173,10 @@ class QaGeneration():
 
         try:
             # Check number of tokens
-            encoding = tiktoken.get_encoding("r50k_base")
-            if len(encoding.encode(source)) > intended_input_tokens:
-                source_list: List = self.split_chunks(
-                    source, intended_input_tokens, encoding)
+            if self.prompt_llm.token_budget.count(source) > intended_input_tokens:
+                source_list: List = self.prompt_llm.token_budget.chunk(source, intended_input_tokens)
             else:
-                source_list: List = list(source)
+                source_list: List = [source]
 
             result = ""
             for source in source_list:
@@ -232,30 +232,6 @@ class QaGeneration():
             output_list.append(str(item).splitlines())
         return output_list
 
-    @staticmethod
-    def split_chunks(source: str | List, intended_input_tokens: int, encoding: tiktoken.Encoding) -> List[str]:
-        """
-        split text by tokens
-
-        Args:
-            source (str | List): text in string or list format
-            intended_input_tokens (int): intended tokens for the summary chunks to be within
-            encoding (tiktoken.Encoding): encoding for calculating tokens
-
-        Returns:
-            List[str]: list representation of summaries splitted into chunks
-        """
-        output_List = []
-        current_string = ""
-        source = ensure_List_string(source)
-        for item in source:
-            if len(encoding.encode(current_string + item)) < intended_input_tokens / 2:
-                current_string += item
-            else:
-                output_List.append(current_string)
-                current_string = ""
-        return output_List
-
     @staticmethod
     def check_present(item_list: List, target: str) -> bool:
         """
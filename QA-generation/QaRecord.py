@@ -0,0 +1,162 @@
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List
+from DatasetStream import DatasetReader
+
+"""
+Compact in-memory rows for questions and answers. Every question on an article carries its own copy of the article
+and of the definition once parsed from a file, so a loaded dataset holds each article several times over.
+A QaRecord stores the article, definition and summaries of the article by id into a TextPool instead,
+each distinct text is held once however many rows refer to it. Sentence lists under those keys, as in answers files,
+are kept with each sentence interned.
+
+QaRecord behaves as the dict it replaces, row["context"], "context" in row, row.get, row.update, and is written
+out with the same keys in the same order, so files and code reading rows are unchanged
+"""
+
+# Keys holding texts shared by many rows
+interned_keys = frozenset(["definition", "context", "point_form_context", "concise_context"])
+
+
+class TextPool():
+    """
+    Distinct texts, each stored once and referenced by id
+    """
+    def __init__(self):
+        self.texts: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add(self, text: str) -> int:
+        """
+        Id of the text, added on first use
+        """
+        text_id = self.ids.get(text, None)
+        if text_id is not None:
+            return text_id
+        with self.lock:
+            if text not in self.ids:
+                self.ids[text] = len(self.texts)
+                self.texts.append(text)
+            return self.ids[text]
+
+    def get(self, text_id: int) -> str:
+        """
+        Text with the given id
+        """
+        return self.texts[text_id]
+
+    def intern(self, text: str) -> str:
+        """
+        The stored copy of the text, so equal texts share memory
+        """
+        return self.texts[self.add(text)]
+
+
+_default_pool: TextPool | None = None
+
+
+def get_pool() -> TextPool:
+    """
+    Text pool shared within the process
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = TextPool()
+    return _default_pool
+
+
+class QaRecord(MutableMapping):
+    """
+    A row of a questions or answers dataset, with shared texts held by id in a TextPool
+    """
+    __slots__ = ("pool", "fields")
+
+    def __init__(self, row: Dict | None = None, pool: TextPool | None = None):
+        """
+        Constructor for QaRecord
+
+        Args:
+            row (Dict | None, optional): fields of the row. Defaults to an empty row.
+            pool (TextPool | None, optional): pool of the shared texts. Defaults to the pool shared within the process.
+        """
+        self.pool = pool if pool is not None else get_pool()
+        self.fields: Dict[str, Any] = {}
+        if row is not None:
+            for key, value in row.items():
+                self[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.fields[key]
+        # Ids only ever stand in for texts under the interned keys
+        if type(value) is int and key in interned_keys:
+            return self.pool.get(value)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in interned_keys:
+            if isinstance(value, str):
+                value = self.pool.add(value)
+            elif isinstance(value, list):
+                value = [self.pool.intern(item) if isinstance(item, str) else item for item in value]
+        self.fields[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self.fields[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.fields
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The row as a dict, with the same keys in the same order as it was read
+        """
+        return {key: self[key] for key in self.fields}
+
+    def text_id(self, key: str) -> int | None:
+        """
+        Id of the text under an interned key, rows with the same id share the text. None when it is not a text
+        """
+        value = self.fields.get(key, None)
+        return value if type(value) is int and key in interned_keys else None
+
+
+def iter_records(rows: Iterable[Dict], pool: TextPool | None = None) -> Iterator[QaRecord]:
+    """
+    Rows as QaRecords, taken lazily
+
+    Args:
+        rows (Iterable[Dict]): rows, eg. from DatasetReader
+        pool (TextPool | None, optional): pool of the shared texts. Defaults to the pool shared within the process.
+
+    Returns:
+        Iterator[QaRecord]: the records
+    """
+    for row in rows:
+        yield QaRecord(row, pool)
+
+
+def load_records(path: str, pool: TextPool | None = None) -> List[QaRecord]:
+    """
+    Loads every row of a dataset as QaRecords, a row at a time, so duplicated texts are never all held at once
+
+    Args:
+        path (str): path of the dataset
+        pool (TextPool | None, optional): pool of the shared texts. Defaults to the pool shared within the process.
+
+    Returns:
+        List[QaRecord]: the records
+    """
+    return list(iter_records(DatasetReader(path), pool))
@@ -0,0 +1,95 @@
+from typing import Callable, List, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+class QuestionIndex():
+    """
+    Incremental index of question embeddings, used to reject questions that are near duplicates
+    of questions already generated. Embeddings are normalised, so cosine similarity is a dot product
+    """
+    def __init__(
+        self,
+        get_embedder: Callable[[], "SentenceTransformer"],
+        threshold: float = 0.9,
+        batch_size: int = 64
+    ):
+        """
+        Constructor for QuestionIndex
+
+        Args:
+            get_embedder (Callable[[], SentenceTransformer]): returns the sentence transformer, called on first use
+            threshold (float, optional): questions with a cosine similarity above this are rejected. Defaults to 0.9.
+            batch_size (int, optional): batch size for embedding. Defaults to 64.
+        """
+        self.get_embedder = get_embedder
+        self.threshold = threshold
+        self.batch_size = batch_size
+
+        self.embeddings: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        self.size: int = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def embed(self, questions: List[str]) -> np.ndarray:
+        """
+        Normalised embeddings of the questions
+
+        Args:
+            questions (List[str]): questions to embed
+
+        Returns:
+            np.ndarray: (len(questions), dim) embeddings
+        """
+        return self.get_embedder().encode(
+            questions,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32)
+
+    def append(self, embedding: np.ndarray) -> None:
+        """
+        Adds an embedding to the index, doubling its capacity when full
+
+        Args:
+            embedding (np.ndarray): normalised embedding
+        """
+        if self.size == 0 and self.embeddings.shape[1] != embedding.shape[0]:
+            self.embeddings = np.zeros((64, embedding.shape[0]), dtype=np.float32)
+        if self.size == self.embeddings.shape[0]:
+            self.embeddings = np.concatenate([self.embeddings, np.zeros_like(self.embeddings)])
+        self.embeddings[self.size] = embedding
+        self.size += 1
+
+    def add(self, questions: List[str], filter_duplicates: bool = True) -> List[bool]:
+        """
+        Adds questions to the index, rejecting near duplicates of questions already within it,
+        including the ones earlier in the same list
+
+        Args:
+            questions (List[str]): questions to add
+            filter_duplicates (bool, optional): when False, every question is added. Defaults to True.
+
+        Returns:
+            List[bool]: whether each question was added
+        """
+        if len(questions) == 0:
+            return []
+
+        new_embeddings = self.embed(questions)
+        added: List[bool] = []
+        for embedding in new_embeddings:
+            is_duplicate = (
+                filter_duplicates
+                and self.size > 0
+                and float(np.max(self.embeddings[:self.size] @ embedding)) > self.threshold
+            )
+            if not is_duplicate:
+                self.append(embedding)
+            added.append(not is_duplicate)
+        return added
@@ -0,0 +1,198 @@
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+from SentenceStore import text_hash
+
+if TYPE_CHECKING:
+    from bert_score import BERTScorer
+
+"""
+BERTScore with the reference side computed once per context. Every question of an article is scored against the
+same context sentences, so the contextual token embeddings and idf weights of the reference sentences are kept,
+keyed by the hash of the reference window, and each candidate sentence is greedily matched against the kept tensors.
+BERTScorer.score encodes the references again for every candidate.
+
+Scores are those of BERTScorer.score([cand], [ref_window]) for each candidate: the best F1 over the reference
+sentences, rescaled with the baseline when the scorer is
+"""
+
+
+class ReferenceScorer():
+    """
+    Scores candidate sentences against reference windows, with the reference embeddings cached per window
+    """
+    def __init__(self, scorer: "BERTScorer", max_references: int = 32):
+        """
+        Constructor for ReferenceScorer
+
+        Args:
+            scorer (BERTScorer): loaded bert scorer, for its model, tokenizer, idf and baseline
+            max_references (int, optional): reference windows kept, least recently used are dropped first.
+                An article of 50 sentences takes about 8MB with roberta-large. Defaults to 32.
+        """
+        self.scorer = scorer
+        self.max_references = max_references
+        self.lock = threading.Lock()
+        self.references: "OrderedDict[str, Future]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if scorer.idf:
+            self.idf_dict = scorer._idf_dict
+        else:
+            # Same weights as BERTScorer.score without idf, special tokens are left out
+            self.idf_dict = defaultdict(lambda: 1.0)
+            self.idf_dict[scorer._tokenizer.sep_token_id] = 0
+            self.idf_dict[scorer._tokenizer.cls_token_id] = 0
+
+    def embed(self, sentences: List[str]) -> Tuple[Any, Any, Any]:
+        """
+        Token embeddings of the sentences, normalised for cosine similarity
+
+        Args:
+            sentences (List[str]): sentences to embed
+
+        Returns:
+            Tuple[Any, Any, Any]: embeddings, token mask and idf weights summing to 1 per sentence, padded to the longest sentence
+        """
+        import torch
+        from bert_score.utils import get_bert_embedding
+
+        embedding, mask, idf = get_bert_embedding(
+            sentences,
+            self.scorer._model,
+            self.scorer._tokenizer,
+            self.idf_dict,
+            batch_size=self.scorer.batch_size,
+            device=self.scorer.device
+        )
+        embedding = embedding / torch.norm(embedding, dim=-1, keepdim=True)
+        idf = idf / idf.sum(dim=1, keepdim=True)
+        return embedding, mask.float(), idf
+
+    def reference(self, ref_window: List[str]) -> Tuple[Any, Any, Any]:
+        """
+        Embeddings of the reference window, computed on first use. Threads asking for a window being computed wait for it
+
+        Args:
+            ref_window (List[str]): reference sentences
+
+        Returns:
+            Tuple[Any, Any, Any]: as embed
+        """
+        key = text_hash("\n".join(ref_window))
+        with self.lock:
+            future = self.references.get(key, None)
+            is_owner = future is None
+            if is_owner:
+                self.misses += 1
+                future = self.references[key] = Future()
+                while len(self.references) > self.max_references:
+                    self.references.popitem(last=False)
+            else:
+                self.hits += 1
+                self.references.move_to_end(key)
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = self.embed(ref_window)
+        except BaseException as e:
+            with self.lock:
+                self.references.pop(key, None)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def score_windows(self, windows: List[Tuple[List[str], List[str]]]) -> List[List[float]]:
+        """
+        Scores every candidate sentence against its reference window, candidates of all windows are embedded together
+
+        Args:
+            windows (List[Tuple[List[str], List[str]]]): candidate sentences and reference sentences of each window
+
+        Returns:
+            List[List[float]]: F1 of each candidate sentence, per window
+        """
+        import torch
+
+        cands = [cand for cand_window, _ in windows for cand in cand_window]
+        if len(cands) == 0:
+            return [[] for _ in windows]
+
+        with torch.no_grad():
+            hyp_embedding, hyp_mask, hyp_idf = self.embed(cands)
+
+            results, start = [], 0
+            for cand_window, ref_window in windows:
+                end = start + len(cand_window)
+                if len(cand_window) == 0:
+                    results.append([])
+                    continue
+                ref_embedding, ref_mask, ref_idf = self.reference(ref_window)
+                F = self.greedy_match(
+                    hyp_embedding[start:end], hyp_mask[start:end], hyp_idf[start:end],
+                    ref_embedding, ref_mask, ref_idf
+                )
+                # Best reference for each candidate, as BERTScorer does for a list of references
+                F = F.max(dim=1)[0]
+                if self.scorer.rescale_with_baseline:
+                    baseline = self.scorer.baseline_vals[2].item()
+                    F = (F - baseline) / (1 - baseline)
+                results.append(F.tolist())
+                start = end
+        return results
+
+    def score_window(self, cand_window: List[str], ref_window: List[str]) -> List[float]:
+        """
+        Scores each candidate sentence against the reference window
+
+        Args:
+            cand_window (List[str]): candidate sentences
+            ref_window (List[str]): reference sentences
+
+        Returns:
+            List[float]: F1 of each candidate sentence
+        """
+        return self.score_windows([(cand_window, ref_window)])[0]
+
+    @staticmethod
+    def greedy_match(
+        hyp_embedding: Any,
+        hyp_mask: Any,
+        hyp_idf: Any,
+        ref_embedding: Any,
+        ref_mask: Any,
+        ref_idf: Any
+    ) -> Any:
+        """
+        Greedy cosine matching of every candidate against every reference, as bert_score.utils.greedy_cos_idf
+
+        Returns:
+            Any: F1 tensor of candidates by references
+        """
+        import torch
+
+        # candidates x references x candidate tokens x reference tokens
+        sim = torch.einsum("chd,rld->crhl", hyp_embedding, ref_embedding)
+        sim = sim * (hyp_mask[:, None, :, None] * ref_mask[None, :, None, :])
+
+        P = (sim.max(dim=3)[0] * hyp_idf[:, None, :]).sum(dim=2)
+        R = (sim.max(dim=2)[0] * ref_idf[None, :, :]).sum(dim=2)
+
+        # Sentences of only special tokens score 0
+        P = P.masked_fill(hyp_mask.sum(dim=1).eq(2)[:, None], 0.0)
+        R = R.masked_fill(ref_mask.sum(dim=1).eq(2)[None, :], 0.0)
+        F = 2 * P * R / (P + R)
+        return F.masked_fill(torch.isnan(F), 0.0)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Reference windows kept, and lookups that reused or computed one
+        """
+        with self.lock:
+            return {"references": len(self.references), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+"""
+Sentence boundaries are computed once per text, keyed by the sha256 of the text, and kept as character offsets.
+Articles are shared by many questions, so evaluation, perplexity and more-eval reuse the stored spans instead of
+running punkt on the same text again. With a path, spans are appended to a JSONL file next to the corpus,
+precomputed for every article with sentence-store.py
+
+punkt: nltk's punkt tokenizer, gives the same sentences as nltk.sent_tokenize
+fast: a regex splitter on sentence end punctuation, for bulk jobs where punkt is too slow
+"""
+
+Span = Tuple[int, int]
+
+# End punctuation, optionally closed by quotes or brackets, followed by whitespace and the start of a sentence
+_fast_boundary = re.compile(r"""[.!?]['"’”)\]]*\s+(?=['"‘“(\[]?[A-Z0-9])""")
+
+
+def text_hash(text: str) -> str:
+    """
+    sha256 of the text, the key of its spans
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fast_spans(text: str) -> List[Span]:
+    """
+    Splits text into sentences on end punctuation followed by a capitalised word, with no abbreviation handling
+
+    Args:
+        text (str): text to split
+
+    Returns:
+        List[Span]: start and end offset of each sentence
+    """
+    spans: List[Span] = []
+    start = 0
+    for match in _fast_boundary.finditer(text):
+        end = match.start() + len(match.group().rstrip())
+        spans.append((start, end))
+        start = match.end()
+    if text[start:].strip() != "":
+        spans.append((start, len(text.rstrip())))
+    return [(start, end) for start, end in spans if text[start:end].strip() != ""]
+
+
+_punkt: Any = None
+
+
+def punkt_spans(text: str) -> List[Span]:
+    """
+    Splits text into sentences with nltk's punkt tokenizer.
+    punkt has to be available locally, nothing is downloaded: python3 -m nltk.downloader punkt
+
+    Args:
+        text (str): text to split
+
+    Raises:
+        LookupError: when punkt is not installed
+
+    Returns:
+        List[Span]: start and end offset of each sentence
+    """
+    global _punkt
+    if _punkt is None:
+        import nltk
+
+        # Same tokenizer as nltk.sent_tokenize, nltk 3.8.2 onwards reads punkt_tab instead of the punkt pickle
+        try:
+            try:
+                from nltk.tokenize import _get_punkt_tokenizer
+                _punkt = _get_punkt_tokenizer("english")
+            except ImportError:
+                _punkt = nltk.data.load("tokenizers/punkt/english.pickle")
+        except LookupError:
+            raise LookupError("nltk punkt not found, install it with: python3 -m nltk.downloader punkt punkt_tab")
+
+    return list(_punkt.span_tokenize(text))
+
+
+class SentenceStore():
+    """
+    Sentence spans of texts, computed once per text hash
+    """
+    splitters = {"punkt": punkt_spans, "fast": fast_spans}
+
+    def __init__(self, path: str = "", splitter: str = "punkt"):
+        """
+        Constructor for SentenceStore, loading the spans already stored at path
+
+        Args:
+            path (str, optional): JSONL file of stored spans, spans are only kept in memory when blank. Defaults to "".
+            splitter (str, optional): "punkt" or "fast", for texts not stored yet. Defaults to "punkt".
+        """
+        if splitter not in self.splitters:
+            print(f"{splitter} is not a supported splitter, use punkt or fast")
+            exit()
+
+        self.path = path
+        self.splitter = splitter
+        self.spans: Dict[str, List[Span]] = {}
+        self.pending: List[str] = []
+        self.lock = threading.Lock()
+
+        if path != "" and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip() == "":
+                        continue
+                    entry = json.loads(line)
+                    # Spans from a different splitter are computed again
+                    if entry.get("splitter", "punkt") == splitter:
+                        self.spans[entry["sha256"]] = [tuple(span) for span in entry["spans"]]
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def get_spans(self, text: str, persist: bool = True) -> List[Span]:
+        """
+        Sentence spans of the text, computed on first use
+
+        Args:
+            text (str): text to split
+            persist (bool, optional): When False, the spans are only kept in memory, for texts that do not come up
+                again in other runs, eg. answers. Defaults to True.
+
+        Returns:
+            List[Span]: start and end offset of each sentence
+        """
+        key = text_hash(text)
+        with self.lock:
+            spans = self.spans.get(key, None)
+        if spans is not None:
+            return spans
+
+        spans = self.splitters[self.splitter](text)
+        with self.lock:
+            if key not in self.spans:
+                self.spans[key] = spans
+                if persist:
+                    self.pending.append(key)
+        return spans
+
+    def split(self, text: str, persist: bool = True) -> List[str]:
+        """
+        Splits text into sentences
+
+        Args:
+            text (str): text to split
+            persist (bool, optional): When False, the spans are only kept in memory, see get_spans. Defaults to True.
+
+        Returns:
+            List[str]: list of sentences
+        """
+        return [text[start:end] for start, end in self.get_spans(text, persist)]
+
+    def save(self) -> None:
+        """
+        Appends the spans computed since the last save to the JSONL file
+        """
+        with self.lock:
+            if self.path == "" or len(self.pending) == 0:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                for key in self.pending:
+                    f.write(json.dumps({"sha256": key, "splitter": self.splitter, "spans": self.spans[key]}) + "\n")
+            self.pending = []
+
+
+_default_store: SentenceStore | None = None
+
+
+def get_store() -> SentenceStore:
+    """
+    Sentence store shared within the process, in memory only unless opened with open_store
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = SentenceStore()
+    return _default_store
+
+
+def open_store(path: str, splitter: str = "punkt") -> SentenceStore:
+    """
+    Replaces the shared sentence store with one stored at path
+
+    Args:
+        path (str): JSONL file of stored spans
+        splitter (str, optional): "punkt" or "fast". Defaults to "punkt".
+
+    Returns:
+        SentenceStore: the shared store
+    """
+    global _default_store
+    _default_store = SentenceStore(path, splitter)
+    return _default_store
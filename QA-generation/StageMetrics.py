@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+
+class StageMetrics():
+    """
+    Collects timing spans and token counts for each stage of a generation run.
+    Spans are exported as JSONL events, or as a Prometheus textfile, when a directory is given
+    """
+    def __init__(self, directory: str = "", export_format: str = "jsonl"):
+        """
+        Constructor for StageMetrics
+
+        Args:
+            directory (str, optional): Directory to store the metrics, nothing is written when blank. Defaults to "".
+            export_format (str, optional): "jsonl" for an event per span, "prometheus" for a textfile. Defaults to "jsonl".
+        """
+        if export_format not in ["jsonl", "prometheus"]:
+            print(f"{export_format} is not a supported metrics format, use jsonl or prometheus")
+            exit()
+
+        self.export_format = export_format
+        self.file_path: str = self.generate_file_path(directory) if directory != "" else ""
+
+        self.spans: Dict[str, List[float]] = {}
+        self.tokens: Dict[str, Dict[str, int]] = {}
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def generate_file_path(self, directory: str) -> str:
+        """
+        Generates a new file path for metrics, with datetime included
+
+        Args:
+            directory (str): Directory to decorate
+
+        Returns:
+            str: File path generated
+        """
+        current_datetime = datetime.now()
+        formatted_datetime = current_datetime.strftime("%Y-%m-%d-%H:%M:%S")
+        extension = "jsonl" if self.export_format == "jsonl" else "prom"
+
+        return f"{directory}/metrics_{formatted_datetime}.{extension}"
+
+    def active_spans(self) -> List[Dict]:
+        """
+        Returns the spans currently open in this thread, innermost last
+        """
+        if not hasattr(self.local, "active"):
+            self.local.active = []
+        return self.local.active
+
+    @contextmanager
+    def span(self, stage: str, **labels) -> Iterator[Dict]:
+        """
+        Times the enclosed block as a stage
+
+        Args:
+            stage (str): name of the stage
+            labels: extra fields stored with the event, eg. the row index
+
+        Yields:
+            Iterator[Dict]: the event being recorded
+        """
+        active = self.active_spans()
+        event = {
+            "stage": stage,
+            "parent": active[-1]["stage"] if len(active) > 0 else "",
+            **labels,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+        active.append(event)
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event["duration"] = time.perf_counter() - start
+            active.pop()
+            self.record(event)
+
+    def add_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        Adds token usage of a completion to the innermost open span
+
+        Args:
+            prompt_tokens (int): tokens in the prompt
+            completion_tokens (int): tokens generated
+        """
+        active = self.active_spans()
+        if len(active) == 0:
+            return
+        active[-1]["prompt_tokens"] += prompt_tokens
+        active[-1]["completion_tokens"] += completion_tokens
+
+    def record(self, event: Dict) -> None:
+        """
+        Stores a finished span, and appends it to the JSONL file
+
+        Args:
+            event (Dict): finished span
+        """
+        with self.lock:
+            stage = event["stage"]
+            self.spans.setdefault(stage, []).append(event["duration"])
+            tokens = self.tokens.setdefault(stage, {"prompt_tokens": 0, "completion_tokens": 0})
+            tokens["prompt_tokens"] += event["prompt_tokens"]
+            tokens["completion_tokens"] += event["completion_tokens"]
+
+            if self.file_path != "" and self.export_format == "jsonl":
+                with open(self.file_path, "a") as f:
+                    f.write(json.dumps(event) + "\n")
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Summary of every stage
+
+        Returns:
+            Dict[str, Dict]: count, total, mean, p50, p95 and tokens for each stage
+        """
+        with self.lock:
+            return {
+                stage: {
+                    "count": len(spans),
+                    "total": sum(spans),
+                    "mean": sum(spans) / len(spans),
+                    "p50": self.percentile(spans, 50),
+                    "p95": self.percentile(spans, 95),
+                    **self.tokens[stage]
+                }
+                for stage, spans in self.spans.items()
+            }
+
+    def save(self) -> None:
+        """
+        Writes the Prometheus textfile, JSONL events are already written as they happen
+        """
+        if self.file_path == "" or self.export_format != "prometheus":
+            return
+
+        lines = [
+            "# HELP qa_stage_duration_seconds Time spent in each stage",
+            "# TYPE qa_stage_duration_seconds summary"
+        ]
+        summary = self.summary()
+        for stage, stats in summary.items():
+            lines.append(f'qa_stage_duration_seconds{{stage="{stage}",quantile="0.5"}} {stats["p50"]}')
+            lines.append(f'qa_stage_duration_seconds{{stage="{stage}",quantile="0.95"}} {stats["p95"]}')
+            lines.append(f'qa_stage_duration_seconds_sum{{stage="{stage}"}} {stats["total"]}')
+            lines.append(f'qa_stage_duration_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines += [
+            "# HELP qa_stage_tokens_total Tokens used by completions in each stage",
+            "# TYPE qa_stage_tokens_total counter"
+        ]
+        for stage, stats in summary.items():
+            lines.append(f'qa_stage_tokens_total{{stage="{stage}",type="prompt"}} {stats["prompt_tokens"]}')
+            lines.append(f'qa_stage_tokens_total{{stage="{stage}",type="completion"}} {stats["completion_tokens"]}')
+
+        # Written to a temporary file first, so the textfile collector never reads a partial file
+        with open(f"{self.file_path}.tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{self.file_path}.tmp", self.file_path)
+
+    def print_summary(self) -> None:
+        """
+        Prints the summary of every stage as a table
+        """
+        print(f"{'stage':<28}{'count':>7}{'total(s)':>11}{'mean(s)':>10}{'p50(s)':>10}{'p95(s)':>10}{'prompt tok':>12}{'compl tok':>12}")
+        for stage, stats in self.summary().items():
+            print(
+                f"{stage:<28}{stats['count']:>7}{stats['total']:>11.3f}{stats['mean']:>10.3f}"
+                f"{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['prompt_tokens']:>12}{stats['completion_tokens']:>12}"
+            )
+
+    @staticmethod
+    def percentile(values: List[float], percent: float) -> float:
+        """
+        Nearest rank percentile
+
+        Args:
+            values (List[float]): values to work on
+            percent (float): percentile, between 0 and 100
+
+        Returns:
+            float: the percentile value, 0 when there are no values
+        """
+        if len(values) == 0:
+            return 0
+        ordered = sorted(values)
+        rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+        return ordered[min(rank, len(ordered)) - 1]
@@ -0,0 +1,158 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+class StagePipeline():
+    """
+    Runs items through a sequence of stages, each with its own pool of worker threads.
+    Stages are joined by bounded queues, so a slow stage holds back the stages before it instead of
+    letting work pile up, and network bound and compute bound stages run at the same time.
+    Throughput approaches that of the slowest stage, rather than the sum of all stages
+    """
+    # Marks the end of the items on a queue
+    done = object()
+
+    def __init__(self, queue_size: int = 16):
+        """
+        Constructor for StagePipeline
+
+        Args:
+            queue_size (int, optional): max items waiting in front of each stage. Defaults to 16.
+        """
+        self.queue_size = max(queue_size, 1)
+        self.stages: List[Tuple[str, Callable[[Any], Any], int]] = []
+
+        self.errors: List[BaseException] = []
+        self.failed = threading.Event()
+
+    def add_stage(self, name: str, function: Callable[[Any], Any], num_of_workers: int = 1) -> "StagePipeline":
+        """
+        Adds a stage after the current last stage
+
+        Args:
+            name (str): name of the stage, for the worker threads
+            function (Callable[[Any], Any]): takes an item and returns the item passed to the next stage
+            num_of_workers (int, optional): threads running the stage. Defaults to 1.
+
+        Returns:
+            StagePipeline: the pipeline, so stages can be chained
+        """
+        self.stages.append((name, function, max(num_of_workers, 1)))
+        return self
+
+    def worker(self, function: Callable[[Any], Any], inbox: queue.Queue, outbox: queue.Queue | None) -> None:
+        """
+        Takes items from the inbox until the end is marked, passing each result to the outbox
+        """
+        while True:
+            item = inbox.get()
+            if item is self.done:
+                return
+            # After a failure, items are drained without being worked on, so every thread can finish
+            if self.failed.is_set():
+                continue
+            try:
+                result = function(item)
+            except BaseException as e:
+                self.errors.append(e)
+                self.failed.set()
+                continue
+            if outbox is not None:
+                outbox.put(result)
+
+    def run(self, items: Iterable[Any]) -> None:
+        """
+        Runs every item through all the stages, returning when the last stage has finished
+
+        Args:
+            items (Iterable[Any]): items for the first stage, taken lazily as the first queue has room
+
+        Raises:
+            BaseException: the first exception raised by a stage, once every thread has stopped
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        pools: List[List[threading.Thread]] = []
+        for index, (name, function, num_of_workers) in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            pool = [
+                threading.Thread(target=self.worker, args=(function, queues[index], outbox), name=f"{name}-{worker}", daemon=True)
+                for worker in range(num_of_workers)
+            ]
+            for thread in pool:
+                thread.start()
+            pools.append(pool)
+
+        for item in items:
+            if self.failed.is_set():
+                break
+            queues[0].put(item)
+
+        # Each stage is closed once the stage before it has finished
+        for index, pool in enumerate(pools):
+            for _ in pool:
+                queues[index].put(self.done)
+            for thread in pool:
+                thread.join()
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+
+class SharedResults():
+    """
+    Results shared between items of a pipeline, eg. the summary of an article asked for by many questions.
+    The first item to ask for a key computes it, items asking while it is being computed wait for it
+    """
+    def __init__(self, results: Dict[str, Any] | None = None):
+        """
+        Constructor for SharedResults
+
+        Args:
+            results (Dict[str, Any] | None, optional): results already known. Defaults to None.
+        """
+        self.lock = threading.Lock()
+        self.futures: Dict[str, Future] = {}
+        for key, value in (results or {}).items():
+            self.futures[key] = Future()
+            self.futures[key].set_result(value)
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return key in self.futures
+
+    def get(self, key: str, compute: Callable[[], Any], keep: Callable[[Any], bool] = lambda result: True) -> Any:
+        """
+        Returns the result for the key, computing it when no other item has
+
+        Args:
+            key (str): key of the result
+            compute (Callable[[], Any]): computes the result
+            keep (Callable[[Any], bool], optional): whether a result is kept for later items, failed results
+                are computed again by the next item that asks. Defaults to keeping every result.
+
+        Returns:
+            Any: the result
+        """
+        with self.lock:
+            future = self.futures.get(key, None)
+            is_owner = future is None
+            if is_owner:
+                future = self.futures[key] = Future()
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            with self.lock:
+                del self.futures[key]
+            future.set_exception(e)
+            raise
+        if not keep(result):
+            with self.lock:
+                del self.futures[key]
+        future.set_result(result)
+        return result
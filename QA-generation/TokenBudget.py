@@ -0,0 +1,247 @@
+import math
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple, Union
+
+
+class PromptTooLong(Exception):
+    """
+    Raised before a request is sent, when its prompt does not fit the context window of the model
+    """
+
+
+class ApproximateTokenizer():
+    """
+    Fallback when no tokenizer can be loaded, counts about 4 characters per token
+    """
+    chars_per_token = 4
+
+    def encode(self, text: str) -> List[int]:
+        return [0] * ((len(text) + self.chars_per_token - 1) // self.chars_per_token)
+
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(tokenizer_name: str) -> Any:
+    """
+    Loads a tokenizer once per process. "tiktoken:<encoding>" loads a tiktoken encoding,
+    anything else is loaded with transformers' AutoTokenizer, from the huggingface cache after the first download
+
+    Args:
+        tokenizer_name (str): name of the tokenizer
+
+    Returns:
+        Any: object with encode and decode
+    """
+    try:
+        if tokenizer_name.startswith("tiktoken:"):
+            import tiktoken
+
+            return tiktoken.get_encoding(tokenizer_name.split(":", 1)[1])
+
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+    except Exception as e:
+        print(f"tokenizer {tokenizer_name} could not be loaded ({e}), token counts are approximate")
+        return ApproximateTokenizer()
+
+
+class TokenBudget():
+    """
+    Pre-flight checks for prompts. Counts prompt tokens with a cached tokenizer for the model, and truncates,
+    chunks or rejects inputs that would not fit the context window, so no request is sent that is bound to fail
+    """
+    # Tokens taken by the chat template around the system and user messages
+    message_overhead = 8
+
+    def __init__(
+        self,
+        context_window: int = 2048,
+        tokenizer_name: str = "tiktoken:r50k_base",
+        policy: str = "truncate",
+        price_per_1k_prompt: float = 0,
+        price_per_1k_completion: float = 0
+    ):
+        """
+        Constructor for TokenBudget
+
+        Args:
+            context_window (int, optional): max prompt and completion tokens of the model. Defaults to 2048.
+            tokenizer_name (str, optional): tokenizer for the model, see get_tokenizer. Defaults to "tiktoken:r50k_base".
+            policy (str, optional): "truncate", "chunk" or "skip" for inputs that do not fit. Defaults to "truncate".
+            price_per_1k_prompt (float, optional): cost of 1000 prompt tokens. Defaults to 0.
+            price_per_1k_completion (float, optional): cost of 1000 completion tokens. Defaults to 0.
+        """
+        if policy not in ["truncate", "chunk", "skip"]:
+            print(f"{policy} is not a supported prompt policy, use truncate, chunk or skip")
+            exit()
+
+        self.context_window = context_window
+        self.tokenizer_name = tokenizer_name
+        self.policy = policy
+        self.price_per_1k_prompt = price_per_1k_prompt
+        self.price_per_1k_completion = price_per_1k_completion
+
+    @classmethod
+    def from_config(cls, model_config: Dict[str, Any]) -> "TokenBudget":
+        """
+        Creates the TokenBudget from the model's section of the QA config
+
+        Args:
+            model_config (Dict[str, Any]): section of the QA config for the model
+
+        Returns:
+            TokenBudget: budget for the model
+        """
+        return cls(
+            context_window=model_config.get("context_window", 2048),
+            tokenizer_name=model_config.get("tokenizer", "tiktoken:r50k_base"),
+            policy=model_config.get("prompt_policy", "truncate"),
+            price_per_1k_prompt=model_config.get("price_per_1k_prompt", 0),
+            price_per_1k_completion=model_config.get("price_per_1k_completion", 0)
+        )
+
+    def tokenizer(self) -> Any:
+        return get_tokenizer(self.tokenizer_name)
+
+    def count(self, text: str) -> int:
+        """
+        Number of tokens in the text
+        """
+        return len(self.tokenizer().encode(text))
+
+    def split_tokens(self, text: str, num_of_tokens: int) -> List[str]:
+        """
+        Splits text into consecutive windows of num_of_tokens tokens
+
+        Args:
+            text (str): text to split
+            num_of_tokens (int): tokens in a window
+
+        Returns:
+            List[str]: windows of the text
+        """
+        tokenizer = self.tokenizer()
+        if isinstance(tokenizer, ApproximateTokenizer):
+            width = num_of_tokens * tokenizer.chars_per_token
+            return [text[start:start + width] for start in range(0, len(text), width)]
+        tokens = tokenizer.encode(text)
+        return [tokenizer.decode(tokens[start:start + num_of_tokens]) for start in range(0, len(tokens), num_of_tokens)]
+
+    def truncate(self, text: str, num_of_tokens: int) -> str:
+        """
+        Keeps the first num_of_tokens tokens of the text
+        """
+        windows = self.split_tokens(text, num_of_tokens)
+        return windows[0] if len(windows) > 0 else ""
+
+    def chunk(self, text: str, num_of_tokens: int) -> List[str]:
+        """
+        Splits text into chunks of at most num_of_tokens tokens, on line breaks where possible
+
+        Args:
+            text (str): text to split
+            num_of_tokens (int): max tokens in a chunk
+
+        Returns:
+            List[str]: chunks of the text
+        """
+        chunk_list: List[str] = []
+        current_lines: List[str] = []
+        current_tokens = 0
+        for line in text.splitlines(keepends=True):
+            line_tokens = self.count(line)
+            if line_tokens > num_of_tokens:
+                # Lines too long for a chunk are split by tokens, each window a chunk of its own
+                if len(current_lines) > 0:
+                    chunk_list.append("".join(current_lines))
+                    current_lines, current_tokens = [], 0
+                chunk_list += self.split_tokens(line, num_of_tokens)
+                continue
+            if current_tokens + line_tokens > num_of_tokens and len(current_lines) > 0:
+                chunk_list.append("".join(current_lines))
+                current_lines, current_tokens = [], 0
+            current_lines.append(line)
+            current_tokens += line_tokens
+        if len(current_lines) > 0:
+            chunk_list.append("".join(current_lines))
+        return chunk_list
+
+    def prompt_tokens(self, definition: str, prompt: str) -> int:
+        """
+        Tokens in the system and user messages of a request
+        """
+        return self.count(definition) + self.count(prompt) + self.message_overhead
+
+    def input_budget(self, definition: str, max_tokens: int) -> int:
+        """
+        Tokens left for the input, once the definition, prompt template and completion are accounted for
+        """
+        return self.context_window - max_tokens - self.prompt_tokens(definition, "Input:\nOutput:")
+
+    def fit(self, definition: str, input: str, max_tokens: int, suffix: str = "") -> List[str]:
+        """
+        Fits an input into the context window according to the policy. Only the input is truncated or chunked,
+        the suffix, eg. the question asked about a context, is kept whole at the end of every input sent
+
+        Args:
+            definition (str): system prompt of the request
+            input (str): input of the request
+            max_tokens (int): max tokens to generate
+            suffix (str, optional): end of the input, never cut. Defaults to "".
+
+        Raises:
+            PromptTooLong: when the input does not fit and the policy is skip, or the definition and suffix alone do not fit
+
+        Returns:
+            List[str]: inputs to send, each ending with the suffix, more than one when chunked
+        """
+        budget = self.input_budget(definition, max_tokens)
+        if suffix != "":
+            budget -= self.count(suffix)
+        if budget <= 0:
+            raise PromptTooLong(
+                f"definition, suffix and max_tokens={max_tokens} leave no room for the input in {self.context_window} tokens")
+
+        input_tokens = self.count(input)
+        if input_tokens <= budget:
+            return [input + suffix]
+        if self.policy == "truncate":
+            return [self.truncate(input, budget) + suffix]
+        if self.policy == "chunk":
+            return [chunk + suffix for chunk in self.chunk(input, budget)]
+        raise PromptTooLong(f"input of {input_tokens} tokens is over the budget of {budget} tokens")
+
+    def estimate(self, requests: List[Tuple[str, Union[str, int], int]]) -> Dict[str, Any]:
+        """
+        Estimated token volume and cost of a list of requests, completions are counted at max_tokens
+
+        Args:
+            requests (List[Tuple[str, Union[str, int], int]]): definition, input and max_tokens of each request.
+                The input can be given as a number of tokens, for outputs of earlier requests
+
+        Returns:
+            Dict[str, Any]: requests, prompt_tokens, completion_tokens, cost and number of inputs over budget
+        """
+        report = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "over_budget": 0}
+        for definition, input, max_tokens in requests:
+            budget = self.input_budget(definition, max_tokens)
+            input_tokens = input if isinstance(input, int) else self.count(input)
+            if budget <= 0 or (input_tokens > budget and self.policy == "skip"):
+                report["over_budget"] += 1
+                continue
+            if input_tokens > budget:
+                report["over_budget"] += 1
+
+            num_of_requests = math.ceil(input_tokens / budget) if self.policy == "chunk" else 1
+            template_tokens = self.context_window - max_tokens - budget
+            report["requests"] += num_of_requests
+            report["prompt_tokens"] += num_of_requests * template_tokens + (
+                input_tokens if self.policy == "chunk" else min(input_tokens, budget))
+            report["completion_tokens"] += num_of_requests * max(max_tokens, 0)
+
+        report["cost"] = (
+            report["prompt_tokens"] / 1000 * self.price_per_1k_prompt
+            + report["completion_tokens"] / 1000 * self.price_per_1k_completion
+        )
+        return report
@@ -0,0 +1,86 @@
+import argparse
+import time
+
+from CorpusIndex import CorpusIndex
+from evaluation import Evaluation
+from HandleExceptions import CollatedExceptions
+from SentenceStore import get_store, open_store
+
+"""
+Builds the corpus-wide sentence embedding index over every article in the context directory.
+Once built, set corpus_index_path under file_config in the QA config, and answer generation
+stores the nearest source articles of every answer sentence.
+
+usage:
+python3 corpus-index.py \
+    --context_dir str (optional) \
+    --output_path str (optional) \
+    --logs_dir str (optional) \
+    --batch_size int (optional) \
+    --sentence_store_path str (optional) \
+    --backend auto|hnsw|exact (optional)
+"""
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--context_dir",
+        type=str,
+        default="../data/context",
+        help="directory of the contexts to index",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="../data/context/corpus_index",
+        help="path to save the index to, without the .npz",
+    )
+    parser.add_argument(
+        "--logs_dir",
+        type=str,
+        default="../data/generations/logs",
+        help="directory for the error logs",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=128,
+        help="batch size for embedding",
+    )
+    parser.add_argument(
+        "--sentence_store_path",
+        type=str,
+        default="../data/context/sentences.jsonl",
+        help="JSONL file of sentence spans from sentence-store.py, new spans are appended, blank to keep them in memory",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="auto",
+        choices=["auto", "hnsw", "exact"],
+        help="search backend, hnsw needs faiss",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    open_store(args.sentence_store_path)
+    evaluation_object = Evaluation(collated_exceptions=CollatedExceptions(args.logs_dir))
+
+    start = time.perf_counter()
+    corpus_index = CorpusIndex.build(
+        context_dir=args.context_dir,
+        get_embedder=evaluation_object.get_embedder,
+        batch_size=args.batch_size,
+        backend=args.backend
+    )
+    corpus_index.save(args.output_path)
+    get_store().save()
+    print(f"{len(corpus_index)} sentences from {len(corpus_index.sources)} articles indexed in {time.perf_counter() - start:.1f}s")
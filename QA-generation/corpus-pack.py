@@ -0,0 +1,44 @@
+import argparse
+import time
+
+from PackedCorpus import PackedCorpus
+
+"""
+Packs every article in the context directory into a single memory mapped file with an offset index and metadata columns.
+Set packed_corpus_path under file_config in the QA config to the same path, and question generation draws its articles
+from it instead of parsing the context file. Pack again after scraping, context files changed since are read directly.
+
+usage:
+python3 corpus-pack.py \
+    --context_dir str (optional) \
+    --output_path str (optional)
+"""
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--context_dir",
+        type=str,
+        default="../data/context",
+        help="directory of the contexts to pack",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="../data/context/packed_corpus",
+        help="path to save the corpus to, without extension, .bin and .npz are added",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    start = time.perf_counter()
+    num_of_articles = PackedCorpus.pack(args.context_dir, args.output_path)
+    print(f"{num_of_articles} articles packed in {time.perf_counter() - start:.1f}s")
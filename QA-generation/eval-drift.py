@@ -0,0 +1,245 @@
+import argparse
+import copy
+import json
+import random
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from DatasetStream import load_rows
+from evaluation import Evaluation
+from HandleExceptions import CollatedExceptions
+
+"""
+Drift report for the int8 and onnx evaluation backends. Rows of stored datasets are evaluated again with the
+chosen backend, and *_bertScore_average and *_sentence_transformer_average are compared against the fp32 scores
+already stored (or recalculated with fp32 torch in the same run, with --recompute_baseline True),
+together with the time taken by each, so the speedup is accepted knowing how far the scores move.
+
+usage:
+python3 eval-drift.py \
+    --filepaths str|list[str] (optional) \
+    --eval_backend int8|onnx|torch (optional) \
+    --num_threads int (optional) \
+    --sample int (optional) \
+    --recompute_baseline bool (optional) \
+    --logs_dir str (optional) \
+    --output str (optional)
+"""
+
+filename_list = [
+    "../data/generations/nyt/close_book_answers_nyt_vicuna-13b-v1.3.json",
+    "../data/generations/rsis/close_book_answers_rsis_vicuna-13b-v1.3.json",
+    "../data/generations/straitstimes/close_book_answers_straitstimes_vicuna-13b-v1.3.json",
+    "../data/generations/nyt/open_book_answers_nyt_vicuna-13b-v1.3.json"
+]
+
+# (candidate key, reference key, result key)
+eval_targets = [
+    ("close_book_answer", "context", "answer"),
+    ("point_form_close_book_answer", "point_form_context", "summarised"),
+    ("open_book_answer", "concise_context", "open_book_orignals"),
+]
+
+metrics = ["bertScore", "sentence_transformer"]
+
+
+def stored_score(row: Dict, result_key: str, metric: str) -> float | None:
+    """
+    Stored average of a metric, older open book files use sentence-transformer in the key
+    """
+    for key in [f"{result_key}_{metric}_average", f"{result_key}_{metric.replace('_', '-')}_average"]:
+        if key in row:
+            return row[key]
+    return None
+
+
+def collect_rows(file_path_list: List[str], sample: int, seed: int) -> List[Tuple[Dict, str, str, str, Dict[str, float]]]:
+    """
+    Samples rows with stored scores from every file
+
+    Args:
+        file_path_list (List[str]): answer files to sample from
+        sample (int): max rows per file and target
+        seed (int): seed for the sampling
+
+    Returns:
+        List[Tuple[Dict, str, str, str, Dict[str, float]]]: row to evaluate, candidate key, reference key, result key and stored scores
+    """
+    generator = random.Random(seed)
+    rows = []
+    for file_path in file_path_list:
+        dataset = load_rows(file_path)
+        for cand_key, ref_key, result_key in eval_targets:
+            candidates = []
+            for row in dataset:
+                if cand_key not in row or ref_key not in row:
+                    continue
+                scores = {metric: stored_score(row, result_key, metric) for metric in metrics}
+                if any(score is None for score in scores.values()):
+                    continue
+                candidates.append(({cand_key: row[cand_key], ref_key: row[ref_key]}, cand_key, ref_key, result_key, scores))
+            rows += generator.sample(candidates, min(sample, len(candidates)))
+    return rows
+
+
+def evaluate_rows(evaluation_object: Evaluation, rows: List[Tuple]) -> Tuple[List[Dict[str, float]], float]:
+    """
+    Evaluates every row with the given evaluation object
+
+    Args:
+        evaluation_object (Evaluation): evaluation with the backend to measure
+        rows (List[Tuple]): rows from collect_rows
+
+    Returns:
+        Tuple[List[Dict[str, float]], float]: scores of each row, and seconds taken after the models were loaded
+    """
+    evaluation_object.get_embedder()
+    evaluation_object.get_scorer()
+
+    start = time.perf_counter()
+    results = []
+    for row, cand_key, ref_key, result_key, _ in rows:
+        dataset = evaluation_object.evaluation_generation(
+            dataset=copy.deepcopy(row),
+            cand_key=cand_key,
+            ref_key=ref_key,
+            result_key=result_key,
+            rouge=False
+        )
+        results.append({metric: dataset.get(f"{result_key}_{metric}_average", 0) for metric in metrics})
+    return results, time.perf_counter() - start
+
+
+def drift(baseline: List[float], scores: List[float]) -> Dict[str, float]:
+    """
+    Differences between the baseline and backend scores of a metric
+
+    Args:
+        baseline (List[float]): fp32 scores
+        scores (List[float]): backend scores
+
+    Returns:
+        Dict[str, float]: means, mean difference, mean, p95 and max absolute difference, and correlation
+    """
+    baseline_array = np.array(baseline, dtype=np.float64)
+    score_array = np.array(scores, dtype=np.float64)
+    difference = score_array - baseline_array
+    correlation = float(np.corrcoef(baseline_array, score_array)[0, 1]) if len(baseline) > 1 and baseline_array.std() > 0 and score_array.std() > 0 else 1.0
+    return {
+        "rows": len(baseline),
+        "baseline_mean": float(baseline_array.mean()),
+        "backend_mean": float(score_array.mean()),
+        "mean_difference": float(difference.mean()),
+        "mean_abs_difference": float(np.abs(difference).mean()),
+        "p95_abs_difference": float(np.percentile(np.abs(difference), 95)),
+        "max_abs_difference": float(np.abs(difference).max()),
+        "correlation": correlation
+    }
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--filepaths",
+        type=str,
+        default=",".join(filename_list),
+        help="path(s) of the answer files with fp32 scores, multiple paths separated by commas",
+    )
+    parser.add_argument(
+        "--eval_backend",
+        type=str,
+        default="int8",
+        choices=["torch", "int8", "onnx"],
+        help="backend to measure against fp32",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=0,
+        help="CPU threads for the models, 0 keeps the default",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=50,
+        help="rows sampled per file and answer type",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed for sampling rows",
+    )
+    parser.add_argument(
+        "--recompute_baseline",
+        type=bool,
+        default=False,
+        help="Whether to recalculate fp32 scores in this run instead of using the stored ones",
+    )
+    parser.add_argument(
+        "--logs_dir",
+        type=str,
+        default="../data/generations/logs",
+        help="directory for the error logs",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="",
+        help="path to save the report as json",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    rows = collect_rows([item.strip() for item in args.filepaths.split(",")], args.sample, args.seed)
+    print(f"{len(rows)} rows sampled")
+    collated_exceptions = CollatedExceptions(args.logs_dir)
+
+    backend_scores, backend_time = evaluate_rows(
+        Evaluation(collated_exceptions, eval_backend=args.eval_backend, num_threads=args.num_threads), rows)
+
+    baseline_time = None
+    if args.recompute_baseline:
+        baseline_scores, baseline_time = evaluate_rows(
+            Evaluation(collated_exceptions, eval_backend="torch", num_threads=args.num_threads), rows)
+    else:
+        baseline_scores = [scores for _, _, _, _, scores in rows]
+
+    report = {
+        "eval_backend": args.eval_backend,
+        "num_threads": args.num_threads,
+        "baseline": "recomputed" if args.recompute_baseline else "stored",
+        "backend_seconds": backend_time,
+        "baseline_seconds": baseline_time,
+        "rows_per_second": len(rows) / backend_time if backend_time > 0 else 0,
+        "metrics": {}
+    }
+    for result_key in sorted({result_key for _, _, _, result_key, _ in rows}):
+        indices = [index for index, row in enumerate(rows) if row[3] == result_key]
+        for metric in metrics:
+            report["metrics"][f"{result_key}_{metric}_average"] = drift(
+                [baseline_scores[index][metric] for index in indices],
+                [backend_scores[index][metric] for index in indices]
+            )
+
+    print(f"\n{args.eval_backend} against {report['baseline']} fp32, {report['rows_per_second']:.2f} rows/s"
+          + (f", fp32 {len(rows) / baseline_time:.2f} rows/s" if baseline_time else ""))
+    print(f"{'metric':<44}{'rows':>6}{'fp32':>9}{'backend':>9}{'bias':>9}{'mean|d|':>9}{'p95|d|':>9}{'max|d|':>9}{'corr':>8}")
+    for key, stats in report["metrics"].items():
+        print(
+            f"{key:<44}{stats['rows']:>6}{stats['baseline_mean']:>9.4f}{stats['backend_mean']:>9.4f}"
+            f"{stats['mean_difference']:>9.4f}{stats['mean_abs_difference']:>9.4f}{stats['p95_abs_difference']:>9.4f}"
+            f"{stats['max_abs_difference']:>9.4f}{stats['correlation']:>8.4f}"
+        )
+
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,96 @@
+import argparse
+import os
+
+from EvalServer import EvalServer
+
+"""
+Serves the evaluation models over a Unix socket, so concurrent open book, close book and more-eval runs
+share one copy of the sentence transformer and the bert scorer. Set eval_socket under file_config in the QA config
+(or --eval_socket for more-eval/eval.py) to the same path, and Evaluation sends its score requests here.
+
+usage:
+python3 eval-server.py \
+    --socket_path str (optional) \
+    --embedder_name str (optional) \
+    --max_batch_size int (optional) \
+    --max_wait float (optional) \
+    --device str (optional) \
+    --eval_backend torch|int8|onnx (optional) \
+    --num_threads int (optional)
+"""
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--socket_path",
+        type=str,
+        default="/tmp/complex-qa-eval.sock",
+        help="path of the Unix socket to listen on",
+    )
+    parser.add_argument(
+        "--embedder_name",
+        type=str,
+        default="all-mpnet-base-v2",
+        help="sentence transformer model to serve",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=64,
+        help="max sentences in a batch",
+    )
+    parser.add_argument(
+        "--max_wait",
+        type=float,
+        default=0.01,
+        help="max seconds a request waits for its batch to fill",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="",
+        help="device for the models, eg. cpu or cuda, picked automatically when blank",
+    )
+    parser.add_argument(
+        "--eval_backend",
+        type=str,
+        default="torch",
+        choices=["torch", "int8", "onnx"],
+        help="inference backend, int8 and onnx run on CPU",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=0,
+        help="CPU threads for the models, 0 keeps the default",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    # A socket left behind by a server that did not shut down cleanly
+    if os.path.exists(args.socket_path):
+        os.remove(args.socket_path)
+
+    server = EvalServer(
+        socket_path=args.socket_path,
+        embedder_name=args.embedder_name,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait,
+        device=args.device if args.device != "" else None,
+        eval_backend=args.eval_backend,
+        num_threads=args.num_threads
+    )
+    print(f"serving evaluation models on {args.socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.socket_path)
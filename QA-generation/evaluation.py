@@ -1,50 +1,154 @@
 import argparse
 import glob
 import logging
-from typing import cast
-import transformers
-from bert_score import BERTScorer
-import json
-from sentence_transformers import SentenceTransformer, util
-import torch
-from torch import Tensor
-from rouge_score import rouge_scorer
+import threading
+from typing import cast, TYPE_CHECKING
 import os
-import nltk
-import ssl
+from DatasetStream import dataset_extensions, split_extension, write_rows
+from EvalBackends import load_embedder, load_scorer
+from EvalServer import EvalClient, RemoteEmbedder, RemoteScorer
 from HandleExceptions import CollatedExceptions
+from MetricCache import MetricCache, window_hash
+from ReferenceScorer import ReferenceScorer
+from SentenceStore import get_store, text_hash
+from StageMetrics import StageMetrics
 from QaGeneration import ensure_string
-from typing import List, Dict
-from nltk.tokenize import sent_tokenize
+from typing import List, Dict, Tuple
 
-os.environ["NLTK_DATA"] = "~/nltk_data"
-ssl._create_default_https_context = ssl._create_unverified_context
-nltk.download('punkt')
+if TYPE_CHECKING:
+    from CorpusIndex import CorpusIndex
+    from sentence_transformers import SentenceTransformer
 
 """
 This doc uses 2 evaluation methods, sentence bert and bert score
 ref == reference paragraph
 cand == candidate paragraph, compared against the reference paragraph
+
+torch, transformers, bert_score, sentence_transformers and nltk are only imported on first use,
+so importing this file stays cheap for commands that do not evaluate
+
+Results are looked up in a MetricCache first, so models are only loaded when some result is missing
 """
 
+# Settings of each cached metric besides its model and backend, change one when its scoring changes
+bert_score_version = "roberta-large-baseline"
+rouge_version = "rouge1,rougeL,rougeLsum-stemmed-split"
+
+def sent_tokenize(text: str, persist: bool = True) -> List[str]:
+    """
+    Splits text into sentences with nltk's punkt tokenizer, through the shared sentence store,
+    so each text is only split once. See SentenceStore
+
+    Args:
+        text (str): text to split
+        persist (bool, optional): When False, the spans are not saved with the store, eg. for answers. Defaults to True.
+
+    Returns:
+        List[str]: list of sentences
+    """
+    return get_store().split(text, persist)
+
 
 class Evaluation():
-    def __init__(self, collated_exceptions: CollatedExceptions):
+    def __init__(
+        self,
+        collated_exceptions: CollatedExceptions,
+        stage_metrics: StageMetrics | None = None,
+        eval_socket: str = "",
+        eval_backend: str = "torch",
+        num_threads: int = 0,
+        metric_cache_path: str = ""
+    ):
         """
         Constructor for the Evaluation objext
 
         Args:
             collated_exceptions (CollatedExceptions): Object for logging exceptions
+            stage_metrics (StageMetrics | None, optional): Object for timing each evaluation. Defaults to None.
+            eval_socket (str, optional): Unix socket of a running eval-server.py, to score with its models
+                instead of loading them in this process. Defaults to "".
+            eval_backend (str, optional): "torch", "int8" or "onnx", see EvalBackends. Defaults to "torch".
+            num_threads (int, optional): CPU threads for the models, 0 keeps the default. Defaults to 0.
+            metric_cache_path (str, optional): JSONL file of cached metric results, kept in memory when blank. Defaults to "".
         """
         self.collated_exceptions = collated_exceptions
+        self.eval_backend = eval_backend
+        self.embedder_name = "all-mpnet-base-v2"
+        self.num_threads = num_threads
+        self.stage_metrics = stage_metrics if stage_metrics is not None else StageMetrics()
+        self.metric_cache = MetricCache(metric_cache_path)
+
+        # Models are loaded on first use, once, by whichever evaluation thread gets there first
+        self.embedder: "SentenceTransformer | RemoteEmbedder | None" = None
+        self.scorer: "ReferenceScorer | RemoteScorer | None" = None
+        self.load_lock = threading.Lock()
+
+        # Shared models from the eval server, when it is up
+        if eval_socket != "":
+            client = EvalClient(eval_socket)
+            if client.ping():
+                self.embedder = RemoteEmbedder(client)
+                self.scorer = RemoteScorer(client)
+                # Results are cached under the models of the server
+                server_models = client.server_models()
+                self.embedder_name = server_models["embedder_name"]
+                self.eval_backend = server_models["eval_backend"]
+            else:
+                print(f"eval server not reachable at {eval_socket}, loading evaluation models locally")
+
+    @staticmethod
+    def quiet_transformers() -> None:
+        """
+        Only log errors from transformers
+        """
+        import transformers
 
         transformers.tokenization_utils.logger.setLevel(logging.ERROR)
         transformers.configuration_utils.logger.setLevel(logging.ERROR)
         transformers.modeling_utils.logger.setLevel(logging.ERROR)
 
+    def metric_version(self, metric: str) -> str:
+        """
+        Version of a metric in the metric cache, from its model, backend and settings
+
+        Args:
+            metric (str): "bertScore", "sentence_transformer" or "rouge"
+
+        Returns:
+            str: the version
+        """
+        versions = {
+            "bertScore": f"{bert_score_version}/{self.eval_backend}",
+            "sentence_transformer": f"{self.embedder_name}/{self.eval_backend}",
+            "rouge": rouge_version
+        }
+        return versions[metric]
+
+    def get_embedder(self) -> "SentenceTransformer | RemoteEmbedder":
+        """
+        Returns the sentence transformer, loading it on first use
+        """
+        with self.load_lock:
+            if self.embedder is None:
+                self.quiet_transformers()
+                with self.stage_metrics.span("load_models"):
+                    self.embedder = load_embedder(self.eval_backend, self.num_threads)
+        return self.embedder
+
+    def get_scorer(self) -> "ReferenceScorer | RemoteScorer":
+        """
+        Returns the bert scorer, loading it on first use. Reference embeddings are cached per context, see ReferenceScorer
+        """
+        with self.load_lock:
+            if self.scorer is None:
+                self.quiet_transformers()
+                with self.stage_metrics.span("load_models"):
+                    self.scorer = ReferenceScorer(load_scorer(self.eval_backend, self.num_threads))
+        return self.scorer
+
     @staticmethod
     def eval_bert_score(
-        scorer: BERTScorer,
+        scorer: "ReferenceScorer | RemoteScorer",
         cand_window: List,
         ref_window: List
     ) -> List:
@@ -54,23 +158,18 @@ class Evaluation():
         https://pypi.org/project/bert-score/
 
         Args:
-            scorer (BERTScorer): Bert Scorer object
+            scorer (ReferenceScorer | RemoteScorer): Bert Scorer object
             cand_window (List): list of string for the candidate passage
             ref_window (List): list of string for the reference passage
 
         Returns:
             List: returns the evaluations done by Bert Score
         """
-        bs_eval_list = []
-        for cand in cand_window:
-            P, R, F1 = scorer.score([cand], [ref_window])
-            F1 = cast(Tensor, F1)
-            bs_eval_list.append(F1.item())
-        return bs_eval_list
+        return scorer.score_window(cand_window, ref_window)
 
     @staticmethod
     def eval_sentence_transformer(
-        embedder: SentenceTransformer,
+        embedder: "SentenceTransformer | RemoteEmbedder",
         cand_window: List,
         ref_window: List,
     ) -> List:
@@ -87,6 +186,10 @@ class Evaluation():
         Returns:
             List: evaluations done by sentence-bert
         """
+        import torch
+        from sentence_transformers import util
+        from torch import Tensor
+
         top_k = 1
         st_eval_list = []
 
@@ -143,7 +246,7 @@ class Evaluation():
         message: str = ""
     ) -> None:
         """
-        Saves the dataset to json
+        Saves the dataset as json, or as JSONL or compressed JSONL when filename ends with .jsonl or .jsonl.zst
 
         Args:
             source_path (str): directory for the file
@@ -151,23 +254,26 @@ class Evaluation():
             data (List[Dict]): data to save
             message (str, optional): identifier for the file, Defaults to ""
         """
-        file = filename.replace(".json", "")
-        with open(f"{source_path}/{file}{message}.json", "w") as f:
-            json.dump(data, f, indent=2)
+        file, extension = split_extension(filename)
+        if extension not in dataset_extensions:
+            file, extension = filename, ".json"
+        write_rows(f"{source_path}/{file}{message}{extension}", data)
 
     @staticmethod
-    def process_answer(answer: str | List[str]) -> List[str]:
+    def process_answer(answer: str | List[str], persist: bool = False) -> List[str]:
         """
         Splitting the answers into sentences
 
         Args:
             answer (str | List[str]): If answer is string, use a bert model to split into sentences
+            persist (bool, optional): When True, the sentence spans are saved with the sentence store, for contexts and
+                summaries shared by many rows. Answers are only split in memory. Defaults to False.
 
         Returns:
             List[str]: returns a list of splitted answers
         """
         if type(answer) == str:
-            answer = sent_tokenize(answer)
+            answer = sent_tokenize(answer, persist)
         else:
             answer = [item.strip() for item in answer if item.strip() != ""]
         return answer
@@ -178,30 +284,23 @@ class Evaluation():
         cand_key: str,
         ref_key: str,
         result_key: str,
+        rouge: bool = True
     ) -> Dict:
         """
-        Performs evalutions using rouge, bertScore and sentence bert
+        Performs evalutions using rouge, bertScore and sentence bert, each looked up in the metric cache first
 
         Args:
             dataset (Dict): dataset with the candidate and reference to evaluate
             cand_key (str): key within the dict for the candidate
             ref_key (str): key within the dict for the reference
             result_key (str): where to store the result
+            rouge (bool, optional): When False, rouge is left to rouge_generation over the whole dataset. Defaults to True.
 
         Returns:
             Dict: dataset with the stored result
         """
-        # sentence transformer
-        embedder = SentenceTransformer('all-mpnet-base-v2')
-        # Bert scorer
-        scorer = BERTScorer(lang="en", rescale_with_baseline=True)
-
-        # Initialize RougeScorer with split_summaries=True
-        scorer_rouge = rouge_scorer.RougeScorer(
-            ['rouge1', 'rougeL', 'rougeLsum'],
-            use_stemmer=True,
-            split_summaries=True
-        )
+        import rouge_evaluation
+
         handle_exceptions = self.collated_exceptions.new_handle_exception(
             result_key=result_key,
             action="evaluation",
@@ -228,22 +327,30 @@ class Evaluation():
             return dataset
 
         try:
-            dataset[ref_key] = self.process_answer(dataset[ref_key])
+            dataset[ref_key] = self.process_answer(dataset[ref_key], persist=True)
             dataset[cand_key] = self.process_answer(dataset[cand_key])
 
             ref_window: List[str] = dataset[ref_key]
             cand_window: List[str] = dataset[cand_key]
+            cand_hash, ref_hash = window_hash(cand_window), window_hash(ref_window)
 
             # bert-score
-            bs_eval_list = self.eval_bert_score(
-                scorer, cand_window, ref_window)
+            with self.stage_metrics.span("bert_score"):
+                bs_eval_list = self.metric_cache.lookup(
+                    "bertScore", self.metric_version("bertScore"), cand_hash, ref_hash,
+                    lambda: self.eval_bert_score(self.get_scorer(), cand_window, ref_window)
+                )
 
             # sentence transformers
-            st_eval_list = self.eval_sentence_transformer(
-                embedder=embedder,
-                cand_window=cand_window,
-                ref_window=ref_window
-            )
+            with self.stage_metrics.span("sentence_transformer"):
+                st_eval_list = self.metric_cache.lookup(
+                    "sentence_transformer", self.metric_version("sentence_transformer"), cand_hash, ref_hash,
+                    lambda: self.eval_sentence_transformer(
+                        embedder=self.get_embedder(),
+                        cand_window=cand_window,
+                        ref_window=ref_window
+                    )
+                )
 
             # Logging eval data to cand data
             dataset = self.log_eval_score(
@@ -252,11 +359,19 @@ class Evaluation():
                 f"{result_key}_sentence_transformer", dataset, st_eval_list, is_blank=False)
 
             # rouge eval
-            scores_rouge = scorer_rouge.score(ensure_string(
-                dataset[ref_key]), ensure_string(dataset[cand_key]))
-            dataset[f"{result_key}_rouge1"] = scores_rouge['rouge1'].fmeasure
-            dataset[f"{result_key}_rougeL"] = scores_rouge['rougeL'].fmeasure
-            dataset[f"{result_key}_rougeLsum"] = scores_rouge['rougeLsum'].fmeasure
+            if rouge:
+                ref, cand = ensure_string(dataset[ref_key]), ensure_string(dataset[cand_key])
+                with self.stage_metrics.span("rouge"):
+                    scores_rouge = self.metric_cache.lookup(
+                        "rouge", self.metric_version("rouge"), text_hash(cand), text_hash(ref),
+                        lambda: {
+                            rouge_type: score.fmeasure
+                            for rouge_type, score in rouge_evaluation.new_scorer().score(ref, cand).items()
+                        }
+                    )
+                dataset[f"{result_key}_rouge1"] = scores_rouge['rouge1']
+                dataset[f"{result_key}_rougeL"] = scores_rouge['rougeL']
+                dataset[f"{result_key}_rougeLsum"] = scores_rouge['rougeLsum']
 
         except Exception as e:
             exception_content = {
@@ -268,6 +383,144 @@ class Evaluation():
         finally:
             return dataset
 
+    def rouge_generation(
+        self,
+        dataset_list: List[Dict],
+        cand_key: str,
+        ref_key: str,
+        result_key: str,
+        max_workers: int | None = None,
+        replace: bool = False
+    ) -> List[Dict]:
+        """
+        Performs rouge evaluations over a whole dataset, spread across a process pool.
+        Gives the same scores as the rouge evaluation in evaluation_generation, pairs in the metric cache are not scored again
+
+        Args:
+            dataset_list (List[Dict]): list of dataset with the candidate and reference to evaluate
+            cand_key (str): key within the dict for the candidate
+            ref_key (str): key within the dict for the reference
+            result_key (str): where to store the result
+            max_workers (int | None, optional): number of worker processes. Defaults to os.cpu_count().
+            replace (bool, optional): When True, existing rouge scores are recalculated. Defaults to False.
+
+        Returns:
+            List[Dict]: dataset with the stored results
+        """
+        import rouge_evaluation
+
+        handle_exceptions = self.collated_exceptions.new_handle_exception(
+            result_key=result_key,
+            action="rouge",
+            model_name="eval"
+        )
+
+        target_list: List[Dict] = []
+        for dataset in dataset_list:
+            if cand_key not in dataset or ref_key not in dataset:
+                continue
+            if not replace and f"{result_key}_rougeLsum" in dataset:
+                continue
+            if ensure_string(dataset[cand_key]) == "" or ensure_string(dataset[ref_key]) == "":
+                continue
+            target_list.append(dataset)
+
+        version = self.metric_version("rouge")
+        pair_hashes: List[Tuple[str, str]] = []
+        missing_pairs: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        for dataset in target_list:
+            ref, cand = ensure_string(dataset[ref_key]), ensure_string(dataset[cand_key])
+            hashes = (text_hash(cand), text_hash(ref))
+            pair_hashes.append(hashes)
+            if self.metric_cache.get("rouge", version, *hashes) is None:
+                missing_pairs[hashes] = (ref, cand)
+
+        pairs = list(missing_pairs.values())
+        try:
+            with self.stage_metrics.span("rouge", pairs=len(pairs)):
+                scores_list = rouge_evaluation.score_pairs(pairs, max_workers=max_workers)
+            for hashes, scores_rouge in zip(missing_pairs.keys(), scores_list):
+                self.metric_cache.put("rouge", version, *hashes, scores_rouge)
+
+            for dataset, hashes in zip(target_list, pair_hashes):
+                scores_rouge = self.metric_cache.get("rouge", version, *hashes)
+                dataset[f"{result_key}_rouge1"] = scores_rouge['rouge1']
+                dataset[f"{result_key}_rougeL"] = scores_rouge['rougeL']
+                dataset[f"{result_key}_rougeLsum"] = scores_rouge['rougeLsum']
+
+        except Exception as e:
+            exception_content = {
+                "result_key": result_key,
+                "number of pairs": len(pairs)
+            }
+            handle_exceptions.store_exceptions(exception_content, str(e))
+
+        return dataset_list
+
+    def nearest_source_generation(
+        self,
+        dataset_list: List[Dict],
+        cand_key: str,
+        result_key: str,
+        corpus_index: "CorpusIndex",
+        k: int = 5,
+        replace: bool = False
+    ) -> List[Dict]:
+        """
+        Finds the k nearest source articles across the whole corpus for every sentence of the candidate,
+        as a check on whether an answer is closer to some other article than its own
+
+        Args:
+            dataset_list (List[Dict]): list of dataset with the candidate
+            cand_key (str): key within the dict for the candidate
+            result_key (str): where to store the result
+            corpus_index (CorpusIndex): index built from the context directory
+            k (int, optional): number of source articles per sentence. Defaults to 5.
+            replace (bool, optional): When True, existing results are recalculated. Defaults to False.
+
+        Returns:
+            List[Dict]: dataset with the stored results
+        """
+        handle_exceptions = self.collated_exceptions.new_handle_exception(
+            result_key=result_key,
+            action="nearest_sources",
+            model_name="eval"
+        )
+
+        target_list: List[Dict] = []
+        sentence_list: List[List[str]] = []
+        for dataset in dataset_list:
+            if cand_key not in dataset or ensure_string(dataset[cand_key]) == "":
+                continue
+            if not replace and f"{result_key}_nearest_sources" in dataset:
+                continue
+            target_list.append(dataset)
+            sentence_list.append(self.process_answer(dataset[cand_key]))
+
+        sentences = [sentence for sentences in sentence_list for sentence in sentences]
+        if len(sentences) == 0:
+            return dataset_list
+
+        try:
+            with self.stage_metrics.span("nearest_sources", sentences=len(sentences)):
+                embeddings = self.get_embedder().encode(
+                    sentences, convert_to_numpy=True, normalize_embeddings=True)
+                hits = corpus_index.nearest_sources(embeddings, k=k)
+
+            start = 0
+            for dataset, sentences in zip(target_list, sentence_list):
+                dataset[f"{result_key}_nearest_sources"] = hits[start:start + len(sentences)]
+                start += len(sentences)
+
+        except Exception as e:
+            exception_content = {
+                "result_key": result_key,
+                "number of sentences": len(sentences)
+            }
+            handle_exceptions.store_exceptions(exception_content, str(e))
+
+        return dataset_list
+
     @staticmethod
     def get_files_with_keyword(directory: str, keyword: str) -> List:
         """
@@ -13,7 +13,11 @@ python3 open-book-generation.py \
     --qa_config str \
     --starting_dataset_path str (optional) \
     --starting_index int (optional) \
-    --replace bool (optional) 
+    --replace bool (optional) \
+    --schedule_window int (optional) \
+    --num_of_workers int (optional) \
+    --eval_workers int (optional) \
+    --queue_size int (optional)
 
 Example: 
 python3 open-book-generation.py \
@@ -79,6 +83,30 @@ def parse_args():
         required=True,
         help="unqiue identifier for the generation file",
     )
+    parser.add_argument(
+        "--schedule_window",
+        type=int,
+        default=8,
+        help="rows whose requests are ordered together by shared prompt prefix",
+    )
+    parser.add_argument(
+        "--num_of_workers",
+        type=int,
+        default=4,
+        help="threads for each LLM stage, answering and summarising",
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        default=1,
+        help="threads for the evaluation stage, more than 1 is best used with eval-server.py",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=16,
+        help="max rows waiting between stages",
+    )
     return parser.parse_args()
 
 
@@ -113,6 +141,10 @@ if __name__ == "__main__":
                 context_name=context_name,
                 questions_path=questions_path_list[index],
                 replace=args.replace,
-                identifier=args.identifier
+                identifier=args.identifier,
+                schedule_window=args.schedule_window,
+                num_of_workers=args.num_of_workers,
+                eval_workers=args.eval_workers,
+                queue_size=args.queue_size
             )
             qa_controller.open_book_qa()
@@ -1,5 +1,6 @@
 import argparse
 import datetime
+import re
 import sys
 import tqdm
 from transformers import AutoModelForCausalLM, AutoTokenizer
@@ -7,24 +8,26 @@ import torch
 import json
 from typing import List, Dict
 import yaml
+from DatasetStream import load_rows, write_rows
 from QaGeneration import ensure_string
 import statistics
-from nltk.tokenize import sent_tokenize
+from SentenceStore import open_store
 
 """
-Usage: python3 perplexity.py --perplexity_config ../configs/perplexity_filepath.yml
+Usage: python3 perplexity.py --perplexity_config ../configs/perplexity_filepath.yml --filepaths str|list[str] (optional)
 """
 
 class Perplexity():
     """
     Object to calculate Perplexity
     """
-    def __init__(self, perplexity_config: str):
+    def __init__(self, perplexity_config: str, filepaths: str = ""):
         """
         Constructor for Perplexity calculations
 
         Args:
             perplexity_config (str): file path to the perplexity config
+            filepaths (str, optional): files to calculate, separated by commas, instead of filepaths in the config. Defaults to "".
         """
         try:
             with open(perplexity_config, "r") as f:
@@ -43,7 +46,14 @@ class Perplexity():
 
         self.device = self.per_config["model_name"]
 
-        self.file_paths = self.per_config["filepaths"]
+        # A list, or paths separated by whitespace or commas
+        file_paths = self.per_config["filepaths"] if filepaths == "" else filepaths
+        if isinstance(file_paths, str):
+            file_paths = [item for item in re.split(r"[\s,]+", file_paths) if item != ""]
+        self.file_paths = file_paths
+
+        # Sentence spans shared with evaluation, precomputed with sentence-store.py
+        self.sentence_store = open_store(self.per_config.get("sentence_store_path", ""))
 
         memory_map = {
             0: "16GB",
@@ -67,8 +77,7 @@ class Perplexity():
         Calculates perplexity based on the file paths in the perplexity config
         """
         for file in self.file_paths:
-            with open(file, "r") as f:
-                dataset: List[Dict[str, str]] = json.load(f)
+            dataset: List[Dict[str, str]] = load_rows(file)
 
             perplexity_file = f"{self.per_config['store_dir']}/perplexity_{file.split('/')[-1]}"
 
@@ -89,7 +98,7 @@ class Perplexity():
                 if context == "":
                     continue
                 try:
-                    context_list = sent_tokenize(context)
+                    context_list = self.sentence_store.split(context)
 
                     # Calculating perplexity spread
                     perplexity_spread = []
@@ -122,8 +131,8 @@ class Perplexity():
                     progress_bar.update(1)
                     torch.cuda.empty_cache()
 
-                    with open(perplexity_file, "w") as f:
-                        json.dump(perplexity_total, f, indent=2)
+                    write_rows(perplexity_file, perplexity_total)
+                    self.sentence_store.save()
                 except Exception as e:
                     with open(self.per_config["store_dir"], "a") as f:
                         f.writelines(f"{datetime.datetime.now()}: {str(e)}\n")
@@ -137,11 +146,17 @@ def parse_args():
         required=True,
         help="path to the perplexity config file",
     )
+    parser.add_argument(
+        "--filepaths",
+        type=str,
+        default="",
+        help="answer files to calculate, multiple paths separated by commas, overrides filepaths in the config",
+    )
     return parser.parse_args()
 
 if __name__ == "__main__":
 
     args = parse_args()
 
-    perplexity = Perplexity(args.perplexity_config)
+    perplexity = Perplexity(args.perplexity_config, args.filepaths)
     perplexity.execute_perplexity_calc()
@@ -10,7 +10,9 @@ python3 question-generation.py \
     --num_of_generations int \
     --model_name str|list[str] \
     --qa_config_path str \
-    --questions_path str (optional)
+    --questions_path str (optional) \
+    --similarity_threshold float (optional) \
+    --stratify_by date (optional)
 
 Example: 
 python3 question-generation.py 
@@ -64,6 +66,19 @@ def parse_args():
         required=True,
         help="name of file to get context from, without the .json",
     )
+    parser.add_argument(
+        "--similarity_threshold",
+        type=float,
+        default=0.9,
+        help="questions with a higher cosine similarity to an existing question are dropped, above 1 to keep all",
+    )
+    parser.add_argument(
+        "--stratify_by",
+        type=str,
+        default="",
+        choices=["", "date"],
+        help="spread the articles drawn evenly over months, needs the packed corpus from corpus-pack.py",
+    )
     return parser.parse_args()
 
 
@@ -94,4 +109,6 @@ if __name__ == "__main__":
                 context_name=context_name,
             )
             qa_controller.generate_questions(
-                context_file_name=args.context_file_name)
+                context_file_name=args.context_file_name,
+                similarity_threshold=args.similarity_threshold,
+                stratify_by=args.stratify_by)
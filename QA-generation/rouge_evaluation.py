@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import nltk
+from rouge_score import rouge_scorer
+
+"""
+Dataset-level rouge scoring, spread across a process pool.
+Each worker holds a single RougeScorer, and caches the stemmed tokens of texts it has already seen,
+so contexts repeated across questions are only tokenised once per worker.
+
+The scoring below mirrors RougeScorer.score (rouge-score==0.1.2) with
+['rouge1', 'rougeL', 'rougeLsum'], use_stemmer=True and split_summaries=True,
+so the values produced are identical to the inline scorer.
+"""
+
+ROUGE_TYPES = ['rouge1', 'rougeL', 'rougeLsum']
+
+# One scorer per worker process, created by init_worker
+_scorer_rouge: Optional[rouge_scorer.RougeScorer] = None
+
+
+def new_scorer() -> rouge_scorer.RougeScorer:
+    """
+    Creates the rouge scorer used throughout the project
+    """
+    return rouge_scorer.RougeScorer(
+        ROUGE_TYPES,
+        use_stemmer=True,
+        split_summaries=True
+    )
+
+
+def init_worker() -> None:
+    """
+    Initialiser for each worker, creates the scorer once per process
+    """
+    global _scorer_rouge
+    _scorer_rouge = new_scorer()
+    tokenize_text.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def tokenize_text(text: str) -> Tuple[Tuple[str, ...], Tuple[Tuple[str, ...], ...]]:
+    """
+    Stemmed tokens of a text, both as a whole and split into sentences for rougeLsum
+
+    Args:
+        text (str): text to tokenise
+
+    Returns:
+        Tuple[Tuple[str, ...], Tuple[Tuple[str, ...], ...]]: tokens of the whole text, tokens of each sentence
+    """
+    if _scorer_rouge is None:
+        init_worker()
+    tokenizer = _scorer_rouge._tokenizer
+
+    sents = [sent for sent in nltk.sent_tokenize(text) if len(sent)]
+    return (
+        tuple(tokenizer.tokenize(text)),
+        tuple(tuple(tokenizer.tokenize(sent)) for sent in sents)
+    )
+
+
+def score_pair(reference: str, candidate: str) -> Dict[str, float]:
+    """
+    Rouge f-measures of a single (reference, candidate) pair
+
+    Args:
+        reference (str): reference text
+        candidate (str): candidate text
+
+    Returns:
+        Dict[str, float]: f-measure for each rouge type
+    """
+    target_tokens, target_sents = tokenize_text(reference)
+    prediction_tokens, prediction_sents = tokenize_text(candidate)
+
+    rouge1 = rouge_scorer._score_ngrams(
+        rouge_scorer._create_ngrams(target_tokens, 1),
+        rouge_scorer._create_ngrams(prediction_tokens, 1)
+    )
+    rougeL = rouge_scorer._score_lcs(target_tokens, prediction_tokens)
+    rougeLsum = rouge_scorer._summary_level_lcs(target_sents, prediction_sents)
+
+    return {
+        "rouge1": rouge1.fmeasure,
+        "rougeL": rougeL.fmeasure,
+        "rougeLsum": rougeLsum.fmeasure
+    }
+
+
+def score_group(group: List[Tuple[int, str, str]]) -> List[Tuple[int, Dict[str, float]]]:
+    """
+    Scores a group of pairs within a worker
+
+    Args:
+        group (List[Tuple[int, str, str]]): list of (index, reference, candidate)
+
+    Returns:
+        List[Tuple[int, Dict[str, float]]]: list of (index, scores)
+    """
+    return [(index, score_pair(reference, candidate)) for index, reference, candidate in group]
+
+
+def score_pairs(
+    pairs: List[Tuple[str, str]],
+    max_workers: Optional[int] = None
+) -> List[Dict[str, float]]:
+    """
+    Scores every (reference, candidate) pair. Pairs sharing a reference are sent to the same worker,
+    so the reference is only tokenised once.
+
+    Args:
+        pairs (List[Tuple[str, str]]): list of (reference, candidate)
+        max_workers (Optional[int], optional): number of worker processes, runs inline when 1. Defaults to os.cpu_count().
+
+    Returns:
+        List[Dict[str, float]]: scores in the same order as the pairs
+    """
+    groups: Dict[str, List[Tuple[int, str, str]]] = {}
+    for index, (reference, candidate) in enumerate(pairs):
+        groups.setdefault(reference, []).append((index, reference, candidate))
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_workers = min(max_workers, len(groups))
+
+    if max_workers <= 1:
+        init_worker()
+        scored_groups = [score_group(group) for group in groups.values()]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+            scored_groups = list(executor.map(score_group, groups.values()))
+
+    results: List[Dict[str, float]] = [{} for _ in pairs]
+    for scored in scored_groups:
+        for index, scores in scored:
+            results[index] = scores
+    return results
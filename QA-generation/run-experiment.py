@@ -0,0 +1,67 @@
+import argparse
+import sys
+from ExperimentPipeline import ExperimentPipeline
+
+"""
+Runs the stages of the experiment config that are stale, in parallel where they do not depend on each other.
+Stages are only run again when their command, script, inputs or model changed since they last succeeded, see ExperimentPipeline.
+Run from QA-generation, the output of each stage is logged to logs_dir in the config.
+
+usage:
+python3 run-experiment.py \
+    --experiment_config str \
+    --max_parallel int (optional) \
+    --dry_run bool (optional) \
+    --force bool (optional)
+
+Example:
+python3 run-experiment.py --experiment_config ../configs/experiment.yaml --dry_run True
+"""
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--experiment_config",
+        type=str,
+        default="../configs/experiment.yaml",
+        help="yaml config of the stages and grid of the experiment",
+    )
+    parser.add_argument(
+        "--max_parallel",
+        type=int,
+        default=0,
+        help="stages run at once, 0 to use max_parallel in the config",
+    )
+    parser.add_argument(
+        "--dry_run",
+        type=bool,
+        default=False,
+        help="Whether to only list the stages that are stale, without running them",
+    )
+    parser.add_argument(
+        "--force",
+        type=bool,
+        default=False,
+        help="Whether to run every stage, stale or not",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    experiment = ExperimentPipeline(args.experiment_config, force=args.force, max_parallel=args.max_parallel)
+    status = experiment.run(dry_run=args.dry_run)
+
+    counts = {}
+    for item in status.values():
+        counts[item] = counts.get(item, 0) + 1
+    print(", ".join(f"{count} {item}" for item, count in counts.items()))
+
+    if counts.get("failed", 0) > 0:
+        sys.exit(1)
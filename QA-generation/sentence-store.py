@@ -0,0 +1,68 @@
+import argparse
+import time
+
+from CorpusIndex import CorpusIndex
+from QaGeneration import ensure_string
+from SentenceStore import SentenceStore
+
+"""
+Precomputes the sentence spans of every article in the context directory, stored by text hash as character offsets.
+Set sentence_store_path under file_config in the QA config (or sentence_store_path in the perplexity config,
+--sentence_store_path for more-eval/eval.py) to the same file, and sentences are read from it instead of running punkt again.
+Texts missing from the store are split on first use and appended to it.
+
+usage:
+python3 sentence-store.py \
+    --context_dir str (optional) \
+    --output_path str (optional) \
+    --splitter punkt|fast (optional)
+"""
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--context_dir",
+        type=str,
+        default="../data/context",
+        help="directory of the contexts to split",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="../data/context/sentences.jsonl",
+        help="JSONL file of sentence spans, new spans are appended",
+    )
+    parser.add_argument(
+        "--splitter",
+        type=str,
+        default="punkt",
+        choices=["punkt", "fast"],
+        help="punkt gives the same sentences as nltk, fast is a regex splitter for bulk jobs",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    sentence_store = SentenceStore(args.output_path, splitter=args.splitter)
+    num_of_stored = len(sentence_store)
+
+    start = time.perf_counter()
+    num_of_sentences = 0
+    for file, articles in CorpusIndex.load_articles(args.context_dir).items():
+        for article in articles:
+            # Questions keep the context joined with "", evaluation and the corpus index with " "
+            for text in {ensure_string(article["content"], ""), ensure_string(article["content"], " ")}:
+                num_of_sentences += len(sentence_store.get_spans(text))
+    sentence_store.save()
+
+    print(
+        f"{len(sentence_store) - num_of_stored} texts split, {num_of_stored} already stored, "
+        f"{num_of_sentences} sentences in {time.perf_counter() - start:.1f}s"
+    )
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+"""
+Build and query benchmark for the corpus index, on random normalised embeddings so no model is needed.
+Compares the exact blocked numpy search against the faiss HNSW backend when faiss is installed,
+reporting build time, queries per second and the recall of HNSW against exact search.
+
+usage:
+python3 bench_corpus_index.py \
+    --num_of_sentences int (optional) \
+    --num_of_queries int (optional) \
+    --dim int (optional) \
+    --k int (optional) \
+    --block_size int (optional) \
+    --output str (optional)
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QA-generation"))
+
+
+def normalised(rng: np.random.Generator, rows: int, dim: int) -> np.ndarray:
+    """
+    Random normalised float32 embeddings
+    """
+    embeddings = rng.standard_normal((rows, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def run_backend(backend: str, args: argparse.Namespace, corpus: np.ndarray, queries: np.ndarray) -> Dict:
+    """
+    Builds and queries the index with a single backend
+
+    Args:
+        backend (str): "exact" or "hnsw"
+        args (argparse.Namespace): benchmark args
+        corpus (np.ndarray): corpus embeddings
+        queries (np.ndarray): query embeddings
+
+    Returns:
+        Dict: report for the backend, with the indices found
+    """
+    from CorpusIndex import CorpusIndex
+
+    # One article per 20 sentences, roughly the size of an opinion piece
+    article_ids = (np.arange(corpus.shape[0]) // 20).astype(np.int32)
+    sources = [f"bench#{index}" for index in range(int(article_ids[-1]) + 1)]
+
+    start = time.perf_counter()
+    corpus_index = CorpusIndex(corpus, article_ids, sources, backend=backend, block_size=args.block_size)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, indices = corpus_index.search(queries, args.k)
+    query_time = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "build_time": build_time,
+        "query_time": query_time,
+        "queries_per_second": queries.shape[0] / query_time if query_time > 0 else 0,
+        "indices": indices
+    }
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_of_sentences",
+        type=int,
+        default=200000,
+        help="number of corpus sentences",
+    )
+    parser.add_argument(
+        "--num_of_queries",
+        type=int,
+        default=2000,
+        help="number of answer sentences to query",
+    )
+    parser.add_argument(
+        "--dim",
+        type=int,
+        default=768,
+        help="embedding dimension, all-mpnet-base-v2 gives 768",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=20,
+        help="sentences per query",
+    )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=8192,
+        help="corpus rows per matmul for exact search",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="",
+        help="path to save the report as json",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = normalised(rng, args.num_of_sentences, args.dim)
+    queries = normalised(rng, args.num_of_queries, args.dim)
+
+    backends = ["exact"]
+    try:
+        import faiss  # noqa: F401
+        backends.append("hnsw")
+    except ImportError:
+        print("faiss is not installed, only the exact backend is benchmarked")
+
+    reports: List[Dict] = [run_backend(backend, args, corpus, queries) for backend in backends]
+
+    exact_indices = reports[0]["indices"]
+    for report in reports:
+        found = sum(len(set(row) & set(exact_row)) for row, exact_row in zip(report.pop("indices"), exact_indices))
+        report["recall"] = found / exact_indices.size
+        print(
+            f"{report['backend']:<8} build {report['build_time']:.2f}s, query {report['query_time']:.2f}s, "
+            f"{report['queries_per_second']:.0f} queries/s, recall@{args.k} {report['recall']:.3f}"
+        )
+
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "backends": reports}, f, indent=2)
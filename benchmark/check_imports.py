@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+"""
+Import time check for the QA entry points. Each target is imported in a fresh interpreter from QA-generation,
+without running it, and the check fails when the import pulls in a model library or takes longer than max_seconds.
+Models are only loaded on first use, so importing QaController or a script should stay cheap.
+
+usage:
+python3 check_imports.py \
+    --max_seconds float (optional)
+"""
+
+qa_generation_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QA-generation")
+
+# Modules, or python scripts imported without running their __main__ block
+targets = ["QaController", "question-generation.py"]
+
+# Libraries that have to stay out of import time
+heavy_modules = ["torch", "transformers", "sentence_transformers", "bert_score", "faiss", "nltk"]
+
+_import_code = """
+import importlib.util, json, sys, time
+target, heavy_modules = sys.argv[1], sys.argv[2].split(",")
+start = time.perf_counter()
+if target.endswith(".py"):
+    spec = importlib.util.spec_from_file_location(target[:-3].replace("-", "_"), target)
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+else:
+    importlib.import_module(target)
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "heavy": [name for name in heavy_modules if name in sys.modules]}))
+"""
+
+
+def check_import(target: str) -> Dict:
+    """
+    Imports a target in a fresh interpreter
+
+    Args:
+        target (str): module name, or path of a script relative to QA-generation
+
+    Returns:
+        Dict: seconds taken and heavy modules loaded, or the error when the import failed
+    """
+    process = subprocess.run(
+        [sys.executable, "-c", _import_code, target, ",".join(heavy_modules)],
+        cwd=qa_generation_dir,
+        capture_output=True,
+        text=True
+    )
+    if process.returncode != 0:
+        return {"seconds": 0.0, "heavy": [], "error": process.stderr.strip().splitlines()[-1:]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--max_seconds",
+        type=float,
+        default=1.0,
+        help="longest import allowed for a target, light commands should import well under a second",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    failures: List[str] = []
+    for target in targets:
+        result = check_import(target)
+        if "error" in result:
+            failures.append(f"{target} failed to import: {' '.join(result['error'])}")
+        elif len(result["heavy"]) > 0:
+            failures.append(f"{target} imports {', '.join(result['heavy'])}")
+        elif result["seconds"] > args.max_seconds:
+            failures.append(f"{target} took {result['seconds']:.2f}s to import, over {args.max_seconds}s")
+        print(f"{target}: {result['seconds']:.2f}s")
+
+    for failure in failures:
+        print(failure)
+    if len(failures) > 0:
+        sys.exit(1)
@@ -0,0 +1,299 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+"""
+Local stub of an OpenAI compatible chat completions server (FastChat / OpenAI), used for benchmarking the pipeline offline.
+Latency, token rate and error rate are configurable, completions are deterministic for a given prompt.
+Prompt processing can be simulated with a prefill rate, with a prefix cache over recent prompts like
+servers with KV-cache prefix reuse (vLLM / FastChat), so request ordering shows up in the benchmark.
+
+Usage:
+python3 mock_server.py \
+    --port int (optional) \
+    --latency float (optional) \
+    --token_rate float (optional) \
+    --error_rate float (optional) \
+    --completion_tokens int (optional) \
+    --prefill_rate float (optional) \
+    --prefix_cache_size int (optional)
+"""
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Threaded http server that answers /v1/chat/completions requests
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.05,
+        token_rate: float = 500,
+        error_rate: float = 0,
+        completion_tokens: int = 120,
+        seed: int = 0,
+        prefill_rate: float = 0,
+        prefix_cache_size: int = 0
+    ) -> None:
+        """
+        Constructor for MockServer
+
+        Args:
+            port (int, optional): port to listen on, 0 picks a free port. Defaults to 0.
+            latency (float, optional): fixed seconds of latency per request. Defaults to 0.05.
+            token_rate (float, optional): completion tokens generated per second. Defaults to 500.
+            error_rate (float, optional): fraction of requests answered with a server error. Defaults to 0.
+            completion_tokens (int, optional): tokens per completion, capped by max_tokens. Defaults to 120.
+            seed (int, optional): seed for error injection. Defaults to 0.
+            prefill_rate (float, optional): prompt tokens processed per second, 0 for no prompt cost. Defaults to 0.
+            prefix_cache_size (int, optional): recent prompts kept for prefix reuse. Defaults to 0.
+        """
+        super().__init__(("localhost", port), MockChatHandler)
+        self.latency = latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens
+        self.prefill_rate = prefill_rate
+
+        self.prefix_cache: deque = deque(maxlen=prefix_cache_size)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: List[Dict] = []
+
+    @property
+    def api_base(self) -> str:
+        """
+        Base url to use as openai_localhost
+        """
+        return f"http://localhost:{self.server_address[1]}/v1"
+
+    def start(self) -> threading.Thread:
+        """
+        Serves requests on a background thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def should_fail(self) -> bool:
+        """
+        Decides if the current request has an injected error
+        """
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def cached_prefix(self, words: List[str]) -> int:
+        """
+        Number of leading prompt tokens found in the prefix cache, the prompt is then added to the cache
+
+        Args:
+            words (List[str]): tokens of the prompt
+
+        Returns:
+            int: tokens that do not need to be processed again
+        """
+        if self.prefix_cache.maxlen == 0:
+            return 0
+        with self.lock:
+            cached = 0
+            for cached_words in self.prefix_cache:
+                shared = 0
+                for word, cached_word in zip(words, cached_words):
+                    if word != cached_word:
+                        break
+                    shared += 1
+                cached = max(cached, shared)
+            self.prefix_cache.append(words)
+        return cached
+
+    def record(self, stats: Dict) -> None:
+        """
+        Records the stats of a single request
+        """
+        with self.lock:
+            self.requests.append(stats)
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """
+    Handler for the chat completions endpoint
+    """
+    server: MockServer
+
+    def log_message(self, format, *args) -> None:
+        # Requests are recorded in MockServer instead
+        pass
+
+    def send_json(self, status: int, body: Dict) -> None:
+        """
+        Sends a json response
+        """
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self) -> None:
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+
+        messages = request.get("messages", [])
+        prompt = " ".join(str(message.get("content", "")) for message in messages)
+        prompt_words = prompt.split()
+        prompt_tokens = len(prompt_words)
+        cached_tokens = self.server.cached_prefix(prompt_words)
+        prefill_time = (prompt_tokens - cached_tokens) / self.server.prefill_rate if self.server.prefill_rate > 0 else 0
+
+        if self.server.should_fail():
+            time.sleep(self.server.latency + prefill_time)
+            self.send_json(500, {"error": {"message": "injected error", "type": "server_error"}})
+            self.server.record({
+                "latency": time.perf_counter() - start,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "completion_tokens": 0,
+                "error": True
+            })
+            return
+
+        completion_tokens = min(self.server.completion_tokens, int(request.get("max_tokens") or self.server.completion_tokens))
+        content = mock_completion(prompt, completion_tokens)
+
+        time.sleep(self.server.latency + prefill_time + completion_tokens / self.server.token_rate)
+        self.send_json(200, {
+            "id": f"chatcmpl-mock-{len(self.server.requests)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "length"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+        self.server.record({
+            "latency": time.perf_counter() - start,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "error": False
+        })
+
+
+def mock_completion(prompt: str, completion_tokens: int) -> str:
+    """
+    Deterministic completion, numbered lines of words taken from the prompt
+
+    Args:
+        prompt (str): prompt sent to the server
+        completion_tokens (int): number of words to generate
+
+    Returns:
+        str: completion text
+    """
+    words = prompt.split() or ["mock"]
+    generator = random.Random(prompt)
+
+    lines = []
+    line: List[str] = []
+    for _ in range(completion_tokens):
+        line.append(generator.choice(words))
+        if len(line) == 12:
+            lines.append(f"{len(lines) + 1}. {' '.join(line)}?")
+            line = []
+    if len(line) > 0:
+        lines.append(f"{len(lines) + 1}. {' '.join(line)}?")
+
+    return "\n".join(lines)
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="port to serve on",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="fixed latency in seconds per request",
+    )
+    parser.add_argument(
+        "--token_rate",
+        type=float,
+        default=500,
+        help="completion tokens generated per second",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0,
+        help="fraction of requests that fail with a server error",
+    )
+    parser.add_argument(
+        "--completion_tokens",
+        type=int,
+        default=120,
+        help="tokens per completion, capped by max_tokens",
+    )
+    parser.add_argument(
+        "--prefill_rate",
+        type=float,
+        default=0,
+        help="prompt tokens processed per second, 0 for no prompt cost",
+    )
+    parser.add_argument(
+        "--prefix_cache_size",
+        type=int,
+        default=0,
+        help="recent prompts kept for prefix reuse, 0 to disable",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    server = MockServer(
+        port=args.port,
+        latency=args.latency,
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        completion_tokens=args.completion_tokens,
+        prefill_rate=args.prefill_rate,
+        prefix_cache_size=args.prefix_cache_size
+    )
+    print(f"serving on {server.api_base}")
+    server.serve_forever()
@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from mock_server import MockServer
+
+"""
+Offline throughput benchmark for the QA pipeline.
+Starts a local mock chat completions server, then drives the same QaController paths as
+close-book-generation.py and open-book-generation.py end to end against it, and reports
+rows per second, p50/p95 latency per stage, CPU time and import time of QaController.
+Evaluation runs for real, on CPU when no GPU is present.
+
+usage:
+python3 run_benchmark.py \
+    --mode close_book|open_book|list[str] (optional) \
+    --questions_path str (optional) \
+    --num_of_generations int (optional) \
+    --latency float (optional) \
+    --token_rate float (optional) \
+    --error_rate float (optional) \
+    --completion_tokens int (optional) \
+    --prefill_rate float (optional) \
+    --prefix_cache_size int (optional) \
+    --num_of_endpoints int (optional) \
+    --schedule_window int (optional) \
+    --num_of_workers int (optional) \
+    --eval_workers int (optional) \
+    --queue_size int (optional) \
+    --import_budget float (optional) \
+    --output str (optional)
+"""
+
+qa_generation_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "QA-generation")
+configs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "configs")
+sys.path.insert(0, qa_generation_dir)
+
+mock_model_name = "mock-model"
+
+
+def measure_import_time() -> float:
+    """
+    Measures the time taken to import QaController in a fresh interpreter
+
+    Returns:
+        float: seconds taken
+    """
+    code = "import time; start = time.perf_counter(); import QaController; print(time.perf_counter() - start)"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=qa_generation_dir,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def run_mode(mode: str, args: argparse.Namespace, servers: List[MockServer], work_dir: str) -> Dict:
+    """
+    Runs a single controller mode against the mock servers
+
+    Args:
+        mode (str): close_book or open_book
+        args (argparse.Namespace): benchmark args
+        servers (List[MockServer]): running mock servers, one per endpoint
+        work_dir (str): directory for the generated files
+
+    Returns:
+        Dict: report for the mode
+    """
+    from QaController import QaController
+    from StageMetrics import StageMetrics
+
+    context_name = "benchmark"
+    qa_config = {
+        mock_model_name: {
+            "openai_localhost": [server.api_base for server in servers] if len(servers) > 1 else servers[0].api_base,
+            "openai_api_key": "EMPTY",
+            "openai_organization": ""
+        },
+        "file_config": {
+            "context_dir": f"{work_dir}/context",
+            "generation_dir": f"{work_dir}/generations",
+            "logs_dir": f"{work_dir}/logs",
+            "definition_path": os.path.join(configs_dir, "definitions_config.json")
+        }
+    }
+    for directory in [f"{work_dir}/generations/{context_name}", f"{work_dir}/logs"]:
+        os.makedirs(directory, exist_ok=True)
+
+    # Only the questions of the benchmark are copied to the work dir
+    with open(args.questions_path, "r") as f:
+        questions_dataset = json.load(f)[:args.num_of_generations]
+    questions_path = f"{work_dir}/questions_{mode}.json"
+    with open(questions_path, "w") as f:
+        json.dump(questions_dataset, f, indent=2)
+
+    qa_controller = QaController(
+        qa_config=qa_config,
+        model_name=mock_model_name,
+        num_of_generations=args.num_of_generations,
+        context_name=context_name,
+        questions_path=questions_path,
+        identifier=mode,
+        schedule_window=args.schedule_window,
+        num_of_workers=args.num_of_workers,
+        eval_workers=args.eval_workers,
+        queue_size=args.queue_size
+    )
+
+    request_starts = [len(server.requests) for server in servers]
+    cpu_start = time.process_time()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall_start = time.perf_counter()
+
+    if mode == "close_book":
+        qa_controller.close_book_qa()
+    else:
+        qa_controller.open_book_qa()
+
+    wall_time = time.perf_counter() - wall_start
+    children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = time.process_time() - cpu_start + (
+        children_end.ru_utime + children_end.ru_stime - children_start.ru_utime - children_start.ru_stime)
+
+    requests = [item for server, start in zip(servers, request_starts) for item in server.requests[start:]]
+    request_latency = [item["latency"] for item in requests]
+    rows = min(args.num_of_generations, len(questions_dataset))
+
+    return {
+        "mode": mode,
+        "rows": rows,
+        "wall_time": wall_time,
+        "rows_per_second": rows / wall_time if wall_time > 0 else 0,
+        "cpu_time": cpu_time,
+        "requests": len(requests),
+        "request_errors": sum(1 for item in requests if item["error"]),
+        "prompt_tokens": sum(item["prompt_tokens"] for item in requests),
+        "cached_tokens": sum(item["cached_tokens"] for item in requests),
+        "server_latency_p50": StageMetrics.percentile(request_latency, 50),
+        "server_latency_p95": StageMetrics.percentile(request_latency, 95),
+        "stages": qa_controller.stage_metrics.summary()
+    }
+
+
+def print_report(report: Dict) -> None:
+    """
+    Prints the benchmark report as a table
+    """
+    print(f"\nimport QaController: {report['import_time']:.3f}s (budget {report['import_budget']:.3f}s)")
+    for mode_report in report["modes"]:
+        print(
+            f"\n{mode_report['mode']}: {mode_report['rows']} rows in {mode_report['wall_time']:.2f}s, "
+            f"{mode_report['rows_per_second']:.3f} rows/s, cpu {mode_report['cpu_time']:.2f}s, "
+            f"{mode_report['requests']} requests ({mode_report['request_errors']} errors), "
+            f"{mode_report['cached_tokens']}/{mode_report['prompt_tokens']} prompt tokens from prefix cache, "
+            f"server p50 {mode_report['server_latency_p50']:.3f}s p95 {mode_report['server_latency_p95']:.3f}s"
+        )
+        print(f"{'stage':<28}{'count':>7}{'total':>10}{'p50':>10}{'p95':>10}{'prompt tok':>12}{'compl tok':>12}")
+        for stage, stats in mode_report["stages"].items():
+            print(
+                f"{stage:<28}{stats['count']:>7}{stats['total']:>10.3f}{stats['p50']:>10.3f}"
+                f"{stats['p95']:>10.3f}{stats['prompt_tokens']:>12}{stats['completion_tokens']:>12}"
+            )
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="close_book,open_book",
+        help="pipeline(s) to benchmark, multiple modes separated by commas 'close_book,open_book'",
+    )
+    parser.add_argument(
+        "--questions_path",
+        type=str,
+        default="../data/generations/rsis/questions_rsis_vicuna-13b-v1.3.json",
+        help="questions to answer during the benchmark",
+    )
+    parser.add_argument(
+        "--num_of_generations",
+        type=int,
+        default=10,
+        help="number of rows to generate per mode",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="fixed latency in seconds per mock request",
+    )
+    parser.add_argument(
+        "--token_rate",
+        type=float,
+        default=500,
+        help="completion tokens generated per second by the mock server",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0,
+        help="fraction of mock requests that fail with a server error",
+    )
+    parser.add_argument(
+        "--completion_tokens",
+        type=int,
+        default=120,
+        help="tokens per mock completion, capped by max_tokens",
+    )
+    parser.add_argument(
+        "--prefill_rate",
+        type=float,
+        default=0,
+        help="prompt tokens processed per second by the mock server, 0 for no prompt cost",
+    )
+    parser.add_argument(
+        "--prefix_cache_size",
+        type=int,
+        default=0,
+        help="recent prompts kept for prefix reuse by each mock server, 0 to disable",
+    )
+    parser.add_argument(
+        "--num_of_endpoints",
+        type=int,
+        default=1,
+        help="number of mock servers, requests are pinned to one by prompt prefix",
+    )
+    parser.add_argument(
+        "--schedule_window",
+        type=int,
+        default=8,
+        help="rows whose requests are ordered together by shared prompt prefix, 1 for row by row",
+    )
+    parser.add_argument(
+        "--num_of_workers",
+        type=int,
+        default=4,
+        help="threads for each LLM stage of the pipeline, 1 with eval_workers 1 for one row at a time per stage",
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        default=1,
+        help="threads for the evaluation stage",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=16,
+        help="max rows waiting between stages",
+    )
+    parser.add_argument(
+        "--import_budget",
+        type=float,
+        default=1.0,
+        help="maximum seconds allowed for importing QaController",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="",
+        help="path to save the report as json",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    servers = [
+        MockServer(
+            latency=args.latency,
+            token_rate=args.token_rate,
+            error_rate=args.error_rate,
+            completion_tokens=args.completion_tokens,
+            seed=index,
+            prefill_rate=args.prefill_rate,
+            prefix_cache_size=args.prefix_cache_size
+        )
+        for index in range(args.num_of_endpoints)
+    ]
+    for server in servers:
+        server.start()
+
+    report: Dict[str, Any] = {
+        "import_time": measure_import_time(),
+        "import_budget": args.import_budget,
+        "modes": []
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for mode in [item.strip() for item in args.mode.split(",")]:
+            report["modes"].append(run_mode(mode, args, servers, work_dir))
+
+    for server in servers:
+        server.shutdown()
+
+    print_report(report)
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if report["import_time"] > args.import_budget:
+        print("import time budget exceeded")
+        sys.exit(1)
@@ -1,14 +1,33 @@
-import json
-from QaGeneration import ensure_string, ensure_List_string
-from evaluation import Evaluation
-from sentence_transformers import SentenceTransformer
+import argparse
+import os
+from EvalServer import EvalClient, RemoteEmbedder
+from MetricCache import MetricCache, window_hash
+from QaGeneration import ensure_string
+from QaRecord import load_records
+from SentenceStore import get_store, open_store, text_hash
+from evaluation import Evaluation, sent_tokenize
+from sentence_transformers import SentenceTransformer, util
+import torch
 from torch import Tensor
-from typing import cast, List, Dict
+from typing import cast, List, Dict, Tuple
 import tqdm
-from nltk.tokenize import sent_tokenize
 
 """
-This file is used for calculating bertScore, sentence-bert and rouge scores seperately
+This file is used for re-calculating sentence-bert scores seperately, on datasets that have already been generated.
+All files are read once, every unique sentence is embedded in a single batched pass, and each file is written once.
+Rows are read as QaRecords, so contexts repeated across rows and files are held once.
+Scores already in the metric cache for the embedder are filled in without embedding, see MetricCache.
+
+Usage:
+python3 eval.py \
+    --filepaths str|list[str] (optional) \
+    --embedder_name str (optional) \
+    --batch_size int (optional) \
+    --eval_socket str (optional) \
+    --sentence_store_path str (optional) \
+    --metric_cache_path str (optional) \
+    --message str (optional) \
+    --replace bool (optional)
 """
 
 filename_list = [
@@ -19,83 +38,261 @@ filename_list = [
     "../data/generations/straitstimes/close_book_answers_straitstimes_vicuna-13b-v1.3.json"
 ]
 
-def clean_data(answer_dataset:Dict) -> Dict:
+# (reference key, candidate key, result key)
+eval_targets = [
+    ("context", "close_book_answer", "answer"),
+    ("point_form_context", "point_form_close_book_answer", "summarised"),
+]
+
+
+def split_pair(answer_dataset: Dict, context_key: str, answer_key: str) -> Tuple[List[str], List[str]]:
     """
-    Ensures that the context is a string
+    Splits the reference and candidate of a single generation into sentences
 
     Args:
         answer_dataset (Dict): the dict representing 1 generation instance
+        context_key (str): key for the context, which acts as the reference
+        answer_key (str): Key for the answer, which acts as the candidate
 
     Returns:
-        Dict: returns the updated dataset
+        Tuple[List[str], List[str]]: reference sentences and candidate sentences
     """
-    answer_dataset["context"] = ensure_string(answer_dataset["context"], joiner=" ")
+    context = ensure_string(answer_dataset[context_key], joiner=" ")
+    ref_window = sent_tokenize(context) if context != "" else []
+    cand_window = Evaluation.process_answer(answer_dataset[answer_key])
+
+    return ref_window, cand_window
 
-    return answer_dataset
 
-def eval(answer_dataset:Dict, context_key:str, answer_key:str, filename:str) -> Dict:
+def collect_jobs(dataset_list: List[List[Dict]], replace: bool, metric_cache: MetricCache, version: str) -> List[Tuple]:
     """
-    Performs evaluations using bertScore, sentence-bert and rouge
+    Finds every (row, target) pair that is missing a metric, metrics in the metric cache are filled in instead
 
     Args:
-        answer_dataset (Dict): dataset to reference from
-        context_key (str): key for the context, which acts as the reference
-        answer_key (str): Key for the answer, which acts as the candidate
-        filename (str): filename to work on
+        dataset_list (List[List[Dict]]): datasets loaded from every file
+        replace (bool): When True, metrics that already exist are recalculated
+        metric_cache (MetricCache): cached metric results
+        version (str): version of the metrics, the embedder and its backend
 
     Returns:
-        Dict: Returns the updated dataset
+        List[Tuple]: list of (row, result_key, ref_window, cand_window, overall_ref, overall_cand, sentence_missing, overall_missing)
     """
-    context = ensure_string(answer_dataset[context_key], joiner=" ")
-    answer_str = ensure_string(answer_dataset[answer_key])
-    answer_dataset[context_key] = sent_tokenize(context)
+    jobs = []
+    for dataset in dataset_list:
+        for answer_dataset in dataset:
+            for context_key, answer_key, result_key in eval_targets:
+                if context_key not in answer_dataset or answer_key not in answer_dataset:
+                    continue
+
+                sentence_missing = replace or f"{result_key}_sentence_transformer_average" not in answer_dataset
+                overall_missing = replace or f"{result_key}_overall_cosine" not in answer_dataset
+                if not sentence_missing and not overall_missing:
+                    continue
+
+                ref_window, cand_window = split_pair(answer_dataset, context_key, answer_key)
+                overall_ref = ensure_string(answer_dataset[context_key], joiner=" ")
+                overall_cand = ensure_string(answer_dataset[answer_key])
+
+                if sentence_missing:
+                    st_eval_list = metric_cache.get(
+                        "sentence_transformer", version, window_hash(cand_window), window_hash(ref_window))
+                    if st_eval_list is not None:
+                        Evaluation.log_eval_score(
+                            f"{result_key}_sentence_transformer", answer_dataset, st_eval_list, is_blank=False)
+                        sentence_missing = False
+                if overall_missing:
+                    overall_cosine = metric_cache.get(
+                        "overall_cosine", version, text_hash(overall_cand), text_hash(overall_ref))
+                    if overall_cosine is not None:
+                        answer_dataset[f"{result_key}_overall_cosine"] = overall_cosine
+                        overall_missing = False
+                if not sentence_missing and not overall_missing:
+                    continue
+
+                jobs.append((
+                    answer_dataset,
+                    result_key,
+                    ref_window,
+                    cand_window,
+                    overall_ref,
+                    overall_cand,
+                    sentence_missing,
+                    overall_missing
+                ))
+    return jobs
+
+
+def embed_unique(embedder: SentenceTransformer | RemoteEmbedder, jobs: List[Tuple], batch_size: int) -> Tuple[Dict[str, int], Tensor]:
+    """
+    Embeds every unique sentence and paragraph required by the jobs in a single batched pass
+
+    Args:
+        embedder (SentenceTransformer | RemoteEmbedder): embedder object for sentence bert
+        jobs (List[Tuple]): jobs from collect_jobs
+        batch_size (int): batch size for the embedder
+
+    Returns:
+        Tuple[Dict[str, int], Tensor]: index of each text within the embeddings, and the embeddings
+    """
+    text_index: Dict[str, int] = {}
+    for _, _, ref_window, cand_window, overall_ref, overall_cand, sentence_missing, overall_missing in jobs:
+        texts = []
+        if sentence_missing:
+            texts += ref_window + cand_window
+        if overall_missing:
+            texts += [overall_ref, overall_cand]
+        for text in texts:
+            if text != "" and text not in text_index:
+                text_index[text] = len(text_index)
+
+    # Jobs with only blank texts have nothing to embed, and encode cannot stack an empty batch
+    if len(text_index) == 0:
+        return text_index, torch.empty(0)
 
-    embedder = SentenceTransformer('all-mpnet-base-v2')
-    answer = Evaluation.process_answer(answer_dataset[answer_key])
+    embeddings = embedder.encode(
+        list(text_index.keys()),
+        batch_size=batch_size,
+        convert_to_tensor=True,
+        show_progress_bar=True
+    )
+    return text_index, cast(Tensor, embeddings)
 
-    st_eval_list = Evaluation.eval_sentence_transformer(embedder=embedder, ref_window=answer_dataset[context_key], cand_window=answer)
-    overall_list = Evaluation.eval_sentence_transformer_str(embedder=embedder, ref_window=answer_str, cand_window=context)
 
-    answer_dataset = Evaluation.log_eval_score(filename, answer_dataset, st_eval_list, is_blank=False)
-    answer_dataset["overall_answer_cosine"] = overall_list
+def eval(jobs: List[Tuple], text_index: Dict[str, int], embeddings: Tensor, metric_cache: MetricCache, version: str) -> None:
+    """
+    Logs sentence-level and overall cosine scores into each row, using precomputed embeddings, and stores them in the metric cache
+
+    Args:
+        jobs (List[Tuple]): jobs from collect_jobs
+        text_index (Dict[str, int]): index of each text within the embeddings
+        embeddings (Tensor): embeddings of every unique text
+        metric_cache (MetricCache): cached metric results
+        version (str): version of the metrics, the embedder and its backend
+    """
+    progress_bar = tqdm.tqdm(total=len(jobs), desc="scoring")
+    for answer_dataset, result_key, ref_window, cand_window, overall_ref, overall_cand, sentence_missing, overall_missing in jobs:
+        if sentence_missing:
+            if len(ref_window) == 0 or len(cand_window) == 0:
+                Evaluation.log_eval_score(
+                    f"{result_key}_sentence_transformer", answer_dataset, [], is_blank=True)
+            else:
+                ref_embeddings = embeddings[[text_index[text] for text in ref_window]]
+                cand_embeddings = embeddings[[text_index[text] for text in cand_window]]
+
+                # Highest cosine-similarity of each candidate sentence against the reference
+                st_eval_list = util.cos_sim(cand_embeddings, ref_embeddings).max(dim=1).values.tolist()
+                metric_cache.put(
+                    "sentence_transformer", version, window_hash(cand_window), window_hash(ref_window), st_eval_list)
+                Evaluation.log_eval_score(
+                    f"{result_key}_sentence_transformer", answer_dataset, st_eval_list, is_blank=False)
+
+        if overall_missing:
+            if overall_ref == "" or overall_cand == "":
+                answer_dataset[f"{result_key}_overall_cosine"] = 0
+            else:
+                answer_dataset[f"{result_key}_overall_cosine"] = util.cos_sim(
+                    embeddings[text_index[overall_cand]], embeddings[text_index[overall_ref]]).item()
+                metric_cache.put(
+                    "overall_cosine", version, text_hash(overall_cand), text_hash(overall_ref),
+                    answer_dataset[f"{result_key}_overall_cosine"])
+
+        progress_bar.update(1)
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--filepaths",
+        type=str,
+        default=",".join(filename_list),
+        help="path(s) of the answer files to evaluate, multiple paths separated by commas",
+    )
+    parser.add_argument(
+        "--embedder_name",
+        type=str,
+        default="all-mpnet-base-v2",
+        help="sentence transformer model to use",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=64,
+        help="batch size for embedding sentences",
+    )
+    parser.add_argument(
+        "--eval_socket",
+        type=str,
+        default="",
+        help="Unix socket of a running eval-server.py, to embed with its model instead of loading one",
+    )
+    parser.add_argument(
+        "--sentence_store_path",
+        type=str,
+        default="../data/context/sentences.jsonl",
+        help="JSONL file of sentence spans from sentence-store.py, new spans are appended, blank to keep them in memory",
+    )
+    parser.add_argument(
+        "--metric_cache_path",
+        type=str,
+        default="../data/generations/metric_cache.jsonl",
+        help="JSONL file of cached metric results, new results are appended, blank to keep them in memory",
+    )
+    parser.add_argument(
+        "--message",
+        type=str,
+        default="",
+        help="identifier appended to the output filename, files are overwritten when blank",
+    )
+    parser.add_argument(
+        "--replace",
+        type=bool,
+        default=False,
+        help="Whether to recalculate metrics that already exist",
+    )
+    return parser.parse_args()
 
-    return answer_dataset
 
 if __name__=="__main__":
-    new_answer_dataset = []
-    for filename in filename_list:
-        with open(filename, "r") as f:
-            answer_dataset_list = json.load(f)
-
-        progress_bar = tqdm.tqdm(
-            total=len(answer_dataset_list), 
-            desc=f"{filename}"
-        )
 
-        for answer_dataset in answer_dataset_list:
+    args = parse_args()
 
-            answer_dataset = eval(
-                answer_dataset=answer_dataset,
-                context_key="context",
-                answer_key="close_book_answer",
-                filename="answer_sentence_transformer"
-            )
+    open_store(args.sentence_store_path)
+    metric_cache = MetricCache(args.metric_cache_path)
 
-            with open(filename, "w") as f:
-                json.dump(answer_dataset_list, f, indent=2)
+    # Scores are cached under the embedder that computed them, the server's when scoring through it
+    client = EvalClient(args.eval_socket) if args.eval_socket != "" else None
+    if client is not None:
+        server_models = client.server_models()
+        version = f"{server_models['embedder_name']}/{server_models['eval_backend']}"
+    else:
+        version = f"{args.embedder_name}/torch"
 
-            answer_dataset = eval(
-                answer_dataset=answer_dataset,
-                context_key="point_form_context",
-                answer_key="point_form_close_book_answer",
-                filename="summarised_sentence_transformer"
-            )
+    file_path_list = [item.strip() for item in args.filepaths.split(",")]
 
-            with open(filename, "w") as f:
-                json.dump(answer_dataset_list, f, indent=2)
+    dataset_list: List[List[Dict]] = []
+    for file_path in file_path_list:
+        dataset_list.append(load_records(file_path))
 
-            progress_bar.update(1)
+    jobs = collect_jobs(dataset_list, args.replace, metric_cache, version)
+    get_store().save()
+    print(f"{len(jobs)} evaluations to calculate")
 
-            new_answer_dataset.append(answer_dataset)
-            with open("data.json", "w") as f:
-                json.dump(new_answer_dataset, f, indent=2)
+    if len(jobs) > 0:
+        if client is not None:
+            embedder = RemoteEmbedder(client)
+        else:
+            embedder = SentenceTransformer(args.embedder_name)
+        text_index, embeddings = embed_unique(embedder, jobs, args.batch_size)
+        eval(jobs, text_index, embeddings, metric_cache, version)
+        metric_cache.save()
+
+    for file_path, dataset in zip(file_path_list, dataset_list):
+        Evaluation.save_to_json(
+            source_path=os.path.dirname(file_path),
+            filename=os.path.basename(file_path),
+            data=dataset,
+            message=args.message
+        )
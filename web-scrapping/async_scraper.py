@@ -0,0 +1,892 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup
+
+"""
+Asynchronous article scraper for NYT, Straitstimes and RSIS.
+Pages are fetched over a pooled aiohttp session, with per-domain concurrency and politeness delays,
+and parsed with BeautifulSoup (lxml). A small pool of headless Chrome workers is only used as a fallback
+for pages whose content cannot be found in the static html.
+
+Saved html can be replayed offline with --fixtures_dir, and recorded with --save_fixtures_dir.
+
+Scrapes are incremental, articles are appended to <output_dir>/data.jsonl as they come in, and
+<output_dir>/scrape_state.json keeps the ETag/Last-Modified and content hash of every url, so reruns
+skip what is already saved. --since stops at the first listing page with nothing new.
+
+Usage:
+python3 async_scraper.py \
+    --site nyt|straitstimes|rsis \
+    --num_of_pages int (optional) \
+    --output_dir str (optional) \
+    --concurrency int (optional) \
+    --min_delay float (optional) \
+    --browser_workers int (optional) \
+    --fixtures_dir str (optional) \
+    --save_fixtures_dir str (optional) \
+    --since YYYY-MM-DD|last (optional) \
+    --revalidate bool (optional)
+"""
+
+API_KEY = "NYT api key here"
+
+# Path to save RSIS pdfs to
+pdf_dir = "../data/context/rsis/pdf"
+
+straitstimes_filters = [
+    "cartoon",
+    "forum"
+]
+
+
+def fixture_name(url: str) -> str:
+    """
+    File name of the saved page for a url
+
+    Args:
+        url (str): url of the page
+
+    Returns:
+        str: file name within the fixtures directory
+    """
+    return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.html"
+
+
+class RetryableError(Exception):
+    """
+    Error for responses that are worth retrying
+    """
+    def __init__(self, message: str, retry_after: float = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DomainLimiter():
+    """
+    Limits the number of requests in flight, and the time between requests, for a single domain
+    """
+    def __init__(self, concurrency: int, min_delay: float, jitter: float):
+        """
+        Constructor for DomainLimiter
+
+        Args:
+            concurrency (int): max requests in flight for the domain
+            min_delay (float): min seconds between the start of two requests
+            jitter (float): random seconds added to the delay
+        """
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.min_delay = min_delay
+        self.jitter = jitter
+        self.lock = asyncio.Lock()
+        self.last_request = 0.0
+
+    async def __aenter__(self) -> None:
+        await self.semaphore.acquire()
+        async with self.lock:
+            wait = self.last_request + self.min_delay + random.uniform(0, self.jitter) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.last_request = time.monotonic()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.semaphore.release()
+
+
+class AsyncFetcher():
+    """
+    Fetches pages over a single pooled http session, politely
+    """
+    def __init__(
+        self,
+        concurrency: int = 4,
+        min_delay: float = 1.0,
+        jitter: float = 1.0,
+        domain_delays: Optional[Dict[str, float]] = None,
+        retries: int = 3,
+        timeout: float = 30,
+        save_fixtures_dir: str = ""
+    ):
+        """
+        Constructor for AsyncFetcher
+
+        Args:
+            concurrency (int, optional): max requests in flight per domain. Defaults to 4.
+            min_delay (float, optional): min seconds between requests to the same domain. Defaults to 1.0.
+            jitter (float, optional): random seconds added to the delay. Defaults to 1.0.
+            domain_delays (Optional[Dict[str, float]], optional): min_delay overrides for specific domains. Defaults to None.
+            retries (int, optional): retries for failed requests. Defaults to 3.
+            timeout (float, optional): seconds before a request times out. Defaults to 30.
+            save_fixtures_dir (str, optional): directory to save every fetched page to. Defaults to "".
+        """
+        self.concurrency = concurrency
+        self.min_delay = min_delay
+        self.jitter = jitter
+        self.domain_delays = domain_delays or {}
+        self.retries = retries
+        self.timeout = timeout
+        self.save_fixtures_dir = save_fixtures_dir
+
+        self.limiters: Dict[str, DomainLimiter] = {}
+        self.session: Any = None
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency * 4,
+            limit_per_host=self.concurrency,
+            ttl_dns_cache=300
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Complex-QA scraper"}
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.session.close()
+
+    def get_limiter(self, url: str) -> DomainLimiter:
+        """
+        Returns the limiter for the domain of the url
+        """
+        domain = urlparse(url).netloc
+        if domain not in self.limiters:
+            self.limiters[domain] = DomainLimiter(
+                concurrency=self.concurrency,
+                min_delay=self.domain_delays.get(domain, self.min_delay),
+                jitter=self.jitter
+            )
+        return self.limiters[domain]
+
+    async def fetch_conditional(self, url: str, headers: Optional[Dict[str, str]] = None) -> tuple[Optional[bytes], Dict[str, str]]:
+        """
+        Fetches a url, retrying with backoff on rate limits, server errors and timeouts
+
+        Args:
+            url (str): url to fetch
+            headers (Optional[Dict[str, str]], optional): extra headers, eg. If-None-Match. Defaults to None.
+
+        Returns:
+            tuple[Optional[bytes], Dict[str, str]]: body of the response, None when not modified, and its ETag/Last-Modified
+        """
+        import aiohttp
+
+        last_error: Exception = Exception(f"no attempt made for {url}")
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.get_limiter(url):
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status == 429 or response.status >= 500:
+                            retry_after = response.headers.get("Retry-After", "")
+                            raise RetryableError(
+                                f"{response.status} for {url}",
+                                float(retry_after) if retry_after.isdigit() else 0
+                            )
+                        response.raise_for_status()
+                        validators = {
+                            key: response.headers[key] for key in ["ETag", "Last-Modified"] if key in response.headers
+                        }
+                        if response.status == 304:
+                            return None, validators
+                        body = await response.read()
+
+                if self.save_fixtures_dir != "":
+                    with open(f"{self.save_fixtures_dir}/{fixture_name(url)}", "wb") as f:
+                        f.write(body)
+                return body, validators
+
+            except (RetryableError, asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+                last_error = e
+                retry_after = e.retry_after if isinstance(e, RetryableError) else 0
+                await asyncio.sleep(max(retry_after, 2 ** attempt))
+        raise last_error
+
+    async def fetch_bytes(self, url: str) -> bytes:
+        """
+        Fetches a url
+
+        Args:
+            url (str): url to fetch
+
+        Returns:
+            bytes: body of the response
+        """
+        body, _ = await self.fetch_conditional(url)
+        return body if body is not None else b""
+
+    async def fetch(self, url: str) -> str:
+        """
+        Fetches a url as text
+
+        Args:
+            url (str): url to fetch
+
+        Returns:
+            str: decoded body of the response
+        """
+        return (await self.fetch_bytes(url)).decode("utf-8", errors="replace")
+
+
+class FixtureFetcher():
+    """
+    Drop-in replacement for AsyncFetcher that reads saved pages from a directory, for offline runs
+    """
+    def __init__(self, fixtures_dir: str):
+        """
+        Constructor for FixtureFetcher
+
+        Args:
+            fixtures_dir (str): directory of pages saved with fixture_name
+        """
+        self.fixtures_dir = fixtures_dir
+
+    async def __aenter__(self) -> "FixtureFetcher":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def fetch_conditional(self, url: str, headers: Optional[Dict[str, str]] = None) -> tuple[Optional[bytes], Dict[str, str]]:
+        return await self.fetch_bytes(url), {}
+
+    async def fetch_bytes(self, url: str) -> bytes:
+        path = f"{self.fixtures_dir}/{fixture_name(url)}"
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no fixture for {url}")
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def fetch(self, url: str) -> str:
+        return (await self.fetch_bytes(url)).decode("utf-8", errors="replace")
+
+
+class BrowserPool():
+    """
+    Pool of headless Chrome workers, only started when a page needs javascript to render
+    """
+    def __init__(self, num_of_workers: int = 1, wait: float = 5):
+        """
+        Constructor for BrowserPool
+
+        Args:
+            num_of_workers (int, optional): number of headless browsers. Defaults to 1.
+            wait (float, optional): implicit wait for each page. Defaults to 5.
+        """
+        self.num_of_workers = num_of_workers
+        self.wait = wait
+        self.drivers: Optional[asyncio.Queue] = None
+        self.all_drivers: List[Any] = []
+
+    @staticmethod
+    def new_driver() -> Any:
+        """
+        Creates a headless Chrome driver
+        """
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        options = Options()
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+    async def start(self) -> None:
+        """
+        Starts the browsers, if not already started
+        """
+        if self.drivers is not None:
+            return
+        self.drivers = asyncio.Queue()
+        for _ in range(self.num_of_workers):
+            driver = await asyncio.to_thread(self.new_driver)
+            self.all_drivers.append(driver)
+            self.drivers.put_nowait(driver)
+
+    async def render(self, url: str) -> str:
+        """
+        Renders a page with a headless browser
+
+        Args:
+            url (str): url to render
+
+        Returns:
+            str: page source after rendering
+        """
+        await self.start()
+        driver = await self.drivers.get()
+        try:
+            def load() -> str:
+                driver.get(url)
+                driver.implicitly_wait(self.wait)
+                return driver.page_source
+            return await asyncio.to_thread(load)
+        finally:
+            self.drivers.put_nowait(driver)
+
+    def close(self) -> None:
+        """
+        Closes all browsers
+        """
+        for driver in self.all_drivers:
+            driver.quit()
+
+
+class ScrapeState():
+    """
+    Persistent state of a site's scrapes. Keeps the ETag/Last-Modified and content hash of every url scraped,
+    so that reruns skip articles already saved. Articles are appended to data.jsonl as soon as they are scraped
+    """
+    def __init__(self, directory: str, save_every: int = 20):
+        """
+        Constructor for ScrapeState
+
+        Args:
+            directory (str): directory of the site's data, eg. ../data/context/nyt
+            save_every (int, optional): number of updates between saves of the state file. Defaults to 20.
+        """
+        self.file_path = f"{directory}/scrape_state.json"
+        self.data_path = f"{directory}/data.jsonl"
+        self.save_every = save_every
+
+        self.urls: Dict[str, Dict[str, str]] = {}
+        self.content_hashes: set[str] = set()
+        self.last_run = ""
+        self.unsaved = 0
+
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "r") as f:
+                state = json.load(f)
+            self.urls = state["urls"]
+            self.last_run = state["last_run"]
+            self.content_hashes = {item["sha256"] for item in self.urls.values() if "sha256" in item}
+        elif not os.path.exists(self.data_path) and os.path.exists(f"{directory}/data.json"):
+            # Articles from scrapes before the state existed are treated as seen
+            with open(f"{directory}/data.json", "r") as f:
+                for article in json.load(f):
+                    if "url" in article:
+                        self.add_article(article["url"], article, article_hash(article))
+            self.save()
+
+    def is_seen(self, url: str) -> bool:
+        """
+        Whether the url has been scraped before
+        """
+        return url in self.urls
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        """
+        Conditional request headers for a url, from its stored ETag/Last-Modified
+
+        Args:
+            url (str): url to request
+
+        Returns:
+            Dict[str, str]: If-None-Match and If-Modified-Since headers, empty for a new url
+        """
+        entry = self.urls.get(url, {})
+        headers = {}
+        if entry.get("ETag", "") != "":
+            headers["If-None-Match"] = entry["ETag"]
+        if entry.get("Last-Modified", "") != "":
+            headers["If-Modified-Since"] = entry["Last-Modified"]
+        return headers
+
+    def update_url(self, url: str, validators: Dict[str, str], digest: str = "") -> None:
+        """
+        Stores the validators, and content hash, of a url
+
+        Args:
+            url (str): url fetched
+            validators (Dict[str, str]): ETag/Last-Modified of the response
+            digest (str, optional): content hash of the article, blank for listing pages. Defaults to "".
+        """
+        entry = self.urls.setdefault(url, {})
+        entry.update(validators)
+        entry["time"] = datetime.now().isoformat()
+        if digest != "":
+            entry["sha256"] = digest
+            self.content_hashes.add(digest)
+
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def add_article(self, url: str, article: Dict, digest: str, validators: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Appends an article to data.jsonl, unless the same content has already been saved
+
+        Args:
+            url (str): url of the article
+            article (Dict): the article
+            digest (str): content hash of the article
+            validators (Optional[Dict[str, str]], optional): ETag/Last-Modified of the response. Defaults to None.
+
+        Returns:
+            bool: True if the article is new
+        """
+        is_new = digest not in self.content_hashes
+        if is_new:
+            with open(self.data_path, "a") as f:
+                f.write(json.dumps(article) + "\n")
+        self.update_url(url, validators or {}, digest)
+        return is_new
+
+    def load_articles(self) -> List[Dict]:
+        """
+        Returns every article saved so far
+        """
+        if not os.path.exists(self.data_path):
+            return []
+        with open(self.data_path, "r") as f:
+            return [json.loads(line) for line in f if line.strip() != ""]
+
+    def save(self, finished: bool = False) -> None:
+        """
+        Saves the state file, replacing it in one step so a crash never leaves a partial file
+
+        Args:
+            finished (bool, optional): marks the end of a run, for --since last. Defaults to False.
+        """
+        if finished:
+            self.last_run = datetime.now().isoformat()
+        with open(f"{self.file_path}.tmp", "w") as f:
+            json.dump({"last_run": self.last_run, "urls": self.urls}, f, indent=2)
+        os.replace(f"{self.file_path}.tmp", self.file_path)
+        self.unsaved = 0
+
+
+def article_hash(article: Dict) -> str:
+    """
+    Content hash of an article, leaving out the url so the same article under another url is caught
+
+    Args:
+        article (Dict): the article
+
+    Returns:
+        str: sha256 of the article's content
+    """
+    if "sha256" in article:
+        return article["sha256"]
+    content = {key: value for key, value in article.items() if key != "url"}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+"""
+Parsers, these work on html strings only so they can be checked against saved pages
+"""
+
+
+def parse_nyt_search(text: str) -> List[str]:
+    """
+    Article urls from a page of the NYT article search api
+    """
+    data = json.loads(text)
+    return [item["web_url"] for item in data["response"]["docs"]]
+
+
+def parse_nyt_article(html: str, url: str) -> Optional[Dict]:
+    """
+    Title and paragraphs of a NYT article, None when the content cannot be found
+    """
+    soup = BeautifulSoup(html, "lxml")
+
+    title_element = soup.select_one(".css-xkf25q")
+    title = title_element.get_text() if title_element is not None else ""
+
+    content_list = []
+    for parent in soup.select(".css-53u6y8"):
+        p_tags = parent.select("p.css-at9mc1.evys1bk0, p.css-12wzsk6.evys1bk0")
+        content_list += [item.get_text() for item in p_tags]
+
+    if len(content_list) == 0:
+        return None
+    return {
+        "url": url,
+        "title": title,
+        "content": content_list
+    }
+
+
+def parse_straitstimes_listing(html: str, url: str) -> List[str]:
+    """
+    Article urls from a Straitstimes opinion listing page
+    """
+    soup = BeautifulSoup(html, "lxml")
+    href_list = []
+    for item in soup.select("a.stretched-link"):
+        href = urljoin(url, item.get("href", ""))
+        if not any(word in href for word in straitstimes_filters):
+            href_list.append(href)
+    return href_list
+
+
+def parse_straitstimes_article(html: str, url: str) -> Optional[Dict]:
+    """
+    Title and paragraphs of a Straitstimes article, None when the content cannot be found
+    """
+    soup = BeautifulSoup(html, "lxml")
+
+    title_element = soup.select_one(".headline")
+    paragraph_list = [para.get_text() + "\n" for para in soup.find_all("p") if not para.has_attr("class")]
+
+    if title_element is None or len(paragraph_list) == 0:
+        return None
+    return {
+        "url": url,
+        "title": title_element.get_text(),
+        "content": paragraph_list
+    }
+
+
+def parse_rsis_listing(html: str, url: str) -> List[str]:
+    """
+    Commentary urls from a RSIS listing page
+    """
+    soup = BeautifulSoup(html, "lxml")
+    href_list = []
+    for title in soup.find_all("p", class_="title title-box"):
+        link = title.find("a", class_="link")
+        if link is not None and link.get("href"):
+            href_list.append(urljoin(url, link["href"]))
+    return href_list
+
+
+def parse_rsis_article(html: str, url: str) -> Optional[Dict]:
+    """
+    Link to the pdf of a RSIS commentary, None when it cannot be found
+    """
+    soup = BeautifulSoup(html, "lxml")
+    for link in soup.find_all("a", href=True):
+        if link["href"].lower().endswith(".pdf"):
+            return {
+                "url": url,
+                "pdf_url": urljoin(url, link["href"])
+            }
+    return None
+
+
+async def download_pdf(article: Dict, fetcher: Any) -> Dict:
+    """
+    Downloads the pdf of a RSIS commentary into the pdf directory
+
+    Args:
+        article (Dict): article with pdf_url
+        fetcher (Any): AsyncFetcher or FixtureFetcher
+
+    Returns:
+        Dict: article with file_name and the sha256 of the pdf added
+    """
+    os.makedirs(pdf_dir, exist_ok=True)
+
+    body = await fetcher.fetch_bytes(article["pdf_url"])
+    file_name = f"{pdf_dir}/{os.path.basename(urlparse(article['pdf_url']).path)}"
+    with open(file_name, "wb") as f:
+        f.write(body)
+    return {**article, "file_name": file_name, "sha256": hashlib.sha256(body).hexdigest()}
+
+
+"""
+Sites, listing_url gives the url of a listing page, listing_parser finds article urls from it.
+post_process runs on each parsed article, since_query restricts the listing to items after a date
+"""
+
+sites: Dict[str, Dict[str, Any]] = {
+    "nyt": {
+        "listing_url": lambda i: f"https://api.nytimes.com/svc/search/v2/articlesearch.json?q=opinion&page={i}&api-key={API_KEY}",
+        "listing_parser": lambda text, url: parse_nyt_search(text),
+        "article_parser": parse_nyt_article,
+        "post_process": None,
+        "since_query": lambda since: f"&begin_date={since.replace('-', '')}&sort=newest",
+        "first_page": 1,
+        # The article search api allows 5 requests per minute
+        "domain_delays": {"api.nytimes.com": 12}
+    },
+    "straitstimes": {
+        "listing_url": lambda i: f"https://www.straitstimes.com/opinion/latest?page={i}",
+        "listing_parser": parse_straitstimes_listing,
+        "article_parser": parse_straitstimes_article,
+        "post_process": None,
+        "since_query": None,
+        "first_page": 0,
+        "domain_delays": {}
+    },
+    "rsis": {
+        "listing_url": lambda i: f"https://www.rsis.edu.sg/publications/rsis-publications/commentaries/page/{i}",
+        "listing_parser": parse_rsis_listing,
+        "article_parser": parse_rsis_article,
+        "post_process": download_pdf,
+        "since_query": None,
+        "first_page": 1,
+        "domain_delays": {}
+    }
+}
+
+
+async def scrape_article(
+    url: str,
+    fetcher: Any,
+    site: Dict[str, Any],
+    browser_pool: Optional[BrowserPool],
+    state: ScrapeState,
+    failure_log_list: List[Dict]
+) -> bool:
+    """
+    Fetches and parses a single article, falling back to a headless browser when the static html has no content.
+    Seen urls are requested conditionally, and the article is only saved when its content hash is new
+
+    Args:
+        url (str): url of the article
+        fetcher (Any): AsyncFetcher or FixtureFetcher
+        site (Dict[str, Any]): entry within sites
+        browser_pool (Optional[BrowserPool]): browsers for the fallback, None to disable
+        state (ScrapeState): scrape state to save the article to
+        failure_log_list (List[Dict]): list to log failures to
+
+    Returns:
+        bool: True if a new article was saved
+    """
+    try:
+        body, validators = await fetcher.fetch_conditional(url, state.request_headers(url))
+        if body is None:
+            state.update_url(url, validators)
+            return False
+
+        article = site["article_parser"](body.decode("utf-8", errors="replace"), url)
+        if article is None and browser_pool is not None:
+            article = site["article_parser"](await browser_pool.render(url), url)
+        if article is None:
+            failure_log_list.append({"url": url, "Error": "no content found"})
+            return False
+
+        if site["post_process"] is not None:
+            article = await site["post_process"](article, fetcher)
+        return state.add_article(url, article, article_hash(article), validators)
+
+    except Exception as e:
+        failure_log_list.append({"url": url, "Error": str(e)})
+        return False
+
+
+async def scrape_site(
+    site_name: str,
+    num_of_pages: int,
+    fetcher: Any,
+    browser_pool: Optional[BrowserPool],
+    state: ScrapeState,
+    since: str = "",
+    revalidate: bool = False
+) -> tuple[int, List[Dict]]:
+    """
+    Scrapes the articles from the listing pages of a site, skipping articles already in the scrape state
+
+    Args:
+        site_name (str): key within sites
+        num_of_pages (int): max number of listing pages to go through
+        fetcher (Any): AsyncFetcher or FixtureFetcher
+        browser_pool (Optional[BrowserPool]): browsers for the fallback, None to disable
+        state (ScrapeState): scrape state of the site
+        since (str, optional): YYYY-MM-DD, only listing pages with new items are gone through. Defaults to "".
+        revalidate (bool, optional): request seen articles again, conditionally, to pick up changes. Defaults to False.
+
+    Returns:
+        tuple[int, List[Dict]]: number of new articles and failures
+    """
+    import tqdm
+
+    site = sites[site_name]
+    failure_log_list: List[Dict] = []
+
+    async def scrape_listing(i: int) -> List[str]:
+        url = site["listing_url"](i)
+        if since != "" and site["since_query"] is not None:
+            url += site["since_query"](since)
+        try:
+            # Listing pages are only requested conditionally for --since, otherwise every page is read again
+            body, validators = await fetcher.fetch_conditional(url, state.request_headers(url) if since != "" else None)
+            state.update_url(url, validators)
+            if body is None:
+                return []
+            return site["listing_parser"](body.decode("utf-8", errors="replace"), url)
+        except Exception as e:
+            failure_log_list.append({"url_index": i, "Error": str(e)})
+            return []
+
+    print("Getting page urls...")
+    pages = range(site["first_page"], site["first_page"] + num_of_pages)
+    if since == "":
+        listing_results = await asyncio.gather(*[scrape_listing(i) for i in pages])
+    else:
+        # Listings are newest first, so pages are gone through in order until one has nothing new
+        listing_results = []
+        for i in pages:
+            hrefs = [href for href in await scrape_listing(i) if not state.is_seen(href)]
+            if len(hrefs) == 0:
+                break
+            listing_results.append(hrefs)
+
+    # Keeping the order of first appearance, without duplicates
+    href_list = list(dict.fromkeys(href for hrefs in listing_results for href in hrefs))
+    if not revalidate:
+        href_list = [href for href in href_list if not state.is_seen(href)]
+
+    print(f"Getting {len(href_list)} articles...")
+    progress_bar = tqdm.tqdm(total=len(href_list))
+
+    async def scrape_and_update(url: str) -> bool:
+        is_new = await scrape_article(url, fetcher, site, browser_pool, state, failure_log_list)
+        progress_bar.update(1)
+        return is_new
+
+    results = await asyncio.gather(*[scrape_and_update(url) for url in href_list])
+    progress_bar.close()
+
+    return sum(results), failure_log_list
+
+
+def save_content(dir: str, filename: str, data: List[Dict]) -> None:
+    """
+    Saves the data to a json file
+
+    Args:
+        dir (str): directory for the json file
+        filename (str): name of file
+        data (List[Dict]): data to save
+    """
+    with open(f"{dir}/{filename}", "w") as f:
+        json.dump(data, f, indent=2)
+
+
+async def main(args: argparse.Namespace) -> None:
+    browser_pool = BrowserPool(args.browser_workers) if args.browser_workers > 0 else None
+
+    if args.fixtures_dir != "":
+        fetcher = FixtureFetcher(args.fixtures_dir)
+    else:
+        fetcher = AsyncFetcher(
+            concurrency=args.concurrency,
+            min_delay=args.min_delay,
+            domain_delays=sites[args.site]["domain_delays"],
+            save_fixtures_dir=args.save_fixtures_dir
+        )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    state = ScrapeState(args.output_dir)
+    since = state.last_run[:10] if args.since == "last" else args.since
+    if since != "":
+        print(f"Getting items since {since}")
+
+    finished = False
+    try:
+        async with fetcher:
+            new_articles, failure_log_list = await scrape_site(
+                args.site, args.num_of_pages, fetcher, browser_pool, state, since, args.revalidate)
+        finished = True
+    finally:
+        if browser_pool is not None:
+            browser_pool.close()
+        state.save(finished=finished)
+
+    # data.jsonl is appended to as articles come in, data.json is rebuilt from it for QA generation
+    article_list = state.load_articles()
+    save_content(args.output_dir, "data.json", article_list)
+
+    final_report = {
+        "extract_text_fails": len(failure_log_list),
+        "new_extractions": new_articles,
+        "total_extractions": len(article_list)
+    }
+    save_content(args.output_dir, "log.json", [final_report] + failure_log_list)
+    print(f"Done, {new_articles} new articles, {len(article_list)} in total, {len(failure_log_list)} failures")
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--site",
+        type=str,
+        required=True,
+        choices=list(sites.keys()),
+        help="site to scrape",
+    )
+    parser.add_argument(
+        "--num_of_pages",
+        type=int,
+        default=99,
+        help="number of listing pages to go through",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="",
+        help="directory to save data.json, log.json and the scrape state, defaults to ../data/context/<site>",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="max requests in flight per domain",
+    )
+    parser.add_argument(
+        "--min_delay",
+        type=float,
+        default=1.0,
+        help="min seconds between requests to the same domain",
+    )
+    parser.add_argument(
+        "--browser_workers",
+        type=int,
+        default=1,
+        help="headless browsers for pages that need javascript, 0 to disable",
+    )
+    parser.add_argument(
+        "--fixtures_dir",
+        type=str,
+        default="",
+        help="replay saved pages from this directory instead of the network",
+    )
+    parser.add_argument(
+        "--save_fixtures_dir",
+        type=str,
+        default="",
+        help="save every fetched page to this directory",
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        default="",
+        help="YYYY-MM-DD or 'last', only fetch items newer than the date or the last finished run",
+    )
+    parser.add_argument(
+        "--revalidate",
+        type=bool,
+        default=False,
+        help="Whether to request seen articles again, conditionally, to pick up edits",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    if args.output_dir == "":
+        args.output_dir = f"../data/context/{args.site}"
+    if args.save_fixtures_dir != "":
+        os.makedirs(args.save_fixtures_dir, exist_ok=True)
+
+    asyncio.run(main(args))
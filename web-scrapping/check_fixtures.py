@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, List
+
+import async_scraper
+from async_scraper import FixtureFetcher, ScrapeState, scrape_site, sites
+
+"""
+Offline check of the async scraper's parsers against saved pages, see fixtures/<site>.
+Each site is scraped end to end with FixtureFetcher into a temporary directory, and the articles saved and the urls
+that failed are compared with fixtures/<site>/expected.json. A second scrape on the same state has to find nothing new.
+
+expected.json lists the url of every saved page under pages, with the file name given by fixture_name.
+Pages are recorded with: python3 async_scraper.py --site <site> --save_fixtures_dir fixtures/<site>
+
+Usage:
+python3 check_fixtures.py \
+    --fixtures_dir str (optional) \
+    --site nyt|straitstimes|rsis (optional)
+"""
+
+
+def normalise(article: Dict) -> Dict:
+    """
+    Article as compared with expected.json, pdfs are downloaded to a temporary directory so only their name is kept
+    """
+    if "file_name" in article:
+        article = {**article, "file_name": os.path.basename(article["file_name"])}
+    return article
+
+
+async def check_site(site_name: str, fixtures_dir: str) -> List[str]:
+    """
+    Scrapes a site from its saved pages and compares the result with its expected.json
+
+    Args:
+        site_name (str): key within sites
+        fixtures_dir (str): directory of the saved pages of the site
+
+    Returns:
+        List[str]: differences from expected.json, empty when the parsers match
+    """
+    with open(f"{fixtures_dir}/expected.json", "r") as f:
+        expected = json.load(f)
+
+    errors: List[str] = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        async_scraper.pdf_dir = f"{output_dir}/pdf"
+        state = ScrapeState(output_dir)
+        async with FixtureFetcher(fixtures_dir) as fetcher:
+            new_articles, failure_log_list = await scrape_site(
+                site_name, expected["num_of_pages"], fetcher, None, state)
+        articles = [normalise(article) for article in state.load_articles()]
+
+        expected_articles = {article["url"]: article for article in expected["articles"]}
+        scraped_articles = {article["url"]: article for article in articles}
+        for url in expected_articles.keys() - scraped_articles.keys():
+            errors.append(f"{url} was not scraped")
+        for url in scraped_articles.keys() - expected_articles.keys():
+            errors.append(f"{url} was scraped but is not expected")
+        for url in expected_articles.keys() & scraped_articles.keys():
+            if expected_articles[url] != scraped_articles[url]:
+                errors.append(f"{url} was parsed as {json.dumps(scraped_articles[url])}")
+        if new_articles != len(articles):
+            errors.append(f"{new_articles} new articles reported, {len(articles)} saved")
+
+        failed_urls = sorted(item.get("url", f"listing page {item.get('url_index')}") for item in failure_log_list)
+        if failed_urls != sorted(expected["failures"]):
+            errors.append(f"failures {failed_urls}, expected {sorted(expected['failures'])}")
+
+        # Nothing is new the second time round
+        async with FixtureFetcher(fixtures_dir) as fetcher:
+            new_articles, _ = await scrape_site(site_name, expected["num_of_pages"], fetcher, None, state)
+        if new_articles != 0:
+            errors.append(f"{new_articles} new articles on a second scrape")
+    return errors
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--fixtures_dir",
+        type=str,
+        default="fixtures",
+        help="directory with the saved pages of each site, in a directory per site",
+    )
+    parser.add_argument(
+        "--site",
+        type=str,
+        default="",
+        choices=[""] + list(sites.keys()),
+        help="site to check, every site with fixtures when blank",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    site_list = [args.site] if args.site != "" else [site for site in sites if os.path.isdir(f"{args.fixtures_dir}/{site}")]
+    num_of_errors = 0
+    for site_name in site_list:
+        errors = asyncio.run(check_site(site_name, f"{args.fixtures_dir}/{site_name}"))
+        num_of_errors += len(errors)
+        print(f"{site_name}: {'ok' if len(errors) == 0 else f'{len(errors)} differences'}")
+        for error in errors:
+            print(f"  {error}")
+
+    if num_of_errors > 0:
+        sys.exit(1)
@@ -0,0 +1,312 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import tqdm
+
+"""
+Batch extraction of RSIS commentaries from pdf into the json schema used in ../data/context/rsis,
+{"file_name", "title", "author(s)", "date", "content"}.
+PDFs are spread across a process pool, each worker laying out the pages of a pdf with pdfminer and parsing
+the lines of the whole document. PDFs whose sha256 is recorded in the index next to the output file are skipped,
+as are pdfs whose file name is already in the output, so an output written before the index existed is not duplicated.
+The parsing follows rsis_pdf_to_json.ipynb, as the pdfs are highly structured.
+
+Usage:
+python3 rsis_pdf_extract.py \
+    --pdf_dir str (optional) \
+    --output_path str (optional) \
+    --max_workers int (optional)
+"""
+
+
+def find_keyword_index(keyword: str, text_list: List[str]) -> int:
+    """
+    Returns the index for a loose match
+
+    Args:
+        keyword (str): keyword to search for
+        text_list (List[str]): list of text to search
+
+    Returns:
+        int: index
+    """
+    keyword = keyword.lower()
+    for index, text in enumerate(text_list):
+        if keyword in text.lower():
+            return index
+    return -1
+
+
+def find_nth_match_index(keyword: str, n: int, text_list: List[str]) -> int:
+    """
+    Finding the nth exact match
+
+    Args:
+        keyword (str): keyword to match
+        n (int): number of matches to skip
+        text_list (List[str]): list of text to search
+
+    Returns:
+        int: index of the nth match
+    """
+    counter = 0
+    for index, text in enumerate(text_list):
+        if counter == n:
+            return index
+        if text == keyword:
+            counter += 1
+    return -1
+
+
+def find_keyword_list_index(keyword_list: List[str], text_list: List[str]) -> int:
+    """
+    return index for any loose matches from the keyword list
+
+    Args:
+        keyword_list (List[str]): list of keywords
+        text_list (List[str]): list of text to search
+
+    Returns:
+        int: index of a match
+    """
+    keyword_list = [keyword.lower() for keyword in keyword_list]
+
+    for index, text in enumerate(text_list):
+        text = text.lower()
+        for keyword in keyword_list:
+            if keyword in text:
+                return index
+    return -1
+
+
+def get_authors(authors: str) -> List[str]:
+    """
+    Splitting the authors portion for RSIS
+
+    Args:
+        authors (str): string representation of the entire author portion
+
+    Returns:
+        List[str]: first and last name of the author
+    """
+    author_list = authors.split(" ")
+    return [
+        author_list[1],
+        author_list[-1]
+    ]
+
+
+def render_text(item: Any) -> Iterator[str]:
+    """
+    Text of a pdfminer layout item, in the same order and format as pdfminer.high_level.extract_text
+
+    Args:
+        item (Any): pdfminer layout item
+
+    Yields:
+        Iterator[str]: pieces of text
+    """
+    from pdfminer.layout import LTContainer, LTText, LTTextBox
+
+    if isinstance(item, LTContainer):
+        for child in item:
+            yield from render_text(child)
+    elif isinstance(item, LTText):
+        yield item.get_text()
+    if isinstance(item, LTTextBox):
+        yield "\n"
+
+
+def extract_lines(file: str) -> List[str]:
+    """
+    Lays out the pages of a pdf one at a time, returning the stripped lines of the whole document,
+    as the parsing looks up markers across all of them
+
+    Args:
+        file (str): path to the pdf
+
+    Returns:
+        List[str]: lines of the pdf
+    """
+    from pdfminer.high_level import extract_pages
+
+    pieces: List[str] = []
+    for page_layout in extract_pages(file):
+        pieces.extend(render_text(page_layout))
+        pieces.append("\f")
+    return [item.strip() for item in "".join(pieces).split("\n")]
+
+
+def parse_commentary(file: str, text_list: List[str]) -> Optional[Dict[str, str]]:
+    """
+    Parses the lines of a RSIS commentary into title, author(s), date and content
+
+    Args:
+        file (str): path to the pdf
+        text_list (List[str]): lines of the pdf
+
+    Returns:
+        Optional[Dict[str, str]]: the commentary, None if the pdf does not follow the structure
+    """
+    # Getting index (pdf is extremely structured)
+    date_index = find_nth_match_index("", 1, text_list)
+    title_index = find_nth_match_index("", 3, text_list)
+    synopsis_index = find_keyword_index("synopsis", text_list)
+    if synopsis_index == -1:
+        return None
+
+    title_list = [item for item in text_list[title_index: synopsis_index] if item != ""]
+    if len(title_list) == 0 or "By" not in title_list[-1]:
+        return None
+
+    author = title_list[-1]
+    title = " ".join(title_list[:-1])
+    author_list = get_authors(author)
+
+    commentary_index = find_keyword_index("commentary", text_list[synopsis_index:]) + synopsis_index
+    end_index = find_keyword_list_index(author_list, text_list[synopsis_index:]) + synopsis_index
+
+    # Getting text
+    date = text_list[date_index] if date_index != -1 else ""
+    commentary = " ".join([item.replace("  ", " ") for item in text_list[commentary_index: end_index - 1] if item != ""])
+
+    result = {
+        "file_name": file,
+        "title": title,
+        "author(s)": author,
+        "date": date,
+        "content": commentary
+    }
+    if any(value == "" for value in result.values()):
+        return None
+    return result
+
+
+def extract_commentary(file: str) -> Dict[str, Any]:
+    """
+    Extracts a single pdf, runs within a worker
+
+    Args:
+        file (str): path to the pdf
+
+    Returns:
+        Dict[str, Any]: {"file_name", "article", "error"}, article is None when nothing could be extracted
+    """
+    try:
+        return {
+            "file_name": file,
+            "article": parse_commentary(file, extract_lines(file)),
+            "error": ""
+        }
+    except Exception as e:
+        return {
+            "file_name": file,
+            "article": None,
+            "error": str(e)
+        }
+
+
+def file_hash(file: str) -> str:
+    """
+    sha256 of a file's content
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_args():
+    """
+    Parse args configurations for the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pdf_dir",
+        type=str,
+        default="../data/context/rsis/pdf",
+        help="directory of the downloaded pdfs",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="../data/context/rsis/data_2021.json",
+        help="json file to add the commentaries to",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    index_path = args.output_path.replace(".json", "_index.json")
+
+    article_list: List[Dict] = []
+    if os.path.exists(args.output_path):
+        with open(args.output_path, "r") as f:
+            article_list = json.load(f)
+
+    # sha256 of every pdf already extracted, including those that did not follow the structure
+    extracted_index: Dict[str, Dict[str, str]] = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            extracted_index = json.load(f)
+
+    # Articles in the output are matched by file name, they may have been extracted from another directory
+    extracted_names = {os.path.basename(article["file_name"]) for article in article_list}
+
+    file_list = sorted(glob.glob(f"{args.pdf_dir}/*.pdf"))
+    pending: Dict[str, str] = {}
+    pending_hashes: Set[str] = set()
+    for file in file_list:
+        digest = file_hash(file)
+        if digest in extracted_index or digest in pending_hashes:
+            continue
+        if os.path.basename(file) in extracted_names:
+            extracted_index[digest] = {
+                "file_name": file,
+                "status": "extracted"
+            }
+            continue
+        pending[file] = digest
+        pending_hashes.add(digest)
+    print(f"{len(file_list) - len(pending)} pdfs already extracted, {len(pending)} to extract")
+
+    extract_text_fails = 0
+    progress_bar = tqdm.tqdm(total=len(pending))
+    with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
+        for result in executor.map(extract_commentary, pending.keys(), chunksize=4):
+            if result["article"] is not None:
+                article_list.append(result["article"])
+                status = "extracted"
+            else:
+                extract_text_fails += 1
+                status = "error" if result["error"] != "" else "unstructured"
+
+            # Failed reads are retried on the next run, unstructured pdfs are not
+            if status != "error":
+                extracted_index[pending[result["file_name"]]] = {
+                    "file_name": result["file_name"],
+                    "status": status
+                }
+            progress_bar.update(1)
+
+    with open(args.output_path, "w") as f:
+        json.dump(article_list, f, indent=2)
+    with open(index_path, "w") as f:
+        json.dump(extracted_index, f, indent=2)
+
+    print(f"total articles: {len(article_list)}, fails: {extract_text_fails}")